@@ -0,0 +1,139 @@
+# Streaming training batches.
+#
+# Reads columnar datasets in shuffled, fixed-size batches of encoded boards and
+# scores, without loading a whole dataset or building any Board objects. Rows
+# are read a chunk of contiguous rows at a time, in a random order of chunks
+# across every dataset, and shuffled within a buffer of a few chunks, so memory
+# use is bounded by the buffer however large the datasets are.
+#
+# Author: Julia Kaeppel
+import numpy as np
+import os
+import sys
+import time
+from columnar import ColumnarDataSet
+from evaluator import CHANNELS, encode
+from typing import Iterator, Optional
+
+# Boards per batch
+BATCH_SIZE = 256
+
+# Contiguous rows read from a dataset at once
+CHUNK_SIZE = 4096
+
+# Chunks shuffled together
+BUFFER_CHUNKS = 8
+
+# Yields shuffled batches of (boards, scores) from one or more datasets.
+# boards is an encoded (n, 9, 9, CHANNELS) float32 array, as evaluator.encode,
+# and scores is an (n,) float32 array. Rows without a score are skipped.
+#
+# If mirror is set, each board is mirrored left to right with probability one
+# half. Quoridor is symmetric left to right, so a mirrored board keeps its
+# score. Every iteration over a reader is a fresh epoch, in a new order.
+class BatchReader:
+    # Opens datasets to read from. Each path must be a columnar dataset
+    # directory. Pickled DataSets must be converted with columnar.py first.
+    def __init__(self, paths: list[str], batch_size: int=BATCH_SIZE, shuffle: bool=True, \
+        mirror: bool=True, drop_remainder: bool=False, chunk_size: int=CHUNK_SIZE, \
+        buffer_chunks: int=BUFFER_CHUNKS, seed: Optional[int]=None):
+        self.datasets = [ColumnarDataSet(_columnar(path)) for path in paths]
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.mirror = mirror
+        self.drop_remainder = drop_remainder
+        self.chunk_size = chunk_size
+        self.buffer_chunks = buffer_chunks
+        self.rng = np.random.default_rng(seed)
+
+    # Total rows in every dataset, including rows without a score
+    def __len__(self) -> int:
+        return sum(len(dataset) for dataset in self.datasets)
+
+    def __iter__(self) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        chunks = [(dataset, start) for dataset in self.datasets \
+            for start in range(0, len(dataset), self.chunk_size)]
+        if self.shuffle:
+            chunks = [chunks[i] for i in self.rng.permutation(len(chunks))]
+
+        # Rows left over from the previous buffer, as (walls, pawns,
+        # wall_counts, p1_turn, scores) columns
+        rows = None
+        for i in range(0, len(chunks), self.buffer_chunks):
+            buffer = [_read_chunk(dataset, slice(start, start + self.chunk_size)) \
+                for dataset, start in chunks[i:i + self.buffer_chunks]]
+            if rows is not None:
+                buffer.append(rows)
+            rows = tuple(np.concatenate(column) for column in zip(*buffer))
+            if self.shuffle:
+                order = self.rng.permutation(len(rows[0]))
+                rows = tuple(column[order] for column in rows)
+
+            full = len(rows[0]) // self.batch_size * self.batch_size
+            for start in range(0, full, self.batch_size):
+                yield self.__batch(tuple(column[start:start + self.batch_size] \
+                    for column in rows))
+            rows = tuple(column[full:] for column in rows)
+
+        if rows is not None and len(rows[0]) > 0 and not self.drop_remainder:
+            yield self.__batch(rows)
+
+    # Encodes a batch of rows, mirroring a random half of them if asked to
+    def __batch(self, rows: tuple[np.ndarray, ...]) -> tuple[np.ndarray, np.ndarray]:
+        walls, pawns, wall_counts, p1_turn, scores = rows
+        if self.mirror:
+            walls, pawns = mirror(walls, pawns, self.rng.random(len(walls)) < 0.5)
+        return (encode(walls, pawns, wall_counts, p1_turn), scores)
+
+# Mirrors boards left to right where flip is set. walls and pawns are shaped
+# as for evaluator.encode. A wall in slot x moves to slot 7 - x, and a pawn in
+# column x moves to column 8 - x.
+def mirror(walls: np.ndarray, pawns: np.ndarray, flip: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    walls = np.where(flip[:, np.newaxis, np.newaxis, np.newaxis], walls[..., ::-1], walls)
+    pawns = pawns.copy()
+    pawns[flip, :, 0] = 8 - pawns[flip, :, 0]
+    return (walls, pawns)
+
+# Wraps a reader in a tf.data.Dataset. tensorflow is only imported when this is
+# called.
+def tf_dataset(reader: BatchReader):
+    import tensorflow as tf
+    return tf.data.Dataset.from_generator(lambda: iter(reader), output_signature=( \
+        tf.TensorSpec(shape=(None, 9, 9, CHANNELS), dtype=tf.float32), \
+        tf.TensorSpec(shape=(None,), dtype=tf.float32)))
+
+# Reads the scored rows of a slice of a dataset, as (walls, pawns, wall_counts,
+# p1_turn, scores) columns
+def _read_chunk(dataset: ColumnarDataSet, rows: slice) -> tuple[np.ndarray, ...]:
+    scores = np.asarray(dataset.scores[rows])
+    scored = ~np.isnan(scores)
+    return (dataset.walls(rows)[scored], dataset.pawns(rows)[scored], \
+        dataset.wall_counts(rows)[scored], dataset.p1_turn(rows)[scored], scores[scored])
+
+# Checks that a path is a columnar dataset directory, raising ValueError
+# otherwise. Datasets are never converted here, since that would write next to
+# the input and leave a stale copy behind if the pickle later changed.
+def _columnar(path: str) -> str:
+    if not os.path.isdir(path):
+        raise ValueError(f"{path} is not a columnar dataset directory. Convert pickled " \
+            "datasets first, with columnar.py or columnar.convert")
+    return path
+
+# Reads one epoch of every dataset given, printing throughput
+def main():
+    if len(sys.argv) < 2:
+        print(f"usage: python {sys.argv[0]} dataset... ")
+        return
+
+    reader = BatchReader(sys.argv[1:])
+    batches = 0
+    boards = 0
+    start = time.perf_counter()
+    for encoded, _ in reader:
+        batches += 1
+        boards += len(encoded)
+    elapsed = time.perf_counter() - start
+    print(f"{boards} boards in {batches} batches, {boards / elapsed:,.0f} boards/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+# Benchmark suite over fixed positions.
+#
+# Positions are drawn from a training dataset in three categories: openings
+# with at most 3 walls placed, midgames with 10 or more walls placed, and
+# endgames with the pawns next to each other, so jumps are possible. The same
+# dataset and seed always give the same positions.
+#
+# Move generation and pathfinding are reported in operations per second, and
+# search in nodes per second and time to reach each depth. Perft counts are
+# included so a faster move generator can't silently change which moves are
+# legal. Results are printed as JSON, and can be compared against an earlier
+# run with --baseline.
+#
+# Author: Julia Kaeppel
+import argparse
+import json
+import os
+import pickle
+import random
+import sys
+import time
+from quoridor import Board
+import minimax
+from perft import perft
+from serializable_board import encode_board
+import vectorized
+
+# Default dataset to draw positions from
+DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "datasets", \
+    "d1-10000.pickle")
+
+# Position categories, and whether a position belongs in each
+CATEGORIES = {
+    "opening": lambda state: 20 - state.p1_walls - state.p2_walls <= 3,
+    "midgame": lambda state: 20 - state.p1_walls - state.p2_walls >= 10 and \
+        abs(state.p1[0] - state.p2[0]) + abs(state.p1[1] - state.p2[1]) > 1,
+    "endgame": lambda state: abs(state.p1[0] - state.p2[0]) + \
+        abs(state.p1[1] - state.p2[1]) == 1,
+}
+
+# Draws count non-terminal positions of each category from a pickled dataset
+def load_positions(path: str, count: int, seed: int=0) -> dict[str, list[tuple[Board, bool]]]:
+    with open(path, "rb") as f:
+        dataset = pickle.load(f)
+    states = [key for key in list(dataset.valid) + list(dataset.unprocessed) \
+        if not key[0].terminal()]
+
+    # Sort by key so the draw doesn't depend on the dataset's order
+    states.sort(key=lambda key: key[0].key(key[1]))
+    rng = random.Random(seed)
+    positions = dict()
+    for category, matches in CATEGORIES.items():
+        candidates = [key for key in states if matches(key[0])]
+        positions[category] = rng.sample(candidates, min(count, len(candidates)))
+    return positions
+
+# Returns how many times per second a function can be called, calling it
+# repeatedly for at least min_time seconds
+def rate(fn, min_time: float) -> float:
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return calls / elapsed
+
+# Returns the rate of an operation over every position, in operations per
+# second, where op is called with each position in turn
+def rate_over(positions: list[tuple[Board, bool]], op, min_time: float) -> float:
+    def run():
+        for state, p1_turn in positions:
+            op(state, p1_turn)
+    return rate(run, min_time) * len(positions)
+
+# Drains the staged move generator, applying and undoing every move so walls
+# are checked for leaving a path
+def _legal_moves(state: Board, p1_turn: bool):
+    for move in state.moves(p1_turn):
+        if state.apply(move, p1_turn):
+            state.undo()
+
+# Places and removes every wall placement in turn, repairing distance fields
+def _wall_repairs(state: Board, p1_turn: bool):
+    for move in state.wall_moves(p1_turn):
+        if state.apply(move, p1_turn):
+            state.shortest_path(True)
+            state.shortest_path(False)
+            state.undo()
+
+# Benchmarks move generation, in positions per second
+def bench_movegen(positions: list[tuple[Board, bool]], min_time: float) -> dict:
+    return {
+        "adj_states": rate_over(positions, lambda state, p1_turn: state.adj_states(p1_turn), \
+            min_time),
+        "legal_moves": rate_over(positions, _legal_moves, min_time),
+    }
+
+# Benchmarks pathfinding. board_init builds a board from its bitboards,
+# computing both distance fields from scratch. wall_placements scores every
+# wall placement as a batch. wall_repairs places every wall in turn, repairing
+# both fields. All are in positions per second.
+def bench_paths(positions: list[tuple[Board, bool]], min_time: float) -> dict:
+    return {
+        "board_init": rate_over(positions, lambda state, _: Board.from_bits(state.h_walls, \
+            state.v_walls, state.p1, state.p2, state.p1_walls, state.p2_walls, eager=True), \
+            min_time),
+        "wall_placements": rate_over(positions, \
+            lambda state, _: vectorized.wall_placements(state), min_time),
+        "wall_repairs": rate_over(positions, _wall_repairs, min_time),
+    }
+
+# Benchmarks searching every position to each depth, with a fresh search each
+# time
+def bench_search(positions: list[tuple[Board, bool]], max_depth: int) -> dict:
+    results = dict()
+    for depth in range(1, max_depth + 1):
+        nodes = 0
+        start = time.perf_counter()
+        for state, p1_turn in positions:
+            search = minimax.Search()
+            minimax.negamax(state, depth, float("-inf"), float("+inf"), p1_turn, False, 0, search)
+            nodes += search.nodes
+        elapsed = time.perf_counter() - start
+        results[str(depth)] = {
+            "seconds": elapsed,
+            "nodes": nodes,
+            "nodes_per_second": nodes / elapsed,
+        }
+    return results
+
+# Runs every benchmark, returning the results as a dict
+def run(path: str=DATASET, count: int=8, seed: int=0, min_time: float=1.0, \
+    search_depth: int=3, perft_depth: int=2, perft_count: int=2) -> dict:
+    positions = load_positions(path, count, seed)
+    results = {
+        "dataset": os.path.basename(path),
+        "seed": seed,
+        "categories": dict(),
+    }
+    for category, states in positions.items():
+        results["categories"][category] = {
+            "positions": [encode_board(state, p1_turn).hex() for state, p1_turn in states],
+            "movegen": bench_movegen(states, min_time),
+            "paths": bench_paths(states, min_time),
+            "search": bench_search(states, search_depth),
+            "perft": {
+                "depth": perft_depth,
+                "counts": [perft(state, p1_turn, perft_depth) \
+                    for state, p1_turn in states[:perft_count]],
+            },
+        }
+    return results
+
+# Prints how each rate compares to a baseline run, returning whether every
+# perft count matches it
+def compare(results: dict, baseline: dict) -> bool:
+    ok = True
+    for category, current in results["categories"].items():
+        base = baseline["categories"].get(category)
+        if base is None:
+            continue
+        for group in ("movegen", "paths"):
+            for name, value in current[group].items():
+                if name in base[group]:
+                    print(f"{category} {name}: {value / base[group][name]:.2f}x")
+        for depth, value in current["search"].items():
+            if depth in base["search"]:
+                print(f"{category} search depth {depth}: " \
+                    f"{base['search'][depth]['seconds'] / value['seconds']:.2f}x")
+
+        # Perft counts are only comparable from the same positions
+        if current["positions"] == base["positions"] and \
+            current["perft"]["depth"] == base["perft"]["depth"]:
+            count = min(len(current["perft"]["counts"]), len(base["perft"]["counts"]))
+            if current["perft"]["counts"][:count] != base["perft"]["counts"][:count]:
+                print(f"{category} perft counts differ: {current['perft']['counts']} " \
+                    f"!= {base['perft']['counts']}")
+                ok = False
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks move generation, pathfinding " \
+        "and search on fixed positions.")
+    parser.add_argument("--dataset", default=DATASET, help="pickled dataset to draw positions from")
+    parser.add_argument("--count", type=int, default=8, help="positions per category")
+    parser.add_argument("--seed", type=int, default=0, help="seed for drawing positions")
+    parser.add_argument("--min-time", type=float, default=1.0, \
+        help="seconds to spend on each rate measurement")
+    parser.add_argument("--search-depth", type=int, default=3, help="deepest search to time")
+    parser.add_argument("--perft-depth", type=int, default=2, help="perft depth to check")
+    parser.add_argument("--perft-count", type=int, default=2, \
+        help="positions per category to run perft on")
+    parser.add_argument("--output", default=None, help="file to write JSON results to")
+    parser.add_argument("--baseline", default=None, help="JSON results to compare against")
+    args = parser.parse_args()
+
+    results = run(args.dataset, args.count, args.seed, args.min_time, args.search_depth, \
+        args.perft_depth, args.perft_count)
+    output = json.dumps(results, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            if not compare(results, json.load(f)):
+                sys.exit(1)
+
+if __name__ == "__main__":
+    main()
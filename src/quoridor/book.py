@@ -0,0 +1,136 @@
+# Opening book.
+#
+# Every game starts from the same position, so the first few moves are searched
+# offline, deeper than a bot could afford to during a game, and looked up by
+# Board.key instead.
+#
+# A book is stored as a .npy file holding a (2, n) uint64 array. The first row
+# holds position keys in ascending order, and the second row holds each
+# position's entry, with the move in the low 16 bits and the depth it was
+# searched to above them. Books are memory-mapped when loaded, so a lookup only
+# reads the pages its binary search touches.
+#
+# Author: Julia Kaeppel
+import argparse
+import numpy as np
+import os
+import time
+from quoridor import Board, WALL_MOVES
+from transposition import TranspositionTable
+from typing import Optional
+
+# Default book, shipped next to the datasets
+BOOK = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "datasets", \
+    "book.npy")
+
+# An opening book, memory-mapped from a file.
+class OpeningBook:
+    # Opens a book. Nothing is read until a position is looked up.
+    def __init__(self, path: str=BOOK):
+        book = np.load(path, mmap_mode="r")
+        if book.ndim != 2 or book.shape[0] != 2 or book.dtype != np.uint64:
+            raise ValueError(f"{path} is not an opening book")
+        self.keys = book[0]
+        self.entries = book[1]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    # Looks up a position, returning its (move, depth) entry, or None if it
+    # isn't in the book
+    def probe(self, state: Board, p1_turn: bool) -> Optional[tuple[int, int]]:
+        key = np.uint64(state.key(p1_turn))
+        i = int(np.searchsorted(self.keys, key))
+        if i == len(self.keys) or self.keys[i] != key:
+            return None
+        entry = int(self.entries[i])
+        return (entry & 0xffff, entry >> 16)
+
+    # Returns the book move of a position, or None if it isn't in the book. A
+    # move is only returned if it's legal, so a key collision can't make a bot
+    # play an illegal move.
+    def lookup(self, state: Board, p1_turn: bool) -> Optional[int]:
+        entry = self.probe(state, p1_turn)
+        if entry is None:
+            return None
+        move = entry[0]
+        if move < WALL_MOVES:
+            return move if move in state.pawn_moves(p1_turn) else None
+        if move not in state.wall_moves(p1_turn) or state.child(move, p1_turn) is None:
+            return None
+        return move
+
+# Searches every position up to plies moves into the game, returning a dict
+# from position key to (move, depth) entry. From each position, the book move
+# and the width best other moves by heuristic are followed, so the book covers
+# the replies an opponent is likely to play.
+def build(plies: int=4, depth: int=4, width: int=3, tt: Optional[TranspositionTable]=None, \
+    verbose: bool=False) -> dict[int, tuple[int, int]]:
+    # minimax looks moves up in books, so it's only imported once one is built
+    import minimax
+    if tt is None:
+        tt = TranspositionTable()
+    entries = dict()
+    positions = [(Board(), True)]
+    for ply in range(plies + 1):
+        start = time.perf_counter()
+        next_positions = []
+        for state, p1_turn in positions:
+            key = state.key(p1_turn)
+            if key in entries or state.terminal():
+                continue
+
+            tt.new_search()
+            _, move = minimax.search_node(state, depth, float("-inf"), float("+inf"), p1_turn, \
+                minimax.Search(tt))
+            entries[key] = (move, depth)
+            if ply < plies:
+                next_positions += [(state.child(reply, p1_turn), not p1_turn) \
+                    for reply in _replies(state, p1_turn, move, width)]
+        positions = next_positions
+        if verbose:
+            print(f"ply {ply}: {len(entries)} positions, {time.perf_counter() - start:.1f}s")
+    return entries
+
+# Writes a book's entries to a file
+def save(entries: dict[int, tuple[int, int]], path: str):
+    keys = np.array(sorted(entries), dtype=np.uint64)
+    book = np.empty((2, len(keys)), dtype=np.uint64)
+    book[0] = keys
+    book[1] = [entries[key][0] | entries[key][1] << 16 for key in keys.tolist()]
+
+    # Write to a temporary file first, so bots never load a partial book
+    np.save(path + ".tmp.npy", book)
+    os.replace(path + ".tmp.npy", path)
+
+# Returns the moves to follow from a book position: its book move, and the
+# width best other legal moves by heuristic, in move order among ties
+def _replies(state: Board, p1_turn: bool, move: int, width: int) -> list[int]:
+    import minimax
+    color = 1 if p1_turn else -1
+    scored = []
+    for reply in state.moves(p1_turn):
+        if reply == move or not state.apply(reply, p1_turn):
+            continue
+        try:
+            scored.append((color * minimax.heuristic(state), reply))
+        finally:
+            state.undo()
+    scored.sort(key=lambda score: -score[0])
+    return [move] + [reply for _, reply in scored[:width]]
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds an opening book.")
+    parser.add_argument("--plies", type=int, default=4, help="moves into the game to cover")
+    parser.add_argument("--depth", type=int, default=4, help="depth to search each position to")
+    parser.add_argument("--width", type=int, default=3, \
+        help="moves besides the book move to follow from each position")
+    parser.add_argument("--output", default=BOOK, help="file to write the book to")
+    args = parser.parse_args()
+
+    entries = build(args.plies, args.depth, args.width, verbose=True)
+    save(entries, args.output)
+    print(f"{len(entries)} positions -> {args.output}")
+
+if __name__ == "__main__":
+    main()
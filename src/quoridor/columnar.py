@@ -0,0 +1,103 @@
+# Columnar on-disk format for training data.
+#
+# A columnar dataset is a directory of .npy files, one per column, each with a
+# row for every valid state of a DataSet:
+#
+# boards.npy: Boards in the binary board format, as serializable_board's
+# BOARD_DTYPE. The turn is stored in the flags field.
+# scores.npy: float32 scores, NaN where a state has none.
+# score_prio.npy: uint16 score priorities.
+#
+# The columns are memory-mapped when loaded, so batches can be sliced out of
+# them without reading the whole file or building any Board objects.
+#
+# Author: Julia Kaeppel
+import numpy as np
+import os
+import pickle
+import sys
+from quoridor import Board
+from serializable_board import BOARD_DTYPE, BOARD_SIZE, decode_board, encode_boards
+
+# Column file names
+_BOARDS = "boards.npy"
+_SCORES = "scores.npy"
+_SCORE_PRIO = "score_prio.npy"
+
+# A columnar dataset, memory-mapped from a directory.
+class ColumnarDataSet:
+    # Opens a columnar dataset. Nothing is read until it's sliced.
+    def __init__(self, directory: str):
+        self.boards = np.load(os.path.join(directory, _BOARDS), mmap_mode="r")
+        self.scores = np.load(os.path.join(directory, _SCORES), mmap_mode="r")
+        self.score_prio = np.load(os.path.join(directory, _SCORE_PRIO), mmap_mode="r")
+        if not len(self.boards) == len(self.scores) == len(self.score_prio):
+            raise ValueError(f"columns of {directory} have different lengths")
+
+    def __len__(self) -> int:
+        return len(self.boards)
+
+    # Returns the turn flags of a slice of rows
+    def p1_turn(self, rows: slice=slice(None)) -> np.ndarray:
+        return (self.boards["flags"][rows] & 1).astype(bool)
+
+    # Returns the walls of a slice of rows, as a (n, 2, 8, 8) bool array
+    # indexed the same way as Board.walls
+    def walls(self, rows: slice=slice(None)) -> np.ndarray:
+        raw = np.ascontiguousarray(self.boards[rows]).view(np.uint8).reshape(-1, BOARD_SIZE)
+        bits = np.unpackbits(raw[:, :16], axis=1, bitorder="little")
+        return bits.astype(bool).reshape(-1, 2, 8, 8)
+
+    # Returns the pawn positions of a slice of rows, as a (n, 2, 2) array of
+    # (x, y) for player 1 and player 2
+    def pawns(self, rows: slice=slice(None)) -> np.ndarray:
+        boards = self.boards[rows]
+        cells = np.stack([boards["p1"], boards["p2"]], axis=1)
+        return np.stack([cells % 9, cells // 9], axis=2)
+
+    # Returns the remaining walls of a slice of rows, as a (n, 2) array for
+    # player 1 and player 2
+    def wall_counts(self, rows: slice=slice(None)) -> np.ndarray:
+        walls = self.boards["walls"][rows]
+        return np.stack([walls & 0xf, walls >> 4], axis=1)
+
+    # Builds the Board of a single row, and whether it's player 1's turn
+    def board(self, row: int) -> tuple[Board, bool]:
+        return decode_board(self.boards[row:row + 1].tobytes())
+
+# Writes the valid states of a DataSet to a columnar dataset directory.
+# Existing columns are replaced.
+def export(dataset, directory: str):
+    os.makedirs(directory, exist_ok=True)
+    items = list(dataset.valid.items())
+
+    boards = np.frombuffer(encode_boards(key for key, _ in items), dtype=BOARD_DTYPE)
+    scores = np.array([np.nan if info.score is None else info.score for _, info in items], \
+        dtype=np.float32)
+    score_prio = np.array([info.score_prio for _, info in items], dtype=np.uint16)
+
+    for name, column in ((_BOARDS, boards), (_SCORES, scores), (_SCORE_PRIO, score_prio)):
+        # Write to a temporary file first, so readers never see a partial column
+        path = os.path.join(directory, name)
+        np.save(path + ".tmp.npy", column)
+        os.replace(path + ".tmp.npy", path)
+
+# Converts a pickled DataSet to a columnar dataset directory.
+def convert(pickle_file: str, directory: str):
+    with open(pickle_file, "rb") as f:
+        dataset = pickle.load(f)
+    export(dataset, directory)
+
+def main():
+    if len(sys.argv) < 2:
+        print(f"usage: python {sys.argv[0]} dataset.pickle... ")
+        return
+
+    # Write each dataset next to its pickle
+    for pickle_file in sys.argv[1:]:
+        directory = os.path.splitext(pickle_file)[0]
+        convert(pickle_file, directory)
+        print(f"{pickle_file} -> {directory} ({len(ColumnarDataSet(directory))} states)")
+
+if __name__ == "__main__":
+    main()
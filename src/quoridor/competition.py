@@ -1,69 +1,358 @@
 # Program to run a competition between two Quoridor bots.
 #
+# Bots are started once per game with --serve and sent every move of the game
+# over persistent pipes. Each bot is asked for one warm-up move before the game
+# starts, with STARTUP_TIME seconds to answer, so --move-time doesn't count its
+# startup. Pass --spawn to instead start a new process for every move, for
+# bots without a serve mode.
+#
+# With --games, a tournament of many games is played, several at once, with
+# sides assigned from --seed. Aggregate win rates, the Elo difference between
+# the programs and move latency percentiles are printed at the end.
+#
+# With --stats-log, every line of JSON a bot writes to stderr during a move,
+# such as julia_bot.py's --stats output, is appended to a log file as a JSON
+# line tagged with the game, turn and program.
+#
 # Author: Julia Kaeppel
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import math
+import os
+import pickle
+import select
 import subprocess
 import sys
+import threading
+import time
 import numpy as np
-from serializable_board import SerializableBoard
+from serializable_board import SerializableBoard, split_frame
 from quoridor import Board
 import random
+from typing import Optional
+
+# Turns after which a game is declared a draw
+MAX_TURNS = 400
+
+# Seconds a served bot may take to start up and answer its warm-up move
+STARTUP_TIME = 60.0
+
+# Raised when a bot takes longer than the move time limit
+class MoveTimeout(Exception):
+    pass
+
+# Errors which cost a bot the game: running out of time, exiting, which breaks
+# the pipe to it, or answering with a malformed board
+_FORFEITS = (MoveTimeout, EOFError, OSError, ValueError, pickle.UnpicklingError)
+
+# A bot program playing in a game.
+class Player:
+    # Creates a player from a program and its args. If serve is set, the
+    # program is started now in serve mode and kept running until closed. If
+    # pickled is set, boards are exchanged pickled rather than in the binary
+    # board format. If capture_stats is set, the bot's stderr is captured and
+    # the JSON lines it writes during each move are kept in stats.
+    def __init__(self, args: list[str], serve: bool=True, pickled: bool=False, \
+        capture_stats: bool=False):
+        self.args = args
+        self.pickled = pickled
+        self.stderr = subprocess.PIPE if capture_stats else None
+        self.stats = []
+        self.partial = b""
+        self.buffer = b""
+        self.proc = None
+        if serve:
+            self.proc = subprocess.Popen(args + ["--serve"], stdin=subprocess.PIPE, \
+                stdout=subprocess.PIPE, stderr=self.stderr)
+
+    # Waits for a serving bot to start up, by asking it for a move from the
+    # starting position and discarding the answer, so its interpreter startup
+    # and imports aren't counted against its first move. The warm-up move gets
+    # its own, generous timeout, so a bot which hangs while starting still
+    # raises MoveTimeout. Does nothing for spawned bots.
+    def warm_up(self, timeout: float=STARTUP_TIME):
+        if self.proc is not None:
+            self.move(start_board(), timeout)
+
+    # Asks the bot for its move, waiting at most timeout seconds if given.
+    def move(self, board: SerializableBoard, timeout: Optional[float]=None) -> SerializableBoard:
+        self.stats = []
+        if self.proc is None:
+            proc = subprocess.Popen(self.args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, \
+                stderr=self.stderr)
+            try:
+                output, errors = proc.communicate(board.write_board(self.pickled), timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+                raise MoveTimeout(f"{self.args[0]} ran out of time")
+            if errors:
+                self.__read_stats(errors + b"\n")
+            return SerializableBoard.read_board(output, self.pickled)
+
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        try:
+            board.write_frame(self.proc.stdin, self.pickled)
+        except BrokenPipeError:
+            raise EOFError(f"{self.args[0]} exited during the game")
+        board = SerializableBoard.read_board(self.__read_frame(deadline), self.pickled)
+
+        # Collect whatever the bot wrote to stderr before answering
+        if self.proc.stderr is not None:
+            fd = self.proc.stderr.fileno()
+            errors = b""
+            while select.select([fd], [], [], 0)[0]:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    break
+                errors += chunk
+            self.__read_stats(errors)
+        return board
+
+    # Reads the bot's next frame, raising MoveTimeout if all of it hasn't
+    # arrived by the deadline. The pipe is read directly rather than through a
+    # buffered stream, so a bot which stalls partway through a frame still runs
+    # out of time. Bytes after the frame are kept for the next one.
+    def __read_frame(self, deadline: Optional[float]) -> bytes:
+        fd = self.proc.stdout.fileno()
+        while True:
+            frame = split_frame(self.buffer)
+            if frame is not None:
+                data, self.buffer = frame
+                return data
+
+            timeout = None if deadline is None else max(deadline - time.perf_counter(), 0)
+            if not select.select([fd], [], [], timeout)[0]:
+                raise MoveTimeout(f"{self.args[0]} ran out of time")
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise EOFError(f"{self.args[0]} exited during the game")
+            self.buffer += chunk
+
+    # Keeps the JSON lines of a bot's stderr output as stats, passing any other
+    # lines on to our own stderr. An unfinished last line is kept for later.
+    def __read_stats(self, errors: bytes):
+        lines = (self.partial + errors).split(b"\n")
+        self.partial = lines.pop()
+        for line in lines:
+            try:
+                self.stats.append(json.loads(line))
+            except ValueError:
+                if line:
+                    sys.stderr.buffer.write(line + b"\n")
+
+    # Stops the bot's process, if it's running. Bots which don't exit once
+    # their input is closed are killed.
+    def close(self):
+        if self.proc is not None:
+            try:
+                self.proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            try:
+                self.proc.wait(1)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+            self.proc = None
+
+# Returns the starting position, with player 1 to move
+def start_board() -> SerializableBoard:
+    return SerializableBoard(np.full(shape=(2, 8, 8), fill_value=False, dtype=bool), \
+        (4, 0), (4, 8), 10, 10, True)
+
+# Outcome of a game between two programs.
+#
+# winner: Index of the winning program, or None for a draw.
+# turns: Number of moves played.
+# reason: How the game ended.
+# latencies: Seconds taken by each move, for each program.
+class GameResult:
+    def __init__(self, winner: Optional[int], turns: int, reason: str, \
+        latencies: tuple[list[float], list[float]]):
+        self.winner = winner
+        self.turns = turns
+        self.reason = reason
+        self.latencies = latencies
+
+# Appends JSON lines to a log file, from any number of threads.
+class StatsLog:
+    def __init__(self, path: str):
+        self.file = open(path, "a")
+        self.lock = threading.Lock()
+
+    # Writes a record as a line of JSON.
+    def write(self, record: dict):
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+# Plays a game between two programs, given as lists of args. If swap is set,
+# the second program plays as player 1. A program which exceeds the move time
+# limit, exits or answers with a malformed board loses the game. If a stats log
+# is given, the stats each bot reports are written to it, tagged with game.
+def play_game(programs: tuple[list[str], list[str]], swap: bool, serve: bool=True, \
+    move_time: Optional[float]=None, verbose: bool=False, pickled: bool=False, \
+    stats_log: Optional[StatsLog]=None, game: int=0) -> GameResult:
+    order = (1, 0) if swap else (0, 1)
+    latencies = ([], [])
+    players = []
+    try:
+        for index in order:
+            players.append(Player(programs[index], serve, pickled, stats_log is not None))
+
+        # Let every bot start up before any move is timed
+        for turn, player in enumerate(players):
+            try:
+                player.warm_up()
+            except _FORFEITS as e:
+                return GameResult(1 - order[turn], 0, str(e), latencies)
+
+        # Create board
+        board = start_board()
+
+        for turn in range(MAX_TURNS):
+            p1_turn = turn % 2 == 0
+            index = order[turn % 2]
+
+            # Run the player's program
+            board.p1_turn = p1_turn
+            start = time.perf_counter()
+            try:
+                board = players[turn % 2].move(board, move_time)
+            except _FORFEITS as e:
+                return GameResult(1 - index, turn, str(e), latencies)
+            latencies[index].append(time.perf_counter() - start)
+            if stats_log is not None:
+                for stats in players[turn % 2].stats:
+                    stats_log.write({"game": game, "turn": turn, "player": turn % 2 + 1, \
+                        "program": " ".join(programs[index]), "latency": latencies[index][-1], \
+                        "stats": stats})
+
+            # Display board
+            if verbose:
+                print(Board(board.walls, board.p1, board.p2, board.p1_walls, board.p2_walls))
+
+            # Check for win state
+            if (p1_turn and board.p1[1] == 8) or (not p1_turn and board.p2[1] == 0):
+                return GameResult(index, turn + 1, "reached goal", latencies)
+
+        return GameResult(None, MAX_TURNS, "turn limit", latencies)
+    finally:
+        for player in players:
+            player.close()
+
+# Plays a tournament of games between two programs, several at once. Sides are
+# shuffled from the seed, with each program playing as player 1 in half the
+# games.
+def tournament(programs: tuple[list[str], list[str]], games: int, jobs: int, seed: int, \
+    serve: bool=True, move_time: Optional[float]=None, verbose: bool=False, \
+    pickled: bool=False, stats_log: Optional[StatsLog]=None) -> list[GameResult]:
+    swaps = [i % 2 == 1 for i in range(games)]
+    random.Random(seed).shuffle(swaps)
+
+    with ThreadPoolExecutor(jobs) as executor:
+        futures = [executor.submit(play_game, programs, swap, serve, move_time, verbose, \
+            pickled, stats_log, game) for game, swap in enumerate(swaps)]
+        results = []
+        for i, future in enumerate(futures):
+            results.append(future.result())
+            if verbose:
+                print(f"game {i + 1}: {results[-1].reason}, {results[-1].turns} turns")
+        return results
+
+# Converts an expected score to an Elo difference
+def elo(score: float) -> float:
+    if score <= 0:
+        return float("-inf")
+    if score >= 1:
+        return float("+inf")
+    return 400 * math.log10(score / (1 - score))
+
+# Returns the Elo difference of the first program over the second, and the
+# bounds of its 95% confidence interval
+def elo_interval(results: list[GameResult]) -> tuple[float, float, float]:
+    scores = np.array([0.5 if r.winner is None else float(r.winner == 0) for r in results])
+    mean = float(scores.mean())
+    margin = 1.96 * float(scores.std()) / math.sqrt(len(scores))
+    return (elo(mean), elo(mean - margin), elo(mean + margin))
+
+# Prints aggregate results of a tournament
+def print_summary(programs: tuple[list[str], list[str]], results: list[GameResult]):
+    games = len(results)
+    draws = sum(r.winner is None for r in results)
+    print(f"{games} games, {draws} draws")
+    for index, program in enumerate(programs):
+        wins = sum(r.winner == index for r in results)
+        print(f"{' '.join(program)}: {wins} wins ({100 * wins / games:.1f}%)")
+
+    diff, low, high = elo_interval(results)
+    print(f"Elo difference: {diff:+.1f} (95% CI {low:+.1f} to {high:+.1f})")
+
+    for index, program in enumerate(programs):
+        latencies = np.array([t for r in results for t in r.latencies[index]]) * 1000
+        if len(latencies) == 0:
+            continue
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        print(f"{' '.join(program)} move latency: p50 {p50:.1f}ms, p90 {p90:.1f}ms, " \
+            f"p99 {p99:.1f}ms, max {latencies.max():.1f}ms")
 
 def main():
     # Read commandline args
-    if len(sys.argv) < 5 or len(sys.argv) != 5 + int(sys.argv[2]) + int(sys.argv[4]):
-        print(f"usage: python {sys.argv[0]} program1 program1_nargs program2 program2_nargs [program1_args...] [program2_args...]")
-        return
-    
-    program1_file = sys.argv[1]
-    program2_file = sys.argv[3]
-    program1_nargs = int(sys.argv[2])
-    program2_nargs = int(sys.argv[4])
-    program1_args = sys.argv[5:5+program1_nargs]
-    program2_args = sys.argv[5+program1_nargs:5+program1_nargs+program2_nargs]
-
-    # Pick player 1 and 2
-    if random.randrange(0, 2) == 0:
-        player1_args = [program1_file] + program1_args
-        player2_args = [program2_file] + program2_args
-    else:
-        player1_args = [program2_file] + program2_args
-        player2_args = [program1_file] + program1_args
-    
-    # Create board
-    board = SerializableBoard(np.full(shape=(2, 8, 8), fill_value=False, dtype=bool), \
-        (4, 0), (4, 8), 10, 10, True)
-    
-    # Game loop
-    while True:
-        # Run player 1 program
-        board.p1_turn = True
-        player1_proc = subprocess.Popen(player1_args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-        player1_board, _ = player1_proc.communicate(board.write_board())
-        board = SerializableBoard.read_board(player1_board)
-
-        # Display board
-        display_board = Board(board.walls, board.p1, board.p2, board.p1_walls, board.p2_walls)
-        print(display_board)
-
-        # Check for win state
-        if board.p1[1] == 8:
-            print(f"{player1_args[0]} wins!")
-            break
-
-        # Run player 2 program
-        board.p1_turn = False
-        player2_proc = subprocess.Popen(player2_args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-        player2_board, _ = player2_proc.communicate(board.write_board())
-        board = SerializableBoard.read_board(player2_board)
-
-        # Display board
-        display_board = Board(board.walls, board.p1, board.p2, board.p1_walls, board.p2_walls)
-        print(display_board)
-
-        # Check for win state
-        if board.p2[1] == 0:
-            print(f"{player2_args[0]} wins!")
-            break
+    parser = argparse.ArgumentParser(description="Runs games between two Quoridor bots.")
+    parser.add_argument("--spawn", action="store_true", \
+        help="start a new process for every move instead of using --serve")
+    parser.add_argument("--games", type=int, default=None, \
+        help="play a tournament of this many games")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), \
+        help="games to play at once in a tournament")
+    parser.add_argument("--seed", type=int, default=None, help="seed for side assignment")
+    parser.add_argument("--move-time", type=float, default=None, \
+        help="seconds a bot may take per move before forfeiting")
+    parser.add_argument("--verbose", action="store_true", help="print every board")
+    parser.add_argument("--pickle", action="store_true", \
+        help="exchange pickled boards, for bots without the binary board format. " \
+            "julia_bot.py only accepts them when run with --pickle")
+    parser.add_argument("--stats-log", default=None, \
+        help="append the JSON stats bots write to stderr to this file")
+    parser.add_argument("program1")
+    parser.add_argument("program1_nargs", type=int)
+    parser.add_argument("program2")
+    parser.add_argument("program2_nargs", type=int)
+    parser.add_argument("args", nargs=argparse.REMAINDER, \
+        help="program1's args followed by program2's args")
+    args = parser.parse_args()
+    if len(args.args) != args.program1_nargs + args.program2_nargs:
+        parser.error("wrong number of program args")
+
+    programs = ([args.program1] + args.args[:args.program1_nargs], \
+        [args.program2] + args.args[args.program1_nargs:])
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+
+    stats_log = None if args.stats_log is None else StatsLog(args.stats_log)
+    try:
+        # Play a single game, showing every board
+        if args.games is None:
+            result = play_game(programs, random.Random(seed).randrange(0, 2) == 0, \
+                not args.spawn, args.move_time, True, args.pickle, stats_log)
+            if result.winner is None:
+                print("Draw!")
+            else:
+                print(f"{programs[result.winner][0]} wins! ({result.reason})")
+            return
+
+        results = tournament(programs, args.games, args.jobs, seed, not args.spawn, \
+            args.move_time, args.verbose, args.pickle, stats_log)
+        print(f"seed {seed}")
+        print_summary(programs, results)
+    finally:
+        if stats_log is not None:
+            stats_log.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,120 @@
+# Endgame solver for pawn races.
+#
+# Once neither player has a wall left, the walls on the board are fixed and the
+# only moves left are pawn moves, so a position has at most 81 * 81 * 2 pawn
+# placements reachable from it. These are solved exactly by retrograde
+# analysis, jumps included, which is far cheaper than searching the race move by
+# move.
+#
+# Author: Julia Kaeppel
+from collections import deque
+from quoridor import Board
+from typing import Optional
+
+# (x, y) position of each cell
+_CELLS = tuple((cell % 9, cell // 9) for cell in range(81))
+
+# Outcome of a solved position, for the player to move.
+#
+# win: Whether the player to move wins with best play.
+# plies: Plies until the game ends with best play. The winner takes the
+# fastest win, and the loser the slowest loss.
+# move: Best move, as a pawn move's destination cell. None if the position is
+# already terminal.
+class Solution:
+    def __init__(self, win: bool, plies: int, move: Optional[int]):
+        self.win = win
+        self.plies = plies
+        self.move = move
+
+# Returns whether a position is a pawn race, with no walls left to place
+def is_race(state: Board) -> bool:
+    return state.p1_walls == 0 and state.p2_walls == 0
+
+# Solves a pawn race, returning the outcome for the player to move, or None if
+# the position isn't a race or neither player can force a win.
+def solve(state: Board, p1_turn: bool) -> Optional[Solution]:
+    if not is_race(state):
+        return None
+
+    # Positions are indexed by pawn cells and turn. A scratch board is moved
+    # around to generate each position's pawn moves, which only depend on the
+    # walls and pawn cells.
+    scratch = Board.from_bits(state.h_walls, state.v_walls, state.p1, state.p2, 0, 0)
+    root = _index(_cell(state.p1), _cell(state.p2), p1_turn)
+    successors = dict()
+    predecessors = dict()
+    queue = deque()
+    outcomes = dict()
+    pending = dict()
+
+    # Find every reachable position. Terminal positions are lost by the player
+    # to move, since the other player has just reached their goal.
+    frontier = [root]
+    successors[root] = None
+    while frontier:
+        index = frontier.pop()
+        p1, p2, turn = _unindex(index)
+        if p1 // 9 == 8 or p2 // 9 == 0:
+            outcomes[index] = (False, 0)
+            queue.append(index)
+            continue
+
+        scratch.p1, scratch.p2 = _CELLS[p1], _CELLS[p2]
+        children = []
+        for cell in scratch.pawn_moves(turn):
+            child = _index(cell, p2, False) if turn else _index(p1, cell, True)
+            children.append(child)
+            predecessors.setdefault(child, []).append(index)
+            if child not in successors:
+                successors[child] = None
+                frontier.append(child)
+        successors[index] = children
+        pending[index] = len(children)
+
+    # Work back from terminal positions in order of distance. A position is won
+    # once any child is lost, and lost once every child is won.
+    while queue:
+        index = queue.popleft()
+        win, plies = outcomes[index]
+        for parent in predecessors.get(index, ()):
+            if parent in outcomes:
+                continue
+            if not win:
+                outcomes[parent] = (True, plies + 1)
+                queue.append(parent)
+                continue
+            pending[parent] -= 1
+            if pending[parent] == 0:
+                outcomes[parent] = (False, plies + 1)
+                queue.append(parent)
+
+    # Positions left unsolved can be drawn out forever
+    outcome = outcomes.get(root)
+    if outcome is None:
+        return None
+    win, plies = outcome
+    if plies == 0:
+        return Solution(win, plies, None)
+
+    # Win as fast as possible, or lose as slowly as possible
+    for child in successors[root]:
+        if outcomes.get(child) == (not win, plies - 1):
+            break
+    p1, p2, _ = _unindex(child)
+    return Solution(win, plies, p1 if p1_turn else p2)
+
+# Returns the best move of a pawn race, or None if it has none
+def best_move(state: Board, p1_turn: bool) -> Optional[int]:
+    solution = solve(state, p1_turn)
+    return None if solution is None else solution.move
+
+def _cell(pos: tuple[int, int]) -> int:
+    return pos[1] * 9 + pos[0]
+
+def _index(p1: int, p2: int, p1_turn: bool) -> int:
+    return (p1 * 81 + p2) * 2 + p1_turn
+
+def _unindex(index: int) -> tuple[int, int, bool]:
+    cells, turn = divmod(index, 2)
+    return (cells // 81, cells % 81, turn == 1)
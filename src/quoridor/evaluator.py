@@ -0,0 +1,135 @@
+# Pluggable position evaluators for negamax.
+#
+# Author: Julia Kaeppel
+from abc import ABC, abstractmethod
+import numpy as np
+from quoridor import Board, WALL_MOVES
+from typing import Callable, Union
+
+# Number of channels in an encoded board
+CHANNELS = 7
+
+# Scores board states for negamax. Scores are from player 1's point of view,
+# the same as minimax.heuristic: positive when player 1 is ahead. Subclasses
+# must implement evaluate, and can't be created until they do.
+class Evaluator(ABC):
+    # Scores a single state, given whose turn it is.
+    @abstractmethod
+    def evaluate(self, state: Board, p1_turn: bool) -> float:
+        pass
+
+    # Scores the children reached by playing each of a list of moves from a
+    # state, returning an array of scores. None of the children may be
+    # terminal. By default each child is scored on its own.
+    def evaluate_moves(self, state: Board, p1_turn: bool, moves: list[int]) -> np.ndarray:
+        scores = np.empty(len(moves))
+        for i, move in enumerate(moves):
+            state.apply(move, p1_turn)
+            try:
+                scores[i] = self.evaluate(state, not p1_turn)
+            finally:
+                state.undo()
+        return scores
+
+    # Scores a list of unrelated states and whose turn it is in each,
+    # returning an array of scores. By default each state is scored on its
+    # own.
+    def evaluate_states(self, states: list[tuple[Board, bool]]) -> np.ndarray:
+        return np.array([self.evaluate(state, p1_turn) for state, p1_turn in states], \
+            dtype=np.float64)
+
+# Compares the shortest path distances of the two pawns. This is the default,
+# and negamax scores its frontier nodes in a faster, specialized way.
+class DistanceEvaluator(Evaluator):
+    def evaluate(self, state: Board, p1_turn: bool) -> float:
+        return state.p2_dist - state.p1_dist
+
+# Scores states with a neural network. The model takes a batch of boards
+# encoded by encode, and returns one score for each.
+#
+# The model may be a callable, or the path of a saved Keras model. A path is
+# only loaded, and tensorflow only imported, once the first state is scored,
+# so bots which never use the evaluator don't pay for it.
+class ModelEvaluator(Evaluator):
+    def __init__(self, model: Union[str, Callable[[np.ndarray], np.ndarray]]):
+        self.path = model if isinstance(model, str) else None
+        self.model = None if isinstance(model, str) else model
+        self.calls = 0
+
+    def evaluate(self, state: Board, p1_turn: bool) -> float:
+        return float(self.predict(encode_states([(state, p1_turn)]))[0])
+
+    # Scores every child in one model call
+    def evaluate_moves(self, state: Board, p1_turn: bool, moves: list[int]) -> np.ndarray:
+        return self.predict(encode_moves(state, p1_turn, moves))
+
+    # Scores every state in one model call
+    def evaluate_states(self, states: list[tuple[Board, bool]]) -> np.ndarray:
+        return self.predict(encode_states(states))
+
+    # Runs the model on a batch of encoded boards
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        if self.model is None:
+            self.model = _load_model(self.path)
+        self.calls += 1
+        return np.asarray(self.model(batch), dtype=np.float64).reshape(-1)
+
+# Encodes a batch of boards for a model, as a (n, 9, 9, CHANNELS) float32
+# array indexed by y, then x, then channel. The inputs are shaped like those of
+# columnar.ColumnarDataSet, so dataset slices can be encoded directly.
+#
+# walls: (n, 2, 8, 8) bool walls arrays, as Board.walls.
+# pawns: (n, 2, 2) (x, y) positions of player 1's and player 2's pawns.
+# wall_counts: (n, 2) remaining walls of player 1 and player 2.
+# p1_turn: (n,) whether it's player 1's turn.
+#
+# Channels 0 and 1 hold horizontal and vertical walls, padded to 9x9. Channels
+# 2 and 3 hold one-hot pawn positions. Channels 4 and 5 hold each player's
+# remaining walls out of 10, and channel 6 is set on player 1's turn.
+def encode(walls: np.ndarray, pawns: np.ndarray, wall_counts: np.ndarray, \
+    p1_turn: np.ndarray) -> np.ndarray:
+    n = len(walls)
+    boards = np.arange(n)
+    batch = np.zeros((n, 9, 9, CHANNELS), dtype=np.float32)
+    batch[:, :8, :8, 0] = walls[:, 0]
+    batch[:, :8, :8, 1] = walls[:, 1]
+    batch[boards, pawns[:, 0, 1], pawns[:, 0, 0], 2] = 1
+    batch[boards, pawns[:, 1, 1], pawns[:, 1, 0], 3] = 1
+    batch[..., 4] = wall_counts[:, 0, np.newaxis, np.newaxis] / 10
+    batch[..., 5] = wall_counts[:, 1, np.newaxis, np.newaxis] / 10
+    batch[..., 6] = p1_turn[:, np.newaxis, np.newaxis]
+    return batch
+
+# Encodes the children reached by playing each of a list of moves from a
+# state, without building any child boards
+def encode_moves(state: Board, p1_turn: bool, moves: list[int]) -> np.ndarray:
+    n = len(moves)
+    moves = np.asarray(moves, dtype=np.int64)
+    is_wall = moves >= WALL_MOVES
+    mover = 0 if p1_turn else 1
+
+    walls = np.repeat(state.walls.reshape(1, 128), n, axis=0)
+    walls[np.flatnonzero(is_wall), moves[is_wall] - WALL_MOVES] = True
+
+    pawns = np.repeat(np.array([[state.p1, state.p2]]), n, axis=0)
+    cells = moves[~is_wall]
+    pawns[~is_wall, mover, 0] = cells % 9
+    pawns[~is_wall, mover, 1] = cells // 9
+
+    wall_counts = np.repeat(np.array([[state.p1_walls, state.p2_walls]]), n, axis=0)
+    wall_counts[is_wall, mover] -= 1
+
+    return encode(walls.reshape(n, 2, 8, 8), pawns, wall_counts, np.full(n, not p1_turn))
+
+# Encodes a list of states and whose turn it is in each
+def encode_states(states: list[tuple[Board, bool]]) -> np.ndarray:
+    walls = np.array([state.walls for state, _ in states]).reshape(-1, 2, 8, 8)
+    pawns = np.array([[state.p1, state.p2] for state, _ in states]).reshape(-1, 2, 2)
+    wall_counts = np.array([[state.p1_walls, state.p2_walls] for state, _ in states]).reshape(-1, 2)
+    return encode(walls, pawns, wall_counts, np.array([p1_turn for _, p1_turn in states], dtype=bool))
+
+# Loads a saved Keras model, returning a function which runs it on a batch
+def _load_model(path: str) -> Callable[[np.ndarray], np.ndarray]:
+    import tensorflow as tf
+    model = tf.keras.models.load_model(path)
+    return lambda batch: model(batch, training=False).numpy()
@@ -0,0 +1,124 @@
+# Indexed set for constant time random sampling.
+#
+# Author: Julia Kaeppel
+import random
+import sys
+import time
+from typing import Any, Hashable, Iterator, Optional
+
+# A mapping which can also sample a uniformly random key in constant time.
+#
+# Keys and values are stored in dense lists, with a dict from each key to its
+# index. Deleting swaps the last entry into the deleted entry's place, so
+# inserting, deleting, looking up and sampling are all O(1). Iteration order is
+# insertion order until something is deleted.
+class IndexedSet:
+    # Creates an indexed set, optionally from the items of a dict.
+    def __init__(self, items: Optional[dict]=None):
+        self._index = dict()
+        self._keys = []
+        self._values = []
+        if items is not None:
+            for key, value in items.items():
+                self[key] = value
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._index
+
+    def __getitem__(self, key: Hashable) -> Any:
+        return self._values[self._index[key]]
+
+    def __setitem__(self, key: Hashable, value: Any):
+        i = self._index.get(key)
+        if i is None:
+            self._index[key] = len(self._keys)
+            self._keys.append(key)
+            self._values.append(value)
+        else:
+            self._values[i] = value
+
+    def __delitem__(self, key: Hashable):
+        i = self._index.pop(key)
+
+        # Move the last entry into the hole
+        last_key = self._keys.pop()
+        last_value = self._values.pop()
+        if i < len(self._keys):
+            self._keys[i] = last_key
+            self._values[i] = last_value
+            self._index[last_key] = i
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self._keys)
+
+    # Returns a key's value, or default if it isn't present.
+    def get(self, key: Hashable, default: Any=None) -> Any:
+        i = self._index.get(key)
+        return default if i is None else self._values[i]
+
+    # Removes a key and returns its value. If the key isn't present, default
+    # is returned if given, and KeyError raised otherwise.
+    def pop(self, key: Hashable, *default) -> Any:
+        i = self._index.get(key)
+        if i is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        value = self._values[i]
+        del self[key]
+        return value
+
+    def keys(self) -> list[Hashable]:
+        return self._keys
+
+    def values(self) -> list[Any]:
+        return self._values
+
+    def items(self) -> Iterator[tuple[Hashable, Any]]:
+        return zip(self._keys, self._values)
+
+    # Returns a uniformly random key. Raises IndexError if the set is empty.
+    def sample(self, rng: random.Random=random) -> Hashable:
+        if not self._keys:
+            raise IndexError("sample from an empty IndexedSet")
+        return self._keys[rng.randrange(len(self._keys))]
+
+    # Only the keys and values are pickled, and the index is rebuilt on load
+    def __getstate__(self) -> tuple[list, list]:
+        return (self._keys, self._values)
+
+    def __setstate__(self, state: tuple[list, list]):
+        self._keys, self._values = state
+        self._index = {key: i for i, key in enumerate(self._keys)}
+
+# Times the bookkeeping gen_states does per generated state, sampling a random
+# unprocessed state, removing it and inserting a new one, for sets of each
+# size. The old approach of copying a dict's keys to sample is timed too.
+def benchmark(sizes: tuple[int, ...]=(1000, 10000, 100000), steps: int=2000):
+    for size in sizes:
+        indexed = IndexedSet({i: None for i in range(size)})
+        start = time.perf_counter()
+        for i in range(size, size + steps):
+            del indexed[indexed.sample()]
+            indexed[i] = None
+        indexed_time = (time.perf_counter() - start) / steps
+
+        d = {i: None for i in range(size)}
+        start = time.perf_counter()
+        for i in range(size, size + steps):
+            del d[random.choice(list(d.keys()))]
+            d[i] = None
+        dict_time = (time.perf_counter() - start) / steps
+
+        print(f"{size} states: IndexedSet {indexed_time * 1e6:.2f}us/state, " \
+            f"dict {dict_time * 1e6:.2f}us/state")
+
+def main():
+    sizes = tuple(int(arg) for arg in sys.argv[1:]) or (1000, 10000, 100000)
+    benchmark(sizes)
+
+if __name__ == "__main__":
+    main()
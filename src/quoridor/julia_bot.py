@@ -2,21 +2,97 @@
 
 # Quoridor bot.
 #
+# Run with --serve to answer a stream of length-prefixed boards on stdin until
+# it closes, rather than a single board. Caches are then kept between moves.
+# Pass --model with the path of a saved Keras model to score positions with it
+# rather than the distance heuristic. Pass --stats to write search statistics
+# for every move to stderr, as a line of JSON, before the move itself. Opening
+# moves are played from the default opening book if it exists, or from the book
+# passed with --book. Pass --mcts to pick moves with Monte Carlo tree search
+# rather than minimax, keeping the tree between moves when serving. Boards are
+# exchanged in the binary board format. Pass --pickle to also accept pickled
+# boards from older programs, which unpickles whatever the bot is sent.
+#
 # Author: Julia Kaeppel
-from serializable_board import SerializableBoard
-from quoridor import Board
+import os
+import sys
+from typing import Optional
+from serializable_board import SerializableBoard, decode_board, encode_board, is_pickled, \
+    read_frame, write_frame
 import minimax
+from evaluator import Evaluator, ModelEvaluator
+from book import BOOK, OpeningBook
+import mcts
+from mcts import MCTS
+from transposition import TranspositionTable
+
+# Computes the move for an encoded board, answering in the same format. Binary
+# boards are decoded straight into a Board. Pickled boards are only accepted,
+# for compatibility with older programs, if allow_pickle is set, since
+# unpickling runs arbitrary code. Otherwise anything but a binary board raises
+# ValueError.
+def respond(data: bytes, tt: Optional[TranspositionTable]=None, \
+    evaluator: Optional[Evaluator]=None, stats: bool=False, \
+    book: Optional[OpeningBook]=None, tree: Optional[MCTS]=None, \
+    allow_pickle: bool=False) -> bytes:
+    search_stats = minimax.SearchStats() if stats else None
+    if is_pickled(data):
+        sb = SerializableBoard.read_board(data, allow_pickle)
+        board, p1_turn = sb.to_board(), sb.p1_turn
+    else:
+        board, p1_turn = decode_board(data)
+
+    if tree is not None:
+        board = mcts.pick_move(board, p1_turn, tree=tree)
+    else:
+        board = minimax.pick_move(board, p1_turn, tt, evaluator=evaluator, stats=search_stats, \
+            book=book)
+
+    if is_pickled(data):
+        output = SerializableBoard.from_board(board, not p1_turn).write_board(True)
+    else:
+        output = encode_board(board, not p1_turn)
+
+    if search_stats is not None:
+        sys.stderr.write(search_stats.to_json() + "\n")
+        sys.stderr.flush()
+    return output
+
+# Answers boards until stdin is closed, sharing a transposition table between
+# every move
+def serve(evaluator: Optional[Evaluator]=None, stats: bool=False, \
+    book: Optional[OpeningBook]=None, tree: Optional[MCTS]=None, allow_pickle: bool=False):
+    tt = TranspositionTable()
+    while True:
+        data = read_frame(sys.stdin.buffer)
+        if data is None:
+            break
+        write_frame(sys.stdout.buffer, respond(data, tt, evaluator, stats, book, tree, \
+            allow_pickle))
 
 def main():
-    # Read input
-    sb = SerializableBoard.input_board()
-    # Compute move
-    board = Board(sb.walls, sb.p1, sb.p2, sb.p1_walls, sb.p2_walls)
-    board = minimax.pick_move(board, sb.p1_turn)
-    sb = SerializableBoard(board.walls, board.p1, board.p2, board.p1_walls, \
-        board.p2_walls, not sb.p1_turn)
-    # Write output
-    sb.output_board()
+    evaluator = None
+    if "--model" in sys.argv[1:-1]:
+        evaluator = ModelEvaluator(sys.argv[sys.argv.index("--model") + 1])
+
+    stats = "--stats" in sys.argv[1:]
+
+    book = None
+    if "--book" in sys.argv[1:-1]:
+        book = OpeningBook(sys.argv[sys.argv.index("--book") + 1])
+    elif os.path.exists(BOOK):
+        book = OpeningBook(BOOK)
+
+    tree = MCTS(evaluator=evaluator) if "--mcts" in sys.argv[1:] else None
+    allow_pickle = "--pickle" in sys.argv[1:]
+
+    if "--serve" in sys.argv[1:]:
+        serve(evaluator, stats, book, tree, allow_pickle)
+        return
+
+    # Read input, compute move and write output
+    sys.stdout.buffer.write(respond(sys.stdin.buffer.read(), None, evaluator, stats, book, \
+        tree, allow_pickle))
 
 if __name__ == "__main__":
     main()
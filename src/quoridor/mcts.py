@@ -0,0 +1,448 @@
+# Monte Carlo tree search.
+#
+# An alternative to minimax.pick_move which grows its tree selectively with
+# PUCT, rather than searching every move to a fixed depth, so promising lines
+# can be followed far deeper than a full-width search of ~130 children per node
+# allows.
+#
+# Nodes live in a fixed-size pool of NumPy arrays. The children of a node are
+# allocated together, as one contiguous block, when it's first expanded, so
+# selection scores every child of a node with a few array operations. A node's
+# value is from the point of view of the player who moved into it.
+#
+# Author: Julia Kaeppel
+from concurrent.futures import ProcessPoolExecutor
+import math
+import numpy as np
+import os
+import random
+import time
+from quoridor import Board, WALL_MOVES
+from evaluator import Evaluator, DistanceEvaluator
+import endgame
+import minimax
+from typing import Optional
+import vectorized
+
+# Playouts per search when no move time is given
+VISITS = 800
+
+# Exploration constant of the PUCT formula
+C_PUCT = 1.5
+
+# Leaves selected before any of them is evaluated. Virtual losses steer each
+# selection in a batch away from the paths of the others, and the leaves are
+# scored in one evaluator call.
+BATCH_SIZE = 8
+
+# Path length difference which scores a position as tanh(1), about 0.76
+VALUE_SCALE = 4.0
+
+# Temperature of the softmax over child heuristic scores which gives the priors
+PRIOR_TEMPERATURE = 1.0
+
+# Plies a rollout plays before it's scored by the heuristic
+ROLLOUT_PLIES = 64
+
+# Nodes in the pool
+CAPACITY = 1 << 19
+
+# Dirichlet noise concentration, for searches with root noise
+NOISE_ALPHA = 0.3
+
+# Marks a node which hasn't been expanded
+_UNEXPANDED = -1
+
+# Result of a search.
+#
+# move: Best child state, the most visited child of the root, or None if the
+# root is terminal.
+# value: Expected result of move for the player to move, from -1 to 1.
+# visits: Playouts through the root, including any kept from earlier searches.
+# playouts: Playouts run by this search.
+# nodes: Nodes in the tree.
+# elapsed: Seconds spent searching.
+class MCTSResult:
+    def __init__(self, move: Optional[Board], value: float, visits: int, playouts: int, \
+        nodes: int, elapsed: float):
+        self.move = move
+        self.value = value
+        self.visits = visits
+        self.playouts = playouts
+        self.nodes = nodes
+        self.elapsed = elapsed
+
+# A search tree, kept between moves. When the next position searched is a
+# child or grandchild of the last root, its subtree is kept and the rest of the
+# pool is freed. Once the pool is full, leaves are still evaluated but no
+# longer expanded.
+#
+# Leaves are scored by the evaluator if one is given, by shortest path greedy
+# rollouts if rollouts is set, and by heuristic otherwise. noise mixes that
+# fraction of Dirichlet noise into the root's priors, to vary play between
+# searches.
+class MCTS:
+    def __init__(self, capacity: int=CAPACITY, c_puct: float=C_PUCT, \
+        batch_size: int=BATCH_SIZE, rollouts: bool=False, evaluator: Optional[Evaluator]=None, \
+        noise: float=0.0, seed: Optional[int]=None):
+        self.capacity = capacity
+        self.c_puct = c_puct
+        self.batch_size = batch_size
+        self.rollouts = rollouts
+        self.evaluator = None if isinstance(evaluator, DistanceEvaluator) else evaluator
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.np_random = np.random.default_rng(seed)
+
+        self.moves = np.zeros(capacity, dtype=np.int16)
+        self.parents = np.zeros(capacity, dtype=np.int32)
+        self.firsts = np.zeros(capacity, dtype=np.int32)
+        self.counts = np.zeros(capacity, dtype=np.int16)
+        self.visits = np.zeros(capacity, dtype=np.int32)
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self.priors = np.zeros(capacity, dtype=np.float32)
+        self.virtual = np.zeros(capacity, dtype=np.int32)
+        self.root_state = None
+        self.root_turn = True
+        self.size = 0
+
+    # Picks the best move, searching for move_time seconds or the given number
+    # of playouts. Without either, VISITS playouts are run.
+    def pick_move(self, state: Board, p1_turn: bool, move_time: Optional[float]=None, \
+        visits: Optional[int]=None) -> Board:
+        return self.search(state, p1_turn, move_time, visits).move
+
+    # Searches a position for move_time seconds or the given number of
+    # playouts, whichever runs out first. Without either, VISITS playouts are
+    # run. At least one batch of playouts is always run.
+    def search(self, state: Board, p1_turn: bool, move_time: Optional[float]=None, \
+        visits: Optional[int]=None) -> MCTSResult:
+        start = time.perf_counter()
+        if move_time is None and visits is None:
+            visits = VISITS
+        deadline = None if move_time is None else start + move_time
+        self.__set_root(state, p1_turn)
+        if self.root_state.terminal():
+            return MCTSResult(None, -1.0, 0, 0, self.size, time.perf_counter() - start)
+
+        # Expand the root first, so noise can be mixed into its priors
+        if self.firsts[0] == _UNEXPANDED:
+            self.__playouts(1)
+        playouts = 0
+        if self.noise > 0:
+            self.__add_noise()
+
+        while visits is None or playouts < visits:
+            batch = self.batch_size if visits is None else min(self.batch_size, visits - playouts)
+            self.__playouts(batch)
+            playouts += batch
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+
+        # Play the most visited move, breaking ties by prior
+        children = self.__children(0)
+        best = children.start + int(np.lexsort((-self.priors[children], \
+            -self.visits[children]))[0])
+        move = self.root_state.child(int(self.moves[best]), p1_turn)
+        value = self.values[best] / self.visits[best] if self.visits[best] > 0 else 0.0
+        return MCTSResult(move, float(value), int(self.visits[0]), playouts, self.size, \
+            time.perf_counter() - start)
+
+    # Returns the visits of each of the root's moves
+    def visit_counts(self) -> dict[int, int]:
+        if self.size == 0 or self.firsts[0] == _UNEXPANDED:
+            return dict()
+        children = self.__children(0)
+        return dict(zip(self.moves[children].tolist(), self.visits[children].tolist()))
+
+    # Empties the tree
+    def reset(self):
+        self.size = 1
+        self.parents[0] = -1
+        self.firsts[0] = _UNEXPANDED
+        self.counts[0] = 0
+        self.visits[0] = 0
+        self.values[0] = 0.0
+        self.priors[0] = 1.0
+        self.virtual[0] = 0
+
+    # Runs a batch of playouts. Each selects a leaf and expands it, with a
+    # virtual loss on its path until the whole batch has been evaluated.
+    def __playouts(self, count: int):
+        state, root_turn = self.root_state, self.root_turn
+        paths = []
+        values = []
+        pending = []
+        for _ in range(count):
+            # Select a leaf, applying moves to the root state on the way down
+            node = 0
+            path = [0]
+            p1_turn = root_turn
+            while self.firsts[node] != _UNEXPANDED:
+                node = self.__select(node)
+                state.apply(int(self.moves[node]), p1_turn)
+                p1_turn = not p1_turn
+                path.append(node)
+
+            try:
+                # The player to move at a terminal state has lost
+                if state.terminal():
+                    value = -1.0
+                else:
+                    self.__expand(node, state, p1_turn)
+                    if self.evaluator is None:
+                        value = self.__evaluate(state, p1_turn)
+                    else:
+                        value = None
+                        pending.append((len(values), Board.from_bits(state.h_walls, \
+                            state.v_walls, state.p1, state.p2, state.p1_walls, \
+                            state.p2_walls), p1_turn))
+            finally:
+                for _ in range(len(path) - 1):
+                    state.undo()
+
+            path = np.array(path)
+            self.virtual[path] += 1
+            paths.append(path)
+            values.append(value)
+
+        # Score leaves waiting on the evaluator in one call
+        if pending:
+            scores = self.evaluator.evaluate_states([(leaf, p1_turn) \
+                for _, leaf, p1_turn in pending])
+            for (i, _, p1_turn), score in zip(pending, scores):
+                values[i] = math.tanh((score if p1_turn else -score) / VALUE_SCALE)
+
+        # Back up each value, alternating sides up the path
+        for path, value in zip(paths, values):
+            self.virtual[path] -= 1
+            self.visits[path] += 1
+            signs = np.where(np.arange(len(path))[::-1] % 2 == 0, -1.0, 1.0)
+            self.values[path] += signs * value
+
+    # Returns the child of a node with the highest PUCT score. Unvisited
+    # children are valued at their parent's value.
+    def __select(self, node: int) -> int:
+        children = self.__children(node)
+        visits = self.visits[children] + self.virtual[children]
+        values = self.values[children] - self.virtual[children]
+        parent_visits = self.visits[node]
+        fpu = -self.values[node] / parent_visits if parent_visits > 0 else 0.0
+        q = np.where(visits > 0, values / np.maximum(visits, 1), fpu)
+        u = self.c_puct * self.priors[children] * math.sqrt(visits.sum() + 1) / (1 + visits)
+        return children.start + int(np.argmax(q + u))
+
+    # Allocates a node's children, with priors from their heuristic scores.
+    # Nothing is allocated if the pool is full.
+    def __expand(self, node: int, state: Board, p1_turn: bool):
+        moves, scores = child_scores(state, p1_turn)
+        count = len(moves)
+        if count == 0 or self.size + count > self.capacity:
+            return
+
+        block = slice(self.size, self.size + count)
+        self.moves[block] = moves
+        self.parents[block] = node
+        self.firsts[block] = _UNEXPANDED
+        self.counts[block] = 0
+        self.visits[block] = 0
+        self.values[block] = 0.0
+        self.virtual[block] = 0
+        self.priors[block] = priors(scores)
+        self.firsts[node] = self.size
+        self.counts[node] = count
+        self.size += count
+
+    # Scores a leaf for the player to move, from -1 to 1
+    def __evaluate(self, state: Board, p1_turn: bool) -> float:
+        if self.rollouts:
+            return self.__rollout(state, p1_turn)
+        color = 1 if p1_turn else -1
+        return math.tanh(color * minimax.heuristic(state) / VALUE_SCALE)
+
+    # Plays out a leaf with both pawns walking their shortest paths, breaking
+    # ties at random, and scores it for the player to move. No walls are
+    # placed. Rollouts which don't finish within ROLLOUT_PLIES are scored by
+    # heuristic.
+    def __rollout(self, state: Board, p1_turn: bool) -> float:
+        turn = p1_turn
+        plies = 0
+        try:
+            while not state.terminal() and plies < ROLLOUT_PLIES:
+                field = state.distance_field(turn)
+                moves = state.pawn_moves(turn)
+                best = min(field[move] for move in moves)
+                state.apply(self.random.choice([move for move in moves if field[move] == best]), \
+                    turn)
+                turn = not turn
+                plies += 1
+
+            # The player to move at a terminal state has lost
+            if state.terminal():
+                return -1.0 if turn == p1_turn else 1.0
+            color = 1 if p1_turn else -1
+            return math.tanh(color * minimax.heuristic(state) / VALUE_SCALE)
+        finally:
+            for _ in range(plies):
+                state.undo()
+
+    # Mixes Dirichlet noise into the root's priors
+    def __add_noise(self):
+        children = self.__children(0)
+        noise = self.np_random.dirichlet([NOISE_ALPHA] * (children.stop - children.start))
+        self.priors[children] = (1 - self.noise) * self.priors[children] + self.noise * noise
+
+    # Makes a position the root, keeping its subtree if it's a child or
+    # grandchild of the current root
+    def __set_root(self, state: Board, p1_turn: bool):
+        key = state.key(p1_turn)
+        if self.root_state is not None:
+            if self.root_state.key(self.root_turn) == key:
+                return
+            node = self.__find(key)
+            if node is not None:
+                self.__reroot(node)
+                self.root_state = _copy(state)
+                self.root_turn = p1_turn
+                return
+
+        self.reset()
+        self.root_state = _copy(state)
+        self.root_turn = p1_turn
+
+    # Looks for a visited child or grandchild of the root with the given key
+    def __find(self, key: int) -> Optional[int]:
+        state, p1_turn = self.root_state, self.root_turn
+        if self.size == 0 or self.firsts[0] == _UNEXPANDED:
+            return None
+        children = self.__children(0)
+        for child in range(children.start, children.stop):
+            if self.visits[child] == 0:
+                continue
+            state.apply(int(self.moves[child]), p1_turn)
+            try:
+                if state.key(not p1_turn) == key:
+                    return child
+                if self.firsts[child] == _UNEXPANDED:
+                    continue
+                grandchildren = self.__children(child)
+                for grandchild in range(grandchildren.start, grandchildren.stop):
+                    if self.visits[grandchild] == 0:
+                        continue
+                    state.apply(int(self.moves[grandchild]), not p1_turn)
+                    try:
+                        if state.key(p1_turn) == key:
+                            return grandchild
+                    finally:
+                        state.undo()
+            finally:
+                state.undo()
+        return None
+
+    # Moves a node's subtree to the front of the pool, with the node as the
+    # root, freeing every other node
+    def __reroot(self, node: int):
+        # List the subtree breadth first, so every block of children stays
+        # contiguous
+        order = [node]
+        i = 0
+        while i < len(order):
+            first = int(self.firsts[order[i]])
+            if first != _UNEXPANDED:
+                order.extend(range(first, first + int(self.counts[order[i]])))
+            i += 1
+        order = np.array(order)
+        remap = np.full(self.capacity, _UNEXPANDED, dtype=np.int32)
+        remap[order] = np.arange(len(order))
+
+        size = len(order)
+        for column in (self.moves, self.counts, self.visits, self.values, self.priors):
+            column[:size] = column[order]
+        firsts = self.firsts[order]
+        self.firsts[:size] = np.where(firsts == _UNEXPANDED, _UNEXPANDED, remap[firsts])
+        self.parents[:size] = remap[self.parents[order]]
+        self.parents[0] = -1
+        self.virtual[:size] = 0
+        self.size = size
+
+    # Returns the slice of a node's children in the pool
+    def __children(self, node: int) -> slice:
+        first = int(self.firsts[node])
+        return slice(first, first + int(self.counts[node]))
+
+# Returns the legal moves of a state and their heuristic scores for the player
+# to move. Winning moves score infinity. Walls are scored all at once, as in
+# minimax.frontier.
+def child_scores(state: Board, p1_turn: bool) -> tuple[list[int], np.ndarray]:
+    color = 1 if p1_turn else -1
+    moves = []
+    scores = []
+    for move in state.pawn_moves(p1_turn):
+        state.apply(move, p1_turn)
+        try:
+            scores.append(float("inf") if state.terminal() else color * minimax.heuristic(state))
+        finally:
+            state.undo()
+        moves.append(move)
+
+    if (state.p1_walls if p1_turn else state.p2_walls) > 0:
+        placements = vectorized.wall_placements(state)
+        valid = np.flatnonzero(placements.valid.ravel())
+        moves += (valid + WALL_MOVES).tolist()
+        scores += (color * (placements.p2_dist.ravel()[valid] - \
+            placements.p1_dist.ravel()[valid])).tolist()
+    return (moves, np.array(scores, dtype=np.float64))
+
+# Turns child scores into priors with a softmax. If any move wins outright,
+# the winning moves share all of the prior.
+def priors(scores: np.ndarray) -> np.ndarray:
+    wins = np.isinf(scores) & (scores > 0)
+    if wins.any():
+        return wins / np.count_nonzero(wins)
+    weights = np.exp((scores - scores.max()) / PRIOR_TEMPERATURE)
+    return weights / weights.sum()
+
+# Picks the best move with a search tree, using the tree given or a fresh one
+# otherwise. Pawn races are solved by the endgame solver without searching.
+def pick_move(state: Board, p1_turn: bool, move_time: Optional[float]=None, \
+    visits: Optional[int]=None, tree: Optional[MCTS]=None) -> Board:
+    move = endgame.best_move(state, p1_turn)
+    if move is not None:
+        return state.child(move, p1_turn)
+    if tree is None:
+        tree = MCTS()
+    return tree.pick_move(state, p1_turn, move_time, visits)
+
+# Searches a position with independent trees in a pool of worker processes,
+# each with its own root noise, and plays the move with the most visits over
+# every tree. Workers are started for this search unless an executor is given.
+def root_parallel(state: Board, p1_turn: bool, visits: int=VISITS, workers: Optional[int]=None, \
+    rollouts: bool=False, noise: float=0.25, executor: Optional[ProcessPoolExecutor]=None) \
+    -> Board:
+    workers = workers if workers is not None else os.cpu_count()
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(workers)
+    try:
+        futures = [executor.submit(_visit_counts, state, p1_turn, visits // workers, rollouts, \
+            noise, seed) for seed in range(workers)]
+        totals = dict()
+        for future in futures:
+            for move, count in future.result().items():
+                totals[move] = totals.get(move, 0) + count
+    finally:
+        if own_executor:
+            executor.shutdown()
+    return state.child(max(totals, key=totals.get), p1_turn)
+
+# Searches a position in a worker, returning the root's visit counts
+def _visit_counts(state: Board, p1_turn: bool, visits: int, rollouts: bool, noise: float, \
+    seed: int) -> dict[int, int]:
+    tree = MCTS(rollouts=rollouts, noise=noise, seed=seed)
+    tree.search(state, p1_turn, visits=visits)
+    return tree.visit_counts()
+
+# Copies a board, so the tree's root can't be changed by the caller
+def _copy(state: Board) -> Board:
+    return Board.from_bits(state.h_walls, state.v_walls, state.p1, state.p2, state.p1_walls, \
+        state.p2_walls)
@@ -1,81 +1,507 @@
 # Minimax.
 #
 # Author: Julia Kaeppel
-from quoridor import Board
-from typing import Optional
+from quoridor import Board, MOVE_COUNT, WALL_MOVES, PathStats, profile_paths
+from typing import Iterator, Optional
+from contextlib import contextmanager, nullcontext
 import heapq
+import json
 from sortedcontainers import SortedList
+import numpy as np
+import time
+import vectorized
+from transposition import TranspositionTable, EXACT, LOWER, UPPER
+from evaluator import Evaluator, DistanceEvaluator
+from book import OpeningBook
+import endgame
 
 # Max depth to search
 MAX_DEPTH = 2
 
-# Class for sorting state-score pairs
-class StateScore:
-    def __init__(self, state: Board, score: int):
-        self.state = state
-        self.score = score
+# Max depth iterative deepening will search to
+MAX_ITERATIVE_DEPTH = 32
+
+# Raised inside a search once its time or node budget has run out
+class SearchAborted(Exception):
+    pass
+
+# Statistics collected from a search, if asked for. Counters are keyed by the
+# remaining depth of the node they were collected at, with leaves at depth 0.
+#
+# nodes: Nodes visited, including leaves scored in a batch.
+# children: Children searched below interior nodes.
+# cutoffs: Beta cutoffs.
+# first_cutoffs: Beta cutoffs caused by the first move searched.
+# panics: Nodes where no move could be searched.
+# paths: Distance fields computed and repaired.
+# wall_batches, wall_batch_time: Batches of wall placements scored at
+# frontier nodes, and seconds spent on them.
+# tt: Changes in the transposition table's counters, if there is one.
+# elapsed: Seconds spent searching.
+class SearchStats:
+    def __init__(self):
+        self.nodes = dict()
+        self.children = dict()
+        self.cutoffs = dict()
+        self.first_cutoffs = dict()
+        self.panics = 0
+        self.paths = PathStats()
+        self.wall_batches = 0
+        self.wall_batch_time = 0.0
+        self.tt = None
+        self.elapsed = 0.0
+
+    # Counts nodes visited at a depth
+    def visit(self, depth: int, count: int=1):
+        self.nodes[depth] = self.nodes.get(depth, 0) + count
+
+    # Counts an interior node's searched children, and whether it was cut off
+    # and by which move
+    def searched(self, depth: int, children: int, cutoff: bool):
+        self.children[depth] = self.children.get(depth, 0) + children
+        if cutoff:
+            self.cutoffs[depth] = self.cutoffs.get(depth, 0) + 1
+            if children == 1:
+                self.first_cutoffs[depth] = self.first_cutoffs.get(depth, 0) + 1
+
+    # Collects pathfinding counts, time and transposition table usage for the
+    # duration of a search
+    @contextmanager
+    def collect(self, tt: Optional[TranspositionTable]=None):
+        previous = profile_paths(self.paths)
+        before = None if tt is None else tt.stats()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.elapsed += time.perf_counter() - start
+            profile_paths(previous)
+            if tt is not None:
+                after = tt.stats()
+                self.tt = {name: after[name] - before[name] \
+                    for name in ("hits", "misses", "stores", "overwrites")}
+                lookups = self.tt["hits"] + self.tt["misses"]
+                self.tt["hit_rate"] = self.tt["hits"] / lookups if lookups else 0.0
+                self.tt["fill"] = after["fill"]
+
+    # Returns the statistics as a dict of plain values. Branching factors are
+    # children searched per interior node, and first move cutoff rates are the
+    # fraction of cutoffs caused by the first move searched.
+    def to_dict(self) -> dict:
+        depths = sorted(self.nodes, reverse=True)
+        return {
+            "nodes": sum(self.nodes.values()),
+            "elapsed": self.elapsed,
+            "depths": {str(depth): {
+                "nodes": self.nodes.get(depth, 0),
+                "branching": self.children[depth] / self.nodes[depth] \
+                    if depth in self.children else None,
+                "cutoffs": self.cutoffs.get(depth, 0),
+                "first_cutoff_rate": self.first_cutoffs.get(depth, 0) / self.cutoffs[depth] \
+                    if self.cutoffs.get(depth) else None,
+            } for depth in depths},
+            "panics": self.panics,
+            "paths": {
+                "searches": self.paths.searches,
+                "search_time": self.paths.search_time,
+                "repairs": self.paths.repairs,
+                "repair_time": self.paths.repair_time,
+            },
+            "wall_batches": self.wall_batches,
+            "wall_batch_time": self.wall_batch_time,
+            "tt": self.tt,
+        }
+
+    # Returns the statistics as a JSON string.
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+# State shared by every node of a search.
+#
+# tt: Transposition table to cache results in, if any.
+# deadline: time.perf_counter() value after which the search is aborted.
+# max_nodes: Node count after which the search is aborted.
+# best_moves: Best move found at each position searched, keyed by Board.key.
+# These are searched first by the next iteration.
+# killers: Up to two recent moves which caused a beta cutoff, by depth.
+# history: Cutoff score of each move, by whether it's player 1's turn.
+# evaluator: Scores leaf states. None uses heuristic.
+# stats: Statistics to collect, if any.
+class Search:
+    def __init__(self, tt: Optional[TranspositionTable]=None, deadline: Optional[float]=None, \
+        max_nodes: Optional[int]=None, evaluator: Optional[Evaluator]=None, \
+        stats: Optional[SearchStats]=None):
+        self.tt = tt
+        self.stats = stats
+        self.evaluator = None if isinstance(evaluator, DistanceEvaluator) else evaluator
+        self.deadline = deadline
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self.limited = False
+        self.best_moves = dict()
+        self.killers = dict()
+        self.history = {True: [0] * MOVE_COUNT, False: [0] * MOVE_COUNT}
     
-    def __eq__(self, other):
-        return self.score == other.score
+    # Counts visited nodes, aborting the search if its budget has run out. The
+    # budget is only enforced once limited is set.
+    def visit(self, count: int=1):
+        self.nodes += count
+        if not self.limited:
+            return
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            raise SearchAborted()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchAborted()
+
+    # Returns a state's moves in search order, starting with the best move from
+    # an earlier search of it
+    def moves(self, state: Board, depth: int, p1_turn: bool) -> Iterator[int]:
+        key = state.key(p1_turn)
+        first = self.best_moves.get(key)
+        if first is None and self.tt is not None:
+            first = self.tt.best_move(key)
+
+        return state.moves(p1_turn, first, self.killers.get(depth, ()), self.history[p1_turn])
+
+    # Records a move which caused a beta cutoff, as a killer move at its depth
+    # and in the history scores
+    def record_cutoff(self, move: int, depth: int, p1_turn: bool):
+        killers = self.killers.get(depth, ())
+        if not move in killers:
+            self.killers[depth] = (move,) + killers[:1]
+        self.history[p1_turn][move] += depth * depth
+
+# Result of an iterative deepening search.
+#
+# move: Best child state found by the last completed depth.
+# value: Score of move at that depth.
+# depth: Last completed depth.
+# nodes: Nodes searched in total, including any unfinished depth.
+# elapsed: Seconds spent searching.
+# pv: Principal variation of the last completed depth, starting with move.
+class SearchResult:
+    def __init__(self, move: Board, value: float, depth: int, nodes: int, elapsed: float, \
+        pv: list[Board]):
+        self.move = move
+        self.value = value
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.pv = pv
+
+# Picks the best move. If a transposition table is given, results are cached in
+# it and reused by later searches. If a move time in seconds or a node budget is
+# given, iterative deepening is used to search as deep as the budget allows,
+# rather than to MAX_DEPTH. Leaf states are scored by the evaluator if one is
+# given, and by heuristic otherwise. If stats are given, statistics about the
+# search are collected in them.
+#
+# Positions in the opening book, if one is given, are played from it, and pawn
+# races are solved by the endgame solver, without searching either.
+def pick_move(state: Board, p1_turn: bool, tt: Optional[TranspositionTable]=None, \
+    move_time: Optional[float]=None, max_nodes: Optional[int]=None, \
+    evaluator: Optional[Evaluator]=None, stats: Optional[SearchStats]=None, \
+    book: Optional[OpeningBook]=None) -> Board:
+    with nullcontext() if stats is None else stats.collect(tt):
+        move = None if book is None else book.lookup(state, p1_turn)
+        if move is None:
+            move = endgame.best_move(state, p1_turn)
+        if move is not None:
+            return state.child(move, p1_turn)
+
+        if move_time is not None or max_nodes is not None:
+            return iterative_deepening(state, p1_turn, tt, move_time, max_nodes, \
+                evaluator=evaluator, stats=stats).move
+
+        if tt is not None:
+            tt.new_search()
+        return negamax(state, MAX_DEPTH, float("-inf"), float("+inf"), p1_turn, False, 0, \
+            Search(tt, evaluator=evaluator, stats=stats))[1]
+
+# Searches one depth deeper at a time until the time or node budget runs out,
+# returning the result of the last completed depth. Each depth searches the
+# best moves of the previous one first. The first depth always completes,
+# whatever the budget, since the budget is only enforced once it has. Raises
+# ValueError if max_depth is less than 1.
+def iterative_deepening(state: Board, p1_turn: bool, tt: Optional[TranspositionTable]=None, \
+    move_time: Optional[float]=None, max_nodes: Optional[int]=None, \
+    max_depth: int=MAX_ITERATIVE_DEPTH, evaluator: Optional[Evaluator]=None, \
+    stats: Optional[SearchStats]=None) -> SearchResult:
+    if max_depth < 1:
+        raise ValueError(f"max_depth must be at least 1, got {max_depth}")
+    start = time.perf_counter()
+    if tt is not None:
+        tt.new_search()
+    search = Search(tt, None if move_time is None else start + move_time, max_nodes, evaluator, \
+        stats)
+
+    result = None
+    for depth in range(1, max_depth + 1):
+        try:
+            value, move = negamax(state, depth, float("-inf"), float("+inf"), p1_turn, \
+                False, 0, search)
+        except SearchAborted:
+            break
+        result = SearchResult(move, value, depth, search.nodes, 0, \
+            principal_variation(state, p1_turn, search, depth))
+        search.limited = True
+
+        # Stop once the game's outcome is decided
+        if value in (float("-inf"), float("+inf")) or move is None:
+            break
     
-    def __lt__(self, other):
-        return self.score < other.score
+    result.nodes = search.nodes
+    result.elapsed = time.perf_counter() - start
+    return result
+
+# Follows the best moves recorded by a search from a state, returning up to
+# depth states
+def principal_variation(state: Board, p1_turn: bool, search: Search, depth: int) -> list[Board]:
+    pv = []
+    while len(pv) < depth and not state.terminal():
+        move = search.best_moves.get(state.key(p1_turn))
+        if move is None:
+            break
+        state = state.child(move, p1_turn)
+        if state is None:
+            break
+        pv.append(state)
+        p1_turn = not p1_turn
+    return pv
+
+# Negamax implementation. The search runs in place on state, which is modified
+# during the search but restored before returning. The transposition table is
+# ignored when generating training data, since every child's exact score is
+# needed.
+def negamax(state: Board, depth: int, alpha: float, beta: float, p1_turn: bool, gen_data: bool, score_prio: int, search: Optional[Search]=None) -> tuple[float, Optional[Board]]:
+    if search is None:
+        search = Search()
 
-# Picks the best move
-def pick_move(state: Board, p1_turn: bool) -> Board:
-    return negamax(state, MAX_DEPTH, float("-inf"), float("+inf"), p1_turn, False, 0)[1]
+    # Check for terminal state reached. The player to move has lost, since the
+    # other player just reached their goal.
+    if state.terminal():
+        search.visit()
+        return (float("-inf"), state)
+
+    # Handle training data generation
+    if gen_data and depth > 0:
+        return rank_children(state, depth, alpha, beta, p1_turn, score_prio, search)
 
-# Negamax implementation
-def negamax(state: Board, depth: int, alpha: float, beta: float, p1_turn: bool, gen_data: bool, score_prio: int) -> tuple[float, Optional[Board]]:
+    value, move = search_node(state, depth, alpha, beta, p1_turn, search)
+    return (value, None if move is None else state.child(move, p1_turn))
+
+# Searches a state in place, returning its value and best move. Children are
+# visited by applying and undoing moves on the one board, so no child states
+# are built.
+def search_node(state: Board, depth: int, alpha: float, beta: float, p1_turn: bool, search: Search) -> tuple[float, Optional[int]]:
     color = 1 if p1_turn else -1
+    search.visit()
+    stats = search.stats
+    if stats is not None:
+        stats.visit(depth)
 
     # Check for terminal state reached
     if state.terminal():
-        return (color * float("-inf"), state)
+        return (float("-inf"), None)
     
     # Check for max depth reached
     if depth == 0:
+        if search.evaluator is not None:
+            return (color * search.evaluator.evaluate(state, p1_turn), None)
         return (color * heuristic(state), None)
-    
-    # Handle training data generation
-    if gen_data:
-        state_scores = SortedList()
 
-    # Recursively find the best child state
+    # Score the children of frontier nodes in a batch
+    if depth == 1:
+        value, max_move = frontier(state, alpha, beta, p1_turn, search)
+        record(search, state, depth, alpha, beta, p1_turn, value, max_move)
+        return (value, max_move)
+
+    # Recursively find the best move
+    tt = search.tt
+    alpha_orig = alpha
     value = float("-inf")
-    children = state.adj_states(p1_turn)
-    max_state = children[0]
-    for child in children:
-        # Calculate child score
-        score = -negamax(child, depth - 1, -beta, -alpha, not p1_turn, False, 0)[0]
+    max_move = None
+    children = 0
+    for move in search.moves(state, depth, p1_turn):
+        if not state.apply(move, p1_turn):
+            continue
+        children += 1
 
-        # Handle training data generation
-        if gen_data:
-            state_scores.add(StateScore(child, score))
+        # Calculate child score, reusing a cached result if it settles the
+        # child's window
+        try:
+            child_value = None
+            if tt is not None:
+                child_value = tt.cutoff(state.key(not p1_turn), depth - 1, -beta, -alpha)
+            if child_value is None:
+                child_value = search_node(state, depth - 1, -beta, -alpha, not p1_turn, search)[0]
+        finally:
+            state.undo()
+        score = -child_value
 
         # Check for new best score
-        if score > value:
+        if score > value or max_move is None:
             value = score
-            max_state = child
+            max_move = move
         
-        # Only handle alpha-beta pruning when gen_data is disabled
-        if not gen_data:
-            alpha = max(alpha, value)
-            if alpha >= beta:
-                break
+        alpha = max(alpha, value)
+        if alpha >= beta:
+            search.record_cutoff(move, depth, p1_turn)
+            break
+    if stats is not None:
+        stats.searched(depth, children, alpha >= beta)
     
     # This is just here to let me know something has gone catastrophically wrong
-    if max_state == None:
+    if max_move == None:
         print("PANIC!")
+        if stats is not None:
+            stats.panics += 1
     
-    # Determine whether to return a score priority
-    if not gen_data:
-        return (value, max_state)
+    record(search, state, depth, alpha_orig, beta, p1_turn, value, max_move)
+    return (value, max_move)
+
+# Scores every child of a state without pruning, in adj_states order, and
+# returns the child with the given score priority along with its score. A
+# priority of 1 is the best child, 2 the second best, and so on, clamped to the
+# worst child. Equal scores rank later children higher.
+def rank_children(state: Board, depth: int, alpha: float, beta: float, p1_turn: bool, score_prio: int, search: Search) -> tuple[float, Board]:
+    search.visit()
+    move_scores = SortedList()
+    moves = state.pawn_moves(p1_turn) + state.wall_moves(p1_turn)
+    for i, move in enumerate(moves):
+        if not state.apply(move, p1_turn):
+            continue
+        try:
+            score = -search_node(state, depth - 1, -beta, -alpha, not p1_turn, search)[0]
+        finally:
+            state.undo()
+        move_scores.add((score, i, move))
+
+    # Ensure index out of bounds error doesn't occur
+    index = -min(score_prio, len(move_scores))
+    score, _, move = move_scores[index]
+    return (score, state.child(move, p1_turn))
+
+# Records a search result as the position's best move, and in the transposition
+# table if there is one, with the bound type implied by the original alpha-beta
+# window.
+def record(search: Search, state: Board, depth: int, alpha: float, beta: float, p1_turn: bool, value: float, move: Optional[int]):
+    key = state.key(p1_turn)
+    if move is not None:
+        search.best_moves[key] = move
+    if search.tt is None:
+        return
+
+    if value <= alpha:
+        bound = UPPER
+    elif value >= beta:
+        bound = LOWER
     else:
-        # Ensure index out of bounds error doesn't occur
-        index = -min(score_prio, len(state_scores))
-        state_score = state_scores[index]
-        return (state_score.score, state_score.state)
+        bound = EXACT
+    search.tt.store(key, depth, bound, value, move)
+
+# Scores every child of a node one ply above the max depth, returning the value
+# and the best move. Pawn moves are scored one by one, and every wall placement
+# is scored at once from its resulting path lengths, so no wall child is ever
+# built. The result matches negamax to depth 1, ties included.
+def frontier(state: Board, alpha: float, beta: float, p1_turn: bool, search: Search) -> tuple[float, Optional[int]]:
+    if search.evaluator is not None:
+        return evaluated_frontier(state, p1_turn, search)
+    color = 1 if p1_turn else -1
+    stats = search.stats
+
+    # Score pawn moves
+    value = float("-inf")
+    max_move = None
+    pawn_moves = state.pawn_moves(p1_turn)
+    for i, move in enumerate(pawn_moves):
+        state.apply(move, p1_turn)
+        try:
+            score = -search_node(state, 0, float("-inf"), float("+inf"), not p1_turn, search)[0]
+        finally:
+            state.undo()
+        if score > value:
+            value = score
+            max_move = move
+        if max(alpha, value) >= beta:
+            if stats is not None:
+                stats.searched(1, i + 1, True)
+            return (value, max_move)
+    
+    # Ensure a wall can actually be placed
+    active_walls = state.p1_walls if p1_turn else state.p2_walls
+    if active_walls == 0:
+        if stats is not None:
+            stats.searched(1, len(pawn_moves), False)
+        return (value, max_move)
+
+    # Score wall placements in the order adj_states generates them, so the
+    # first best wall wins ties
+    if stats is not None:
+        start = time.perf_counter()
+    placements = vectorized.wall_placements(state)
+    order = np.array(state.wall_order())
+    order = np.stack([order, order + 64], axis=1).ravel()
+    valid = placements.valid.ravel()[order]
+    walls = int(np.count_nonzero(valid))
+    search.visit(walls)
+    if stats is not None:
+        stats.wall_batches += 1
+        stats.wall_batch_time += time.perf_counter() - start
+        stats.visit(0, walls)
+        stats.searched(1, len(pawn_moves) + walls, False)
+    scores = color * (placements.p2_dist.ravel()[order] - placements.p1_dist.ravel()[order])
+    if valid.any():
+        scores = np.where(valid, scores, np.iinfo(scores.dtype).min)
+        best = int(np.argmax(scores))
+        if scores[best] > value:
+            value = int(scores[best])
+            max_move = WALL_MOVES + int(order[best])
+
+    return (value, max_move)
+
+# Scores every child of a node one ply above the max depth with the search's
+# evaluator, batching every non-terminal child into a single call. Children
+# are compared in adj_states order, so the first best child wins ties.
+def evaluated_frontier(state: Board, p1_turn: bool, search: Search) -> tuple[float, Optional[int]]:
+    color = 1 if p1_turn else -1
+
+    # Terminal children are scored by search_node, and the rest batched
+    moves = []
+    scores = []
+    for move in state.pawn_moves(p1_turn):
+        state.apply(move, p1_turn)
+        try:
+            if state.terminal():
+                scores.append(-search_node(state, 0, float("-inf"), float("+inf"), \
+                    not p1_turn, search)[0])
+            else:
+                scores.append(None)
+            moves.append(move)
+        finally:
+            state.undo()
+    walls = state.wall_moves(p1_turn)
+    if walls:
+        valid = vectorized.wall_placements(state).valid.ravel()
+        moves += [move for move in walls if valid[move - WALL_MOVES]]
+    scores += [None] * (len(moves) - len(scores))
+
+    batch = [move for move, score in zip(moves, scores) if score is None]
+    if search.stats is not None:
+        search.stats.visit(0, len(batch))
+        search.stats.searched(1, len(moves), False)
+    if batch:
+        search.visit(len(batch))
+        batch_scores = iter(color * search.evaluator.evaluate_moves(state, p1_turn, batch))
+        scores = [float(next(batch_scores)) if score is None else score for score in scores]
+
+    value = float("-inf")
+    max_move = None
+    for move, score in zip(moves, scores):
+        if score > value:
+            value = score
+            max_move = move
+    return (value, max_move)
 
 # Manual heuristic which compares the shortest path distances of the two pawns
 def heuristic(state: Board) -> float:
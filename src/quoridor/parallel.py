@@ -0,0 +1,189 @@
+# Parallel root-split search.
+#
+# Author: Julia Kaeppel
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import random
+import sys
+import time
+from typing import Optional
+from quoridor import Board
+import minimax
+from minimax import Search, SearchResult
+from transposition import TranspositionTable
+
+# Root moves handed to each task. Smaller chunks balance load better, but each
+# task pickles the board and sends it to a worker.
+CHUNK_SIZE = 8
+
+# Worker process state, set up once by _init_worker. _root is the number of
+# the root search the worker's transposition table was last aged for.
+_alpha = None
+_tt = None
+_root = None
+
+# Searches the root moves of a position across a pool of worker processes,
+# using the Young Brothers Wait strategy. The most promising root move is
+# searched first, in this process, to establish an alpha bound. The remaining
+# moves are then split between the workers, which share the best score found
+# so far so every worker searches with the tightest known window.
+#
+# Workers are started once and reused by every search, and each keeps its own
+# transposition table between searches.
+class ParallelSearch:
+    # Starts a pool of worker processes. tt_bytes is the size of each worker's
+    # transposition table, or 0 to disable them.
+    def __init__(self, workers: Optional[int]=None, tt_bytes: int=16 * 1024 * 1024):
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.alpha = multiprocessing.Value("d", float("-inf"))
+        self.tt = TranspositionTable(tt_bytes) if tt_bytes > 0 else None
+        self.root = 0
+        self.executor = ProcessPoolExecutor(self.workers, initializer=_init_worker, \
+            initargs=(self.alpha, tt_bytes))
+
+    # Picks the best move, searching to the given depth.
+    def pick_move(self, state: Board, p1_turn: bool, depth: int=minimax.MAX_DEPTH) -> Board:
+        return self.search(state, p1_turn, depth).move
+
+    # Searches a position to the given depth, returning the best move, its
+    # value and the number of nodes searched by every process.
+    def search(self, state: Board, p1_turn: bool, depth: int=minimax.MAX_DEPTH) -> SearchResult:
+        start = time.perf_counter()
+        if self.tt is not None:
+            self.tt.new_search()
+        self.root += 1
+        search = Search(self.tt)
+
+        # Frontier searches are already batched, so there's nothing to split
+        if depth <= 1 or state.terminal():
+            value, move = minimax.negamax(state, depth, float("-inf"), float("+inf"), p1_turn, \
+                False, 0, search)
+            return SearchResult(move, value, depth, search.nodes, \
+                time.perf_counter() - start, [] if move is None else [move])
+
+        # Order root moves by a depth 1 search, and search the eldest brother
+        minimax.search_node(state, 1, float("-inf"), float("+inf"), p1_turn, search)
+        moves = [move for move in search.moves(state, depth, p1_turn)]
+        value, max_move = float("-inf"), None
+        while moves and max_move is None:
+            move = moves.pop(0)
+            if state.apply(move, p1_turn):
+                try:
+                    value = -minimax.search_node(state, depth - 1, float("-inf"), \
+                        float("+inf"), not p1_turn, search)[0]
+                finally:
+                    state.undo()
+                max_move = move
+        nodes = search.nodes
+
+        # Search the younger brothers in parallel, sharing alpha
+        self.alpha.value = value
+        chunks = [moves[i:i + CHUNK_SIZE] for i in range(0, len(moves), CHUNK_SIZE)]
+        futures = [self.executor.submit(_search_moves, state, p1_turn, depth, chunk, self.root) \
+            for chunk in chunks]
+        for future in futures:
+            score, move, worker_nodes = future.result()
+            nodes += worker_nodes
+            if move is not None and score > value:
+                value, max_move = score, move
+
+        child = state.child(max_move, p1_turn)
+        return SearchResult(child, value, depth, nodes, time.perf_counter() - start, [child])
+
+    # Shuts down the worker processes.
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self) -> "ParallelSearch":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# Sets up a worker process
+def _init_worker(alpha, tt_bytes: int):
+    global _alpha, _tt
+    _alpha = alpha
+    _tt = TranspositionTable(tt_bytes) if tt_bytes > 0 else None
+
+# Searches a chunk of root moves in a worker, returning the best score and move
+# along with the number of nodes searched, or no move if none beat the shared
+# alpha. Each move is searched with the shared alpha, which is raised whenever
+# a better move is found.
+#
+# root numbers the root search the chunk belongs to. A worker ages its
+# transposition table once per root search, on the first chunk of it that it
+# receives, so entries stored for earlier chunks of the same search stay
+# current.
+def _search_moves(state: Board, p1_turn: bool, depth: int, moves: list[int], root: int) \
+    -> tuple[float, Optional[int], int]:
+    global _root
+    if _tt is not None and root != _root:
+        _tt.new_search()
+        _root = root
+    search = Search(_tt)
+    value, max_move = float("-inf"), None
+    for move in moves:
+        if not state.apply(move, p1_turn):
+            continue
+        try:
+            alpha = _alpha.value
+            score = -minimax.search_node(state, depth - 1, float("-inf"), -alpha, \
+                not p1_turn, search)[0]
+        finally:
+            state.undo()
+
+        # Scores at or below alpha only bound the move from above, so can't
+        # beat the best move found so far
+        if score > alpha and score > value:
+            value, max_move = score, move
+            with _alpha.get_lock():
+                if score > _alpha.value:
+                    _alpha.value = score
+    return (value, max_move, search.nodes)
+
+# Generates positions for benchmarking by playing random moves from the
+# starting position
+def benchmark_positions(count: int, seed: int=0) -> list[tuple[Board, bool]]:
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        state, p1_turn = Board(), True
+        for _ in range(rng.randrange(4, 24)):
+            children = state.adj_states(p1_turn)
+            state, p1_turn = rng.choice(children), not p1_turn
+            if state.terminal():
+                break
+        if not state.terminal():
+            positions.append((state, p1_turn))
+    return positions
+
+# Times searching a set of positions with each number of workers, printing the
+# time taken and the speedup over a single worker.
+def benchmark(depth: int=3, positions: int=8, worker_counts: tuple[int, ...]=(1, 2, 4, 8)):
+    boards = benchmark_positions(positions)
+    print(f"depth {depth}, {positions} positions, {os.cpu_count()} cpus")
+
+    base = None
+    for workers in worker_counts:
+        with ParallelSearch(workers) as searcher:
+            # Start every worker before timing
+            searcher.search(boards[0][0], boards[0][1], depth)
+            nodes = 0
+            start = time.perf_counter()
+            for state, p1_turn in boards:
+                nodes += searcher.search(state, p1_turn, depth).nodes
+            elapsed = time.perf_counter() - start
+
+        base = base or elapsed
+        print(f"{workers} workers: {elapsed:.2f}s, {nodes / elapsed:.0f} nodes/s, " \
+            f"{base / elapsed:.2f}x speedup")
+
+def main():
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    positions = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    benchmark(depth, positions)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# Perft move path enumeration.
+#
+# Counts every legal move sequence of a given length from a position, to check
+# move generators against each other and to benchmark them. Every sequence is
+# counted, including those which transpose into the same position. Subtree
+# counts are cached by Zobrist key and depth, so the subtree below a transposed
+# position is only computed once, and its count reused for every sequence
+# reaching it.
+#
+# Author: Julia Kaeppel
+import argparse
+import sys
+import time
+from quoridor import Board, WALL_MOVES
+from serializable_board import decode_board
+from typing import Optional
+
+# Move generators perft can use. adj_states builds every child board, while
+# moves applies and undoes the staged generator's moves on a single board.
+GENERATORS = ("adj_states", "moves")
+
+# Counts the move sequences of the given length from a state. A game that ends
+# early counts as one sequence. Counts are cached in cache, keyed by position
+# and depth, if one is given, and in a fresh cache otherwise.
+def perft(state: Board, p1_turn: bool, depth: int, generator: str="adj_states", \
+    cache: Optional[dict]=None) -> int:
+    if cache is None:
+        cache = dict()
+    if generator == "adj_states":
+        return _perft_adj_states(state, p1_turn, depth, cache)
+    if generator == "moves":
+        return _perft_moves(state, p1_turn, depth, cache)
+    raise ValueError(f"unknown move generator {generator}")
+
+# Counts the move sequences below each legal move of a state, returning a dict
+# from move to count.
+def divide(state: Board, p1_turn: bool, depth: int, generator: str="adj_states", \
+    cache: Optional[dict]=None) -> dict[int, int]:
+    if cache is None:
+        cache = dict()
+    counts = dict()
+    if depth == 0 or state.terminal():
+        return counts
+
+    if generator == "adj_states":
+        for child in state.adj_states(p1_turn):
+            counts[move_between(state, child, p1_turn)] = \
+                perft(child, not p1_turn, depth - 1, generator, cache)
+        return counts
+
+    for move in legal_moves(state, p1_turn):
+        state.apply(move, p1_turn)
+        try:
+            counts[move] = perft(state, not p1_turn, depth - 1, generator, cache)
+        finally:
+            state.undo()
+    return counts
+
+# Compares the per-move counts of two generators, returning a description of
+# every difference
+def compare(state: Board, p1_turn: bool, depth: int, generators: tuple[str, str]=GENERATORS) \
+    -> list[str]:
+    a = divide(state, p1_turn, depth, generators[0])
+    b = divide(state, p1_turn, depth, generators[1])
+    differences = []
+    for move in sorted(a.keys() | b.keys()):
+        if a.get(move) != b.get(move):
+            differences.append(f"{move_name(move)}: {generators[0]} {a.get(move)}, " \
+                f"{generators[1]} {b.get(move)}")
+    return differences
+
+# Returns the legal moves of a state, in the staged generator's order
+def legal_moves(state: Board, p1_turn: bool) -> list[int]:
+    moves = []
+    for move in state.moves(p1_turn):
+        if state.apply(move, p1_turn):
+            state.undo()
+            moves.append(move)
+    return moves
+
+# Returns the move which turns a state into one of its children
+def move_between(state: Board, child: Board, p1_turn: bool) -> int:
+    pawn = child.p1 if p1_turn else child.p2
+    if pawn != (state.p1 if p1_turn else state.p2):
+        return pawn[1] * 9 + pawn[0]
+    h_bits = child.h_walls & ~state.h_walls
+    if h_bits:
+        return WALL_MOVES + h_bits.bit_length() - 1
+    return WALL_MOVES + 64 + (child.v_walls & ~state.v_walls).bit_length() - 1
+
+# Returns a readable name for a move
+def move_name(move: int) -> str:
+    if move < WALL_MOVES:
+        return f"pawn ({move % 9}, {move // 9})"
+    alignment, slot = divmod(move - WALL_MOVES, 64)
+    return f"{'horizontal' if alignment == 0 else 'vertical'} wall ({slot % 8}, {slot // 8})"
+
+def _perft_adj_states(state: Board, p1_turn: bool, depth: int, cache: dict) -> int:
+    if depth == 0 or state.terminal():
+        return 1
+    key = (state.key(p1_turn), depth)
+    count = cache.get(key)
+    if count is None:
+        count = sum(_perft_adj_states(child, not p1_turn, depth - 1, cache) \
+            for child in state.adj_states(p1_turn))
+        cache[key] = count
+    return count
+
+def _perft_moves(state: Board, p1_turn: bool, depth: int, cache: dict) -> int:
+    if depth == 0 or state.terminal():
+        return 1
+    key = (state.key(p1_turn), depth)
+    count = cache.get(key)
+    if count is not None:
+        return count
+
+    # Only leaf moves need to be legal, not searched, one ply above the end
+    count = 0
+    for move in state.moves(p1_turn):
+        if not state.apply(move, p1_turn):
+            continue
+        try:
+            count += 1 if depth == 1 else _perft_moves(state, not p1_turn, depth - 1, cache)
+        finally:
+            state.undo()
+    cache[key] = count
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Counts move sequences from a position.")
+    parser.add_argument("depth", type=int, help="length of the move sequences")
+    parser.add_argument("--position", default=None, \
+        help="position in the binary board format, as hex. Defaults to the starting position")
+    parser.add_argument("--generator", choices=GENERATORS + ("both",), default="both", \
+        help="move generator to count with, or both to check them against each other")
+    args = parser.parse_args()
+
+    if args.position is None:
+        state, p1_turn = Board(), True
+    else:
+        state, p1_turn = decode_board(bytes.fromhex(args.position))
+
+    generators = GENERATORS if args.generator == "both" else (args.generator,)
+    totals = []
+    for generator in generators:
+        start = time.perf_counter()
+        counts = divide(state, p1_turn, args.depth, generator)
+        elapsed = time.perf_counter() - start
+        for move, count in counts.items():
+            print(f"{move_name(move)}: {count}")
+        totals.append(sum(counts.values()))
+        print(f"{generator}: {totals[-1]} sequences in {elapsed:.3f}s\n")
+
+    if len(generators) == 2:
+        differences = compare(state, p1_turn, args.depth, generators)
+        for difference in differences:
+            print(difference)
+        if differences:
+            sys.exit(1)
+        print("generators match")
+
+if __name__ == "__main__":
+    main()
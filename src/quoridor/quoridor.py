@@ -3,9 +3,10 @@
 # Author: Julia Kaeppel and Ben McAuliffe
 from enum import Enum
 import numpy as np
-from copy import deepcopy
 import heapq
-from typing import Optional
+import random
+import time
+from typing import Iterator, Optional
 
 class _Dir(Enum):
     UP = 0
@@ -13,229 +14,437 @@ class _Dir(Enum):
     RIGHT = 2
     LEFT = 3
 
-# The walls array has shape (2, 8, 8). The first index of the first dimension
-# is for horizontal walls, and the second is for vertical walls. The second
-# dimension is the Y dimension, and the third dimension is the X dimension.
-# (0, 0) is the bottom left corner
+# Walls are stored as two 64-bit bitboards, one for horizontal walls and one
+# for vertical walls. The wall slot at (x, y) is stored in bit y * 8 + x. Pawns
+# are stored as packed cell indices, where the cell (x, y) has index y * 9 + x.
+# (0, 0) is the bottom left corner.
+#
+# Each board also keeps a distance field per player, holding the number of
+# moves from every cell to that player's goal row. Shortest path queries are
+# lookups into these fields. When a wall is placed, the child board inherits its
+# parent's fields and repairs them lazily, only touching the cells whose
+# distance actually grows.
+#
+# Distance fields, shortest path lengths and the hash code are all computed on
+# first use, so boards which are only built to be stored or displayed never pay
+# for pathfinding.
+#
+# The walls ndarray view has shape (2, 8, 8). The first index of the first
+# dimension is for horizontal walls, and the second is for vertical walls. The
+# second dimension is the Y dimension, and the third dimension is the X
+# dimension.
 class Board:
-    # Initializes a board
-    def __init__(self, walls: np.ndarray=np.full(shape=(2, 8, 8), fill_value=False, dtype=bool), \
-        p1: (int, int)=(4, 0), p2: (int, int)=(4, 8), p1_walls: int=10, p2_walls: int=10):
-        self.walls = walls
-        self.p1 = p1
-        self.p2 = p2
+    __slots__ = ("h_walls", "v_walls", "_p1", "_p2", "p1_walls", "p2_walls", \
+        "_p1_dist", "_p2_dist", "_hash", "_p1_field", "_p2_field", "_stale", \
+        "_last_wall", "_undo")
+
+    # Initializes a board. If eager is set, both distance fields and the hash
+    # code are computed straight away rather than on first use.
+    def __init__(self, walls: Optional[np.ndarray]=None, p1: (int, int)=(4, 0), \
+        p2: (int, int)=(4, 8), p1_walls: int=10, p2_walls: int=10, eager: bool=False):
+        if walls is None:
+            self.h_walls, self.v_walls = 0, 0
+        else:
+            self.h_walls, self.v_walls = _pack_walls(walls)
+        self.__init_fields(p1, p2, p1_walls, p2_walls, eager)
+
+    # Creates a board from horizontal and vertical wall bitboards, laid out the
+    # same way as h_walls and v_walls, without building a walls array
+    @staticmethod
+    def from_bits(h_walls: int, v_walls: int, p1: (int, int)=(4, 0), p2: (int, int)=(4, 8), \
+        p1_walls: int=10, p2_walls: int=10, eager: bool=False) -> "Board":
+        state = Board.__new__(Board)
+        state.h_walls, state.v_walls = h_walls, v_walls
+        state.__init_fields(p1, p2, p1_walls, p2_walls, eager)
+        return state
+
+    # Initializes everything but the walls
+    def __init_fields(self, p1: (int, int), p2: (int, int), p1_walls: int, p2_walls: int, \
+        eager: bool):
+        self._p1 = p1[1] * 9 + p1[0]
+        self._p2 = p2[1] * 9 + p2[0]
         self.p1_walls = p1_walls
         self.p2_walls = p2_walls
+        self._p1_field = None
+        self._p2_field = None
+        self._stale = 0
+        self._last_wall = None
+        self._undo = None
+
+        self._p1_dist = _UNKNOWN
+        self._p2_dist = _UNKNOWN
+        self._hash = None
+        if eager:
+            self.__field(True)
+            self.__field(False)
+            self._hash = self.__compute_hash()
+
+    # Length of player 1's shortest path to their goal row, or None if there is
+    # none
+    @property
+    def p1_dist(self) -> Optional[int]:
+        if self._p1_dist == _UNKNOWN:
+            self._p1_dist = self.shortest_path(True)
+        return self._p1_dist
+
+    @p1_dist.setter
+    def p1_dist(self, dist: Optional[int]):
+        self._p1_dist = dist
+
+    # Length of player 2's shortest path to their goal row, or None if there is
+    # none
+    @property
+    def p2_dist(self) -> Optional[int]:
+        if self._p2_dist == _UNKNOWN:
+            self._p2_dist = self.shortest_path(False)
+        return self._p2_dist
+
+    @p2_dist.setter
+    def p2_dist(self, dist: Optional[int]):
+        self._p2_dist = dist
+
+    # Zobrist hash code of the board, not including the player to move
+    @property
+    def hash(self) -> int:
+        if self._hash is None:
+            self._hash = self.__compute_hash()
+        return self._hash
+
+    # Position of player 1's pawn
+    @property
+    def p1(self) -> tuple[int, int]:
+        return _CELLS[self._p1]
+
+    @p1.setter
+    def p1(self, pos: tuple[int, int]):
+        self._p1 = pos[1] * 9 + pos[0]
+
+    # Position of player 2's pawn
+    @property
+    def p2(self) -> tuple[int, int]:
+        return _CELLS[self._p2]
+
+    @p2.setter
+    def p2(self, pos: tuple[int, int]):
+        self._p2 = pos[1] * 9 + pos[0]
+
+    # Returns the walls as a read-only (2, 8, 8) bool array, rebuilt from the
+    # bitboards. Writing to it raises ValueError rather than silently leaving
+    # the board unchanged; place walls with apply instead.
+    @property
+    def walls(self) -> np.ndarray:
+        walls = _unpack_walls(self.h_walls, self.v_walls)
+        walls.flags.writeable = False
+        return walls
+
+    # Returns whether a wall is placed in a given slot. Alignment 0 is
+    # horizontal and alignment 1 is vertical.
+    def has_wall(self, x: int, y: int, alignment: int) -> bool:
+        bits = self.v_walls if alignment else self.h_walls
+        return (bits >> (y * 8 + x)) & 1 == 1
 
-        # Precompute shortest paths and hash code
-        self.p1_dist = self.shortest_path(True)
-        self.p2_dist = self.shortest_path(False)
-        self.hash = hash((self.walls.data.tobytes(), self.p1, self.p2, self.p1_walls, self.p2_walls))
-    
     # Returns whether a wall is adjacent to a tile in a given direction.
-    def wall_adj(self, x: np.uint8, y: np.uint8, dir: _Dir) -> bool:
-        if dir == _Dir.UP:
-            if y == 8:
-                return False
-            if x == 0:
-                return self.walls[0][y][x]
-            if x == 8:
-                return self.walls[0][y][x-1]
-            return self.walls[0][y][x-1] or self.walls[0][y][x]
-
-        elif dir == _Dir.DOWN:
-            if y == 0:
-                return False
-            if x == 0:
-                return self.walls[0][y-1][x]
-            if x == 8:
-                return self.walls[0][y-1][x-1]
-            return self.walls[0][y-1][x-1] or self.walls[0][y-1][x]
-        
-        elif dir == _Dir.RIGHT:
-            if x == 8:
-                return False
-            if y == 0:
-                return self.walls[1][y][x]
-            if y == 8:
-                return self.walls[1][y-1][x]
-            return self.walls[1][y-1][x] or self.walls[1][y][x]
-        
-        elif dir == _Dir.LEFT:
-            if x == 0:
-                return False
-            if y == 0:
-                return self.walls[1][y][x-1]
-            if y == 8:
-                return self.walls[1][y-1][x-1]
-            return self.walls[1][y-1][x-1] or self.walls[1][y][x-1]
+    def wall_adj(self, x: int, y: int, dir: _Dir) -> bool:
+        return self.__blocked(y * 9 + x, dir.value)
+
+    # Returns whether the edge leaving a cell in a given direction is blocked by
+    # a wall. Edges leading off the board are never blocked.
+    def __blocked(self, cell: int, dir: int) -> bool:
+        bits = self.h_walls if dir < _RIGHT else self.v_walls
+        return bits & _EDGE_MASKS[dir][cell] != 0
     
     # Returns a list of all valid adjacent board states.
     def adj_states(self, p1_turn: bool) -> list["Board"]:
-        states = []
-
         # Handle movement and jumping. This is done before wall placement since
         # on average, moving is a very bad idea and will thus establish a good
         # lower bound for alpha-beta pruning.
-        ap, ip = (self.p1, self.p2) if p1_turn else (self.p2, self.p1)
-
-        # Jumping up
-        if ap[1] < 8:
-            # Check for wall
-            if not self.wall_adj(ap[0], ap[1], _Dir.UP):
-                # Check for inactive pawn
-                if (ap[0], ap[1] + 1) != ip:
-                    states.append(self.__move_pawn(p1_turn, ap[0], ap[1] + 1))
-                else:
-                    # Check whether straight jump can be performed
-                    if ap[1] < 7 and not self.wall_adj(ip[0], ip[1], _Dir.UP):
-                        states.append(self.__move_pawn(p1_turn, ap[0], ap[1] + 2))
-                    else:
-                        # Check whether left diagonal jump can be performed
-                        if ap[0] > 0 and not self.wall_adj(ip[0], ip[1], _Dir.LEFT):
-                            states.append(self.__move_pawn(p1_turn, ap[0] - 1, ap[1] + 1))
-                        # Check whether right diagonal jump can be performed
-                        if ap[0] < 8 and not self.wall_adj(ip[0], ip[1], _Dir.RIGHT):
-                            states.append(self.__move_pawn(p1_turn, ap[0] + 1, ap[1] + 1))
-        
-        # Jumping down
-        if ap[1] > 0:
-            # Check for wall
-            if not self.wall_adj(ap[0], ap[1], _Dir.DOWN):
-                # Check for inactive pawn
-                if (ap[0], ap[1] - 1) != ip:
-                    states.append(self.__move_pawn(p1_turn, ap[0], ap[1] - 1))
-                else:
-                    # Check whether straight jump can be performed
-                    if ap[1] > 1 and not self.wall_adj(ip[0], ip[1], _Dir.DOWN):
-                        states.append(self.__move_pawn(p1_turn, ap[0], ap[1] - 2))
-                    else:
-                        # Check whether left diagonal jump can be performed
-                        if ap[0] > 0 and not self.wall_adj(ip[0], ip[1], _Dir.LEFT):
-                            states.append(self.__move_pawn(p1_turn, ap[0] - 1, ap[1] - 1))
-                        # Check whether right diagonal jump can be performed
-                        if ap[0] < 8 and not self.wall_adj(ip[0], ip[1], _Dir.RIGHT):
-                            states.append(self.__move_pawn(p1_turn, ap[0] + 1, ap[1] - 1))
-        
-        # Jumping right
-        if ap[0] < 8:
-            # Check for wall
-            if not self.wall_adj(ap[0], ap[1], _Dir.RIGHT):
-                # Check for inactive pawn
-                if (ap[0] + 1, ap[1]) != ip:
-                    states.append(self.__move_pawn(p1_turn, ap[0] + 1, ap[1]))
-                else:
-                    # Check whether straight jump can be performed
-                    if ap[0] < 7 and not self.wall_adj(ip[0], ip[1], _Dir.RIGHT):
-                        states.append(self.__move_pawn(p1_turn, ap[0] + 2, ap[1]))
-                    else:
-                        # Check whether downward diagonal jump can be performed
-                        if ap[1] > 0 and not self.wall_adj(ip[0], ip[1], _Dir.DOWN):
-                            states.append(self.__move_pawn(p1_turn, ap[0] + 1, ap[1] - 1))
-                        # Check whether upward diagonal jump can be performed
-                        if ap[1] < 8 and not self.wall_adj(ip[0], ip[1], _Dir.UP):
-                            states.append(self.__move_pawn(p1_turn, ap[0] + 1, ap[1] + 1))
-
-        # Jumping left
-        if ap[0] > 0:
-            # Check for wall
-            if not self.wall_adj(ap[0], ap[1], _Dir.LEFT):
-                # Check for inactive pawn
-                if (ap[0] - 1, ap[1]) != ip:
-                    states.append(self.__move_pawn(p1_turn, ap[0] - 1, ap[1]))
-                else:
-                    # Check whether straight jump can be performed
-                    if ap[0] > 1 and not self.wall_adj(ip[0], ip[1], _Dir.LEFT):
-                        states.append(self.__move_pawn(p1_turn, ap[0] - 2, ap[1]))
-                    else:
-                        # Check whether downward diagonal jump can be performed
-                        if ap[1] > 0 and not self.wall_adj(ip[0], ip[1], _Dir.DOWN):
-                            states.append(self.__move_pawn(p1_turn, ap[0] - 1, ap[1] - 1))
-                        # Check whether upward diagonal jump can be performed
-                        if ap[1] < 8 and not self.wall_adj(ip[0], ip[1], _Dir.UP):
-                            states.append(self.__move_pawn(p1_turn, ap[0] - 1, ap[1] + 1))
+        states = self.pawn_states(p1_turn)
         
         # Ensure a wall can actually be placed
         active_walls = self.p1_walls if p1_turn else self.p2_walls
         if active_walls == 0:
             return states
 
-        # Order walls based on proximity to pawns
-        walls = []
-        for y in range(8):
-            for x in range(8):
-                prox = min(self.__prox(self.p1, x, y), self.__prox(self.p2, x, y))
-                heapq.heappush(walls, (prox, x, y))
+        # Find the wall slots which would cut each pawn's current shortest path.
+        # Any other wall leaves that pawn's distance unchanged.
+        h_walls, v_walls = self.h_walls, self.v_walls
+        p1_h_path, p1_v_path = self.path_walls(True)
+        p2_h_path, p2_v_path = self.path_walls(False)
 
         # Place walls
-        while walls:
-            _, x, y = heapq.heappop(walls)
-
-            # Horizontal wall
-            if not (self.wall_adj(x, y, _Dir.UP) or
-                self.wall_adj(x + 1, y, _Dir.UP) or self.walls[1][y][x]):
-                # Ensure wall placement is valid
-                state = self.__place_wall(p1_turn, x, y, 0)
-                state.p1_dist = state.shortest_path(True)
-                state.p2_dist = state.shortest_path(False)
-                if state.p1_dist != None and state.p2_dist != None:
-                    states.append(state)
-            
-            # Vertical wall
-            if not (self.wall_adj(x, y, _Dir.RIGHT) or
-                self.wall_adj(x, y + 1, _Dir.RIGHT) or
-                self.walls[0][y][x]):
-                # Ensure wall placement is valid
-                state = self.__place_wall(p1_turn, x, y, 1)
-                state.p1_dist = state.shortest_path(True)
-                state.p2_dist = state.shortest_path(False)
+        for slot in self.wall_order():
+            bit = 1 << slot
+            for alignment in (0, 1):
+                # Check for overlapping and crossing walls
+                h_mask, v_mask = _WALL_CONFLICTS[alignment][slot]
+                if h_walls & h_mask or v_walls & v_mask:
+                    continue
+
+                # Ensure wall placement is valid, only recomputing the distances
+                # of pawns whose shortest path is cut
+                state = self.__place_wall(p1_turn, slot, alignment)
+                if (p1_v_path if alignment else p1_h_path) & bit:
+                    state.p1_dist = state.shortest_path(True)
+                if (p2_v_path if alignment else p2_h_path) & bit:
+                    state.p2_dist = state.shortest_path(False)
                 if state.p1_dist != None and state.p2_dist != None:
                     states.append(state)
 
         return states
-    
-    # Determines whether a path to the end exists
-    def shortest_path(self, p1_turn: bool) -> Optional[float]:
-        open_list = []
-        closed_list = set()
-
-        # Add initial position to queue
-        ap = self.p1 if p1_turn else self.p2
-        target = 8 if p1_turn else 0
-        heapq.heappush(open_list, (abs(ap[1] - target), 0, ap[0], ap[1]))
-
-        # Loop over queue
-        while open_list:
-            elem = heapq.heappop(open_list)
-            dist = elem[1] + 1
-            x, y = elem[2], elem[3]
-            closed_list.add((x, y))
-            
-            # Check for completion
+
+    # Returns a list of the board states reachable by moving the active pawn,
+    # including jumps.
+    def pawn_states(self, p1_turn: bool) -> list["Board"]:
+        return [self.__move_pawn(p1_turn, cell) for cell in self.pawn_moves(p1_turn)]
+
+    # Returns the cells the active pawn can move to, including jumps. These are
+    # also the pawn moves' encodings.
+    def pawn_moves(self, p1_turn: bool) -> list[int]:
+        moves = []
+        ap, ip = (self._p1, self._p2) if p1_turn else (self._p2, self._p1)
+        for dir, side_a, side_b in _JUMP_ORDER:
+            # Check for edge of board and wall
+            dest = _NEIGHBORS[dir][ap]
+            if dest < 0 or self.__blocked(ap, dir):
+                continue
+
+            # Check for inactive pawn
+            if dest != ip:
+                moves.append(dest)
+                continue
+
+            # Check whether straight jump can be performed
+            dest = _NEIGHBORS[dir][ip]
+            if dest >= 0 and not self.__blocked(ip, dir):
+                moves.append(dest)
+                continue
+
+            # Check whether either diagonal jump can be performed
+            for side in (side_a, side_b):
+                dest = _NEIGHBORS[side][ip]
+                if dest >= 0 and not self.__blocked(ip, side):
+                    moves.append(dest)
+
+        return moves
+
+    # Yields the active player's moves in stages, without building any child
+    # states:
+    #
+    # 1. first, typically the best move from an earlier search, if it's legal.
+    # 2. Pawn moves.
+    # 3. Killer moves, if they're legal here.
+    # 4. Walls which cut the opponent's shortest path.
+    # 5. All other walls.
+    #
+    # Walls in the last two stages are ordered by history score, highest first,
+    # and then as in wall_order. history is indexed by move. Yielded walls are
+    # only checked for overlapping and crossing other walls. Whether they leave
+    # both pawns a path is checked by child, so a wall the consumer never
+    # reaches is never validated.
+    def moves(self, p1_turn: bool, first: Optional[int]=None, killers: tuple[int, ...]=(), \
+        history: Optional[list[int]]=None) -> Iterator[int]:
+        pawn_moves = self.pawn_moves(p1_turn)
+        yielded = set()
+        if first is not None and (first in pawn_moves or self.__wall_placeable(p1_turn, first)):
+            yielded.add(first)
+            yield first
+
+        for move in pawn_moves:
+            if not move in yielded:
+                yield move
+
+        # Ensure a wall can actually be placed
+        active_walls = self.p1_walls if p1_turn else self.p2_walls
+        if active_walls == 0:
+            return
+
+        for move in killers:
+            if not move in yielded and self.__wall_placeable(p1_turn, move):
+                yielded.add(move)
+                yield move
+
+        # Split walls by whether they lengthen the opponent's path
+        h_path, v_path = self.path_walls(not p1_turn)
+        on_path, off_path = [], []
+        for move in self.wall_moves(p1_turn):
+            alignment, slot = divmod(move - WALL_MOVES, 64)
+            if (v_path if alignment else h_path) >> slot & 1:
+                on_path.append(move)
+            else:
+                off_path.append(move)
+
+        for walls in (on_path, off_path):
+            if history is not None:
+                walls.sort(key=lambda move: -history[move])
+            for move in walls:
+                if not move in yielded:
+                    yield move
+
+    # Returns the wall placements which don't overlap or cross another wall, in
+    # the order adj_states tries them. Whether they leave both pawns a path
+    # isn't checked.
+    def wall_moves(self, p1_turn: bool) -> list[int]:
+        if (self.p1_walls if p1_turn else self.p2_walls) == 0:
+            return []
+
+        moves = []
+        h_walls, v_walls = self.h_walls, self.v_walls
+        for slot in self.wall_order():
+            for alignment in (0, 1):
+                h_mask, v_mask = _WALL_CONFLICTS[alignment][slot]
+                if not (h_walls & h_mask or v_walls & v_mask):
+                    moves.append(WALL_MOVES + alignment * 64 + slot)
+        return moves
+
+    # Applies a move to this board in place. If the move is a wall which would
+    # leave either pawn without a path, the board is left unchanged and False
+    # is returned. Every applied move must be reverted with undo, most recent
+    # first. The move must come from moves, or otherwise be known to be legal
+    # apart from leaving a path.
+    def apply(self, move: int, p1_turn: bool) -> bool:
+        saved = (self.h_walls, self.v_walls, self._p1, self._p2, self.p1_walls, \
+            self.p2_walls, self._p1_dist, self._p2_dist, self.hash, self._p1_field, \
+            self._p2_field, self._stale, self._last_wall)
+
+        # The moving pawn's distance is looked up once it's needed
+        if move < WALL_MOVES:
             if p1_turn:
-                if y == 7 and not self.wall_adj(x, y, _Dir.UP):
-                    return dist 
+                self._hash ^= _ZOBRIST_P1[self._p1] ^ _ZOBRIST_P1[move]
+                self._p1 = move
+                self._p1_dist = _UNKNOWN
             else:
-                if y == 1 and not self.wall_adj(x, y, _Dir.DOWN):
-                    return dist
-            
-            # Move up
-            if y < 8 and not self.wall_adj(x, y, _Dir.UP) and not (x, y + 1) in closed_list:
-                heapq.heappush(open_list, (abs(y + 1 - target) + dist, dist, x, y + 1))
-            
-            # Move down
-            if y > 0 and not self.wall_adj(x, y, _Dir.DOWN):
-                heapq.heappush(open_list, (abs(y - 1 - target) + dist, dist, x, y - 1))
-            
-            # Move right
-            if x < 8 and not self.wall_adj(x, y, _Dir.RIGHT) and not (x + 1, y) in closed_list:
-                heapq.heappush(open_list, (abs(y - target) + dist, dist, x + 1, y))
-            
-            # Move left
-            if x > 0 and not self.wall_adj(x, y, _Dir.LEFT) and not (x - 1, y) in closed_list:
-                heapq.heappush(open_list, (abs(y - target) + dist, dist, x - 1, y))
+                self._hash ^= _ZOBRIST_P2[self._p2] ^ _ZOBRIST_P2[move]
+                self._p2 = move
+                self._p2_dist = _UNKNOWN
+        else:
+            # Settle any pending repairs, since only one wall can be pending
+            self.__field(True)
+            self.__field(False)
+
+            alignment, slot = divmod(move - WALL_MOVES, 64)
+            if alignment == 0:
+                self.h_walls |= 1 << slot
+            else:
+                self.v_walls |= 1 << slot
+            if p1_turn:
+                self._hash ^= _ZOBRIST_P1_WALLS[self.p1_walls] ^ _ZOBRIST_P1_WALLS[self.p1_walls - 1]
+                self.p1_walls -= 1
+            else:
+                self._hash ^= _ZOBRIST_P2_WALLS[self.p2_walls] ^ _ZOBRIST_P2_WALLS[self.p2_walls - 1]
+                self.p2_walls -= 1
+            self._hash ^= _ZOBRIST_WALLS[alignment][slot]
+            self._stale = 3
+            self._last_wall = (alignment, slot)
+
+            self._p1_dist = self.shortest_path(True)
+            self._p2_dist = self.shortest_path(False)
+            if self._p1_dist == None or self._p2_dist == None:
+                self.__restore(saved)
+                return False
 
-        return None
+        if self._undo is None:
+            self._undo = []
+        self._undo.append(saved)
+        return True
+
+    # Reverts the most recent move applied with apply.
+    def undo(self):
+        self.__restore(self._undo.pop())
+
+    # Restores the fields saved by apply
+    def __restore(self, saved: tuple):
+        (self.h_walls, self.v_walls, self._p1, self._p2, self.p1_walls, self.p2_walls, \
+            self._p1_dist, self._p2_dist, self._hash, self._p1_field, self._p2_field, \
+            self._stale, self._last_wall) = saved
+
+    # Returns the state resulting from a move, or None if the move is a wall
+    # which would leave either pawn without a path. The move must come from
+    # moves, or otherwise be known to be legal apart from that.
+    def child(self, move: int, p1_turn: bool) -> Optional["Board"]:
+        if move < WALL_MOVES:
+            return self.__move_pawn(p1_turn, move)
+
+        alignment, slot = divmod(move - WALL_MOVES, 64)
+        state = self.__place_wall(p1_turn, slot, alignment)
+        state.p1_dist = state.shortest_path(True)
+        state.p2_dist = state.shortest_path(False)
+        if state.p1_dist == None or state.p2_dist == None:
+            return None
+        return state
+
+    # Returns whether a move is a wall placement the active player can make,
+    # ignoring whether it leaves both pawns a path
+    def __wall_placeable(self, p1_turn: bool, move: int) -> bool:
+        if not WALL_MOVES <= move < MOVE_COUNT or (self.p1_walls if p1_turn else self.p2_walls) == 0:
+            return False
+        alignment, slot = divmod(move - WALL_MOVES, 64)
+        h_mask, v_mask = _WALL_CONFLICTS[alignment][slot]
+        return not (self.h_walls & h_mask or self.v_walls & v_mask)
+
+    # Returns the wall slots ordered by proximity to the nearest pawn, with ties
+    # broken by x and then y. This is the order adj_states tries walls in, with
+    # a horizontal wall tried before a vertical wall in each slot.
+    def wall_order(self) -> list[int]:
+        p1_keys, p2_keys = _WALL_ORDER_KEYS[self._p1], _WALL_ORDER_KEYS[self._p2]
+        return sorted(range(64), key=lambda slot: min(p1_keys[slot], p2_keys[slot]))
+
+    # Places a wall in the given slot, returning the new state. The placement
+    # must not overlap or cross another wall. If the wall cuts off either pawn,
+    # the resulting state has a dist of None for that pawn.
+    def place_wall(self, p1_turn: bool, x: int, y: int, alignment: int) -> "Board":
+        state = self.__place_wall(p1_turn, y * 8 + x, alignment)
+        state.p1_dist = state.shortest_path(True)
+        state.p2_dist = state.shortest_path(False)
+        return state
+    
+    # Returns the length of the shortest path from a pawn to its goal row, or
+    # None if no path exists
+    def shortest_path(self, p1_turn: bool) -> Optional[int]:
+        dist = self.__field(p1_turn)[self._p1 if p1_turn else self._p2]
+        return None if dist == UNREACHABLE else dist
+
+    # Returns a player's distance field, indexed by packed cell index. Cells with
+    # no path to the goal row hold UNREACHABLE. The returned list is shared and
+    # must not be modified.
+    def distance_field(self, p1_turn: bool) -> list[int]:
+        return self.__field(p1_turn)
+
+    # Returns the wall slots which would cut one of a pawn's shortest paths, as
+    # horizontal and vertical bitboards. Placing any other wall leaves the
+    # pawn's distance unchanged.
+    def path_walls(self, p1_turn: bool) -> tuple[int, int]:
+        return _path_masks(self.__field(p1_turn), self._p1 if p1_turn else self._p2, \
+            self.h_walls, self.v_walls)
+
+    # Returns a player's distance field, computing or repairing it if needed
+    def __field(self, p1_turn: bool) -> list[int]:
+        flag = 1 if p1_turn else 2
+        field = self._p1_field if p1_turn else self._p2_field
+        if field is not None and not self._stale & flag:
+            return field
+
+        stats = _path_stats
+        if stats is not None:
+            start = time.perf_counter()
+        if field is None:
+            field = _distance_field(self.h_walls, self.v_walls, 8 if p1_turn else 0)
+            if stats is not None:
+                stats.searches += 1
+                stats.search_time += time.perf_counter() - start
+        else:
+            alignment, slot = self._last_wall
+            field = _repair_field(field, self.h_walls, self.v_walls, \
+                _WALL_EDGES[alignment][slot])
+            if stats is not None:
+                stats.repairs += 1
+                stats.repair_time += time.perf_counter() - start
+
+        self._stale &= ~flag
+        if p1_turn:
+            self._p1_field = field
+        else:
+            self._p2_field = field
+        return field
     
     # Checks whether this state is terminal
     def terminal(self):
@@ -244,57 +453,115 @@ class Board:
     # Compares boards. All fields except dist fields are compared, since those
     # are guaranteed to be the same if all other fields match.
     def __eq__(self, other):
-        # Check for None
-        if other == None:
+        if not isinstance(other, Board):
             return False
 
-        return (self.walls == other.walls).all() and self.p1 == other.p1 and \
-            self.p2 == other.p2 and self.p1_walls == other.p1_walls and \
-            self.p2_walls == other.p2_walls
+        return self.h_walls == other.h_walls and self.v_walls == other.v_walls \
+            and self._p1 == other._p1 and self._p2 == other._p2 and \
+            self.p1_walls == other.p1_walls and self.p2_walls == other.p2_walls
     
     def __hash__(self) -> int:
         return self.hash
 
+    # Returns the hash code of the board combined with the player to move, for
+    # keying positions in search tables
+    def key(self, p1_turn: bool) -> int:
+        return self.hash ^ _ZOBRIST_P1_TURN if p1_turn else self.hash
+
+    # Returns the state used for pickling and copying. Distance fields and the
+    # hash code are recomputed on demand rather than stored, and distances are
+    # stored as they are, so pickling never computes them.
+    def __getstate__(self) -> dict:
+        return {name: getattr(self, slot) for slot, name in _STATE_SLOTS}
+
+    # Restores a pickled board. Boards pickled before the bitboard
+    # representation store an ndarray under "walls" and tuple pawns. Older
+    # boards also store a hash which isn't a Zobrist hash, and is often stale,
+    # so the hash is always recomputed.
+    def __setstate__(self, state: dict):
+        if "walls" in state:
+            self.h_walls, self.v_walls = _pack_walls(state["walls"])
+            self.p1 = state["p1"]
+            self.p2 = state["p2"]
+            self.p1_walls = state["p1_walls"]
+            self.p2_walls = state["p2_walls"]
+            self._p1_dist = state["p1_dist"]
+            self._p2_dist = state["p2_dist"]
+        else:
+            for slot, name in _STATE_SLOTS:
+                setattr(self, slot, state[name])
+        self._hash = None
+        self._p1_field = None
+        self._p2_field = None
+        self._stale = 0
+        self._last_wall = None
+        self._undo = None
+
+    # Computes the Zobrist hash code from scratch. Children update their
+    # parent's hash code incrementally instead.
+    def __compute_hash(self) -> int:
+        h = _ZOBRIST_P1[self._p1] ^ _ZOBRIST_P2[self._p2] ^ \
+            _ZOBRIST_P1_WALLS[self.p1_walls] ^ _ZOBRIST_P2_WALLS[self.p2_walls]
+        for tables, bits in zip(_ZOBRIST_WALL_BYTES, (self.h_walls, self.v_walls)):
+            for table in tables:
+                if not bits:
+                    break
+                h ^= table[bits & 0xff]
+                bits >>= 8
+        return h
+
+    # Creates a shallow copy of the board. Every field is an immutable value or
+    # a distance field which is never modified in place, so this is all that's
+    # needed to derive a child state.
+    def __copy(self) -> "Board":
+        state = Board.__new__(Board)
+        state.h_walls = self.h_walls
+        state.v_walls = self.v_walls
+        state._p1 = self._p1
+        state._p2 = self._p2
+        state.p1_walls = self.p1_walls
+        state.p2_walls = self.p2_walls
+        state._p1_dist = self.p1_dist
+        state._p2_dist = self.p2_dist
+        state._hash = self.hash
+        state._p1_field = self.__field(True)
+        state._p2_field = self.__field(False)
+        state._stale = 0
+        state._last_wall = None
+        state._undo = None
+        return state
+
     # Places a wall, creating a new state
-    def __place_wall(self, p1_turn: bool, x: int, y: int, alignment: int) \
-        -> "Board":
-        state = deepcopy(self)
-        state.walls[alignment][y][x] = True
+    def __place_wall(self, p1_turn: bool, slot: int, alignment: int) -> "Board":
+        state = self.__copy()
+        if alignment == 0:
+            state.h_walls |= 1 << slot
+        else:
+            state.v_walls |= 1 << slot
         if p1_turn:
             state.p1_walls -= 1
+            state._hash ^= _ZOBRIST_P1_WALLS[self.p1_walls] ^ _ZOBRIST_P1_WALLS[state.p1_walls]
         else:
             state.p2_walls -= 1
+            state._hash ^= _ZOBRIST_P2_WALLS[self.p2_walls] ^ _ZOBRIST_P2_WALLS[state.p2_walls]
+        state._hash ^= _ZOBRIST_WALLS[alignment][slot]
+        state._stale = 3
+        state._last_wall = (alignment, slot)
         return state
     
     # Moves a pawn to a specified position
-    def __move_pawn(self, p1_turn: bool, x: int, y: int) -> "Board":
-        state = deepcopy(self)
+    def __move_pawn(self, p1_turn: bool, cell: int) -> "Board":
+        state = self.__copy()
         if p1_turn:
-            state.p1 = (x, y)
-            state.p1_dist = state.shortest_path(True)
+            state._p1 = cell
+            state._p1_dist = _UNKNOWN
+            state._hash ^= _ZOBRIST_P1[self._p1] ^ _ZOBRIST_P1[cell]
         else:
-            state.p2 = (x, y)
-            state.p2_dist = state.shortest_path(False)
+            state._p2 = cell
+            state._p2_dist = _UNKNOWN
+            state._hash ^= _ZOBRIST_P2[self._p2] ^ _ZOBRIST_P2[cell]
         return state
     
-    # Calculates the proximity of a wall to a pawn
-    def __prox(self, pawn: tuple[int, int], x: int, y: int) -> int:
-        prox = 0
-        
-        # Handle horizontal component
-        if x < pawn[0]:
-            prox += pawn[0] - x - 1
-        else:
-            prox += x - pawn[0]
-
-        # Handle vertical component
-        if y < pawn[1]:
-            prox += pawn[1] - y - 1
-        else:
-            prox += y - pawn[1]
-        
-        return prox
-
     def __str__(self):
         s = ""
         for y in range(8, -1, -1):
@@ -327,8 +594,8 @@ class Board:
                 
                 # Place corner
                 if x < 8 and y > 0:
-                    if y > 0 and (self.walls[0][y-1][x] or
-                        self.walls[1][y-1][x]):
+                    if y > 0 and (self.has_wall(x, y - 1, 0) or
+                        self.has_wall(x, y - 1, 1)):
                         s += '#'
                     else:
                         s += '+'
@@ -338,3 +605,289 @@ class Board:
         # Add wall counts
         s = f"{s}P1: {self.p1_walls:2}     P2: {self.p2_walls:2}"
         return s
+
+
+# Moves are encoded as ints. A pawn move is encoded as the packed index of the
+# cell the pawn moves to, and a wall placement as WALL_MOVES + alignment * 64 +
+# slot.
+WALL_MOVES = 81
+MOVE_COUNT = WALL_MOVES + 128
+
+# Encodes a pawn move to (x, y)
+def pawn_move(x: int, y: int) -> int:
+    return y * 9 + x
+
+# Encodes placing a wall in the slot at (x, y)
+def wall_move(x: int, y: int, alignment: int) -> int:
+    return WALL_MOVES + alignment * 64 + y * 8 + x
+
+# Distance field value of cells with no path to the goal row
+UNREACHABLE = 0xff
+
+# Marks a shortest path length which hasn't been looked up yet
+_UNKNOWN = -1
+
+# Counts of pathfinding work, collected while profiling is turned on with
+# profile_paths.
+#
+# searches, search_time: Distance fields computed from scratch, and seconds
+# spent on them.
+# repairs, repair_time: Distance fields repaired after a wall, and seconds
+# spent on them.
+class PathStats:
+    def __init__(self):
+        self.searches = 0
+        self.search_time = 0.0
+        self.repairs = 0
+        self.repair_time = 0.0
+
+# Pathfinding counts being collected, if any
+_path_stats = None
+
+# Starts counting pathfinding work in stats, or stops if stats is None.
+# Returns the stats that were being collected before.
+def profile_paths(stats: Optional[PathStats]) -> Optional[PathStats]:
+    global _path_stats
+    previous = _path_stats
+    _path_stats = stats
+    return previous
+
+# Slots holding the board state itself, rather than derived data, and the names
+# they're pickled under
+_STATE_SLOTS = (("h_walls", "h_walls"), ("v_walls", "v_walls"), ("_p1", "_p1"), ("_p2", "_p2"), \
+    ("p1_walls", "p1_walls"), ("p2_walls", "p2_walls"), ("_p1_dist", "p1_dist"), \
+    ("_p2_dist", "p2_dist"))
+
+# Zobrist keys for every wall placement, pawn position, wall count and the
+# player to move. The generator is seeded so hash codes are stable across
+# processes and can be stored on disk.
+_zobrist_random = random.Random(0x51d0c5)
+_ZOBRIST_WALLS = tuple(tuple(_zobrist_random.getrandbits(64) for _ in range(64)) \
+    for _ in range(2))
+_ZOBRIST_P1 = tuple(_zobrist_random.getrandbits(64) for _ in range(81))
+_ZOBRIST_P2 = tuple(_zobrist_random.getrandbits(64) for _ in range(81))
+_ZOBRIST_P1_WALLS = tuple(_zobrist_random.getrandbits(64) for _ in range(64))
+_ZOBRIST_P2_WALLS = tuple(_zobrist_random.getrandbits(64) for _ in range(64))
+_ZOBRIST_P1_TURN = _zobrist_random.getrandbits(64)
+
+# Combined Zobrist keys of every set of walls within each byte of a bitboard,
+# so a hash code can be computed a byte at a time. Indexed as
+# _ZOBRIST_WALL_BYTES[alignment][byte][bits].
+def _zobrist_byte(alignment: int, byte: int, bits: int) -> int:
+    h = 0
+    for bit in range(8):
+        if bits >> bit & 1:
+            h ^= _ZOBRIST_WALLS[alignment][byte * 8 + bit]
+    return h
+
+_ZOBRIST_WALL_BYTES = tuple(tuple(tuple(_zobrist_byte(alignment, byte, bits) for bits in range(256)) \
+    for byte in range(8)) for alignment in (0, 1))
+
+# Cell coordinates by packed cell index
+_CELLS = tuple((i % 9, i // 9) for i in range(81))
+
+# Direction values, for use in the precomputed tables
+_UP, _DOWN, _RIGHT, _LEFT = (dir.value for dir in _Dir)
+_DIRS = (_UP, _DOWN, _RIGHT, _LEFT)
+
+# Neighboring cell index of each cell in each direction, or -1 if the neighbor
+# would be off the board. Indexed as _NEIGHBORS[dir][cell].
+_NEIGHBORS = tuple(tuple(
+    (y + 1) * 9 + x if dir == _UP and y < 8 else
+    (y - 1) * 9 + x if dir == _DOWN and y > 0 else
+    y * 9 + x + 1 if dir == _RIGHT and x < 8 else
+    y * 9 + x - 1 if dir == _LEFT and x > 0 else -1
+    for y in range(9) for x in range(9)) for dir in _DIRS)
+
+# On-board neighbors of each cell, as (dir, cell) pairs
+_ADJ = tuple(tuple((dir, _NEIGHBORS[dir][cell]) for dir in _DIRS if _NEIGHBORS[dir][cell] >= 0) \
+    for cell in range(81))
+
+# Returns the bitboard of wall slots which block the edge leaving the tile at
+# (x, y) in a given direction. Up and down edges are blocked by horizontal
+# walls, and right and left edges are blocked by vertical walls.
+def _edge_mask(x: int, y: int, dir: int) -> int:
+    if dir == _UP or dir == _DOWN:
+        row = y if dir == _UP else y - 1
+        if row < 0 or row > 7:
+            return 0
+        return sum(1 << (row * 8 + wx) for wx in (x - 1, x) if 0 <= wx <= 7)
+    else:
+        col = x if dir == _RIGHT else x - 1
+        if col < 0 or col > 7:
+            return 0
+        return sum(1 << (wy * 8 + col) for wy in (y - 1, y) if 0 <= wy <= 7)
+
+# Wall slots blocking each edge. Indexed as _EDGE_MASKS[dir][cell].
+_EDGE_MASKS = tuple(tuple(_edge_mask(x, y, dir) for y in range(9) for x in range(9)) \
+    for dir in _DIRS)
+
+# Returns the horizontal and vertical wall slots which prevent a wall from being
+# placed in a slot, either by overlapping it or crossing it.
+def _wall_conflicts(slot: int, alignment: int) -> tuple[int, int]:
+    x, y = slot % 8, slot // 8
+    if alignment == 0:
+        return sum(1 << (y * 8 + wx) for wx in (x - 1, x, x + 1) if 0 <= wx <= 7), 1 << slot
+    else:
+        return 1 << slot, sum(1 << (wy * 8 + x) for wy in (y - 1, y, y + 1) if 0 <= wy <= 7)
+
+# Conflicting wall slots of each wall placement. Indexed as
+# _WALL_CONFLICTS[alignment][slot], and holding (h_mask, v_mask) pairs.
+_WALL_CONFLICTS = tuple(tuple(_wall_conflicts(slot, alignment) for slot in range(64)) \
+    for alignment in (0, 1))
+
+# Edges cut by each wall placement, as (cell, dir) pairs. Horizontal walls cut
+# the upward edges of the two cells below them, and vertical walls cut the
+# rightward edges of the two cells to their left. Indexed as
+# _WALL_EDGES[alignment][slot].
+_WALL_EDGES = tuple(tuple(
+    ((slot // 8 * 9 + slot % 8, _UP), (slot // 8 * 9 + slot % 8 + 1, _UP)) if alignment == 0 else
+    ((slot // 8 * 9 + slot % 8, _RIGHT), (slot // 8 * 9 + slot % 8 + 9, _RIGHT))
+    for slot in range(64)) for alignment in (0, 1))
+
+# Direction of a move, followed by the directions of the diagonal jumps to try
+# when a straight jump over the inactive pawn is blocked
+_JUMP_ORDER = ((_UP, _LEFT, _RIGHT), (_DOWN, _LEFT, _RIGHT), \
+    (_RIGHT, _DOWN, _UP), (_LEFT, _DOWN, _UP))
+
+# Calculates the proximity of a wall to a pawn
+def _prox(pawn: tuple[int, int], x: int, y: int) -> int:
+    prox = 0
+    
+    # Handle horizontal component
+    if x < pawn[0]:
+        prox += pawn[0] - x - 1
+    else:
+        prox += x - pawn[0]
+
+    # Handle vertical component
+    if y < pawn[1]:
+        prox += pawn[1] - y - 1
+    else:
+        prox += y - pawn[1]
+    
+    return prox
+
+# Sort keys for ordering wall placements by proximity to a pawn, with ties
+# broken by x and then y. Indexed as _WALL_ORDER_KEYS[cell][slot].
+_WALL_ORDER_KEYS = tuple(tuple(_prox(_CELLS[cell], slot % 8, slot // 8) * 64 + \
+    (slot % 8) * 8 + slot // 8 for slot in range(64)) for cell in range(81))
+
+# Computes a distance field by breadth-first search outward from a goal row
+def _distance_field(h_walls: int, v_walls: int, goal_row: int) -> list[int]:
+    field = [UNREACHABLE] * 81
+    frontier = list(range(goal_row * 9, goal_row * 9 + 9))
+    for cell in frontier:
+        field[cell] = 0
+
+    dist = 0
+    while frontier:
+        dist += 1
+        next_frontier = []
+        for cell in frontier:
+            for dir, dest in _ADJ[cell]:
+                if field[dest] == UNREACHABLE and \
+                    not (h_walls if dir < _RIGHT else v_walls) & _EDGE_MASKS[dir][cell]:
+                    field[dest] = dist
+                    next_frontier.append(dest)
+        frontier = next_frontier
+
+    return field
+
+# Repairs a distance field after a set of edges has been cut. Cutting edges can
+# only increase distances, and only for cells whose every shortest path used a
+# cut edge. Those cells are found first, and then only they are re-settled. The
+# original field is returned unchanged if no cut edge was on a shortest path.
+def _repair_field(field: list[int], h_walls: int, v_walls: int, \
+    edges: tuple[tuple[int, int], ...]) -> list[int]:
+    # Find the far end of each cut edge which lay on a shortest path
+    stack = []
+    for cell, dir in edges:
+        dest = _NEIGHBORS[dir][cell]
+        if field[cell] == field[dest] + 1:
+            stack.append(cell)
+        elif field[dest] == field[cell] + 1:
+            stack.append(dest)
+    if not stack:
+        return field
+
+    # Find every cell which has lost all of its shortest paths
+    affected = set()
+    while stack:
+        cell = stack.pop()
+        dist = field[cell]
+        if cell in affected or dist == 0:
+            continue
+
+        supported = False
+        for dir, dest in _ADJ[cell]:
+            if field[dest] == dist - 1 and not dest in affected and \
+                not (h_walls if dir < _RIGHT else v_walls) & _EDGE_MASKS[dir][cell]:
+                supported = True
+                break
+        if supported:
+            continue
+
+        affected.add(cell)
+        for dir, dest in _ADJ[cell]:
+            if field[dest] == dist + 1 and \
+                not (h_walls if dir < _RIGHT else v_walls) & _EDGE_MASKS[dir][cell]:
+                stack.append(dest)
+
+    # Re-settle the affected cells from their unaffected neighbors
+    field = field.copy()
+    open_list = []
+    for cell in affected:
+        best = UNREACHABLE
+        for dir, dest in _ADJ[cell]:
+            if not dest in affected and field[dest] + 1 < best and \
+                not (h_walls if dir < _RIGHT else v_walls) & _EDGE_MASKS[dir][cell]:
+                best = field[dest] + 1
+        field[cell] = best
+        if best != UNREACHABLE:
+            heapq.heappush(open_list, (best, cell))
+
+    while open_list:
+        dist, cell = heapq.heappop(open_list)
+        if dist > field[cell]:
+            continue
+        for dir, dest in _ADJ[cell]:
+            if field[dest] > dist + 1 and \
+                not (h_walls if dir < _RIGHT else v_walls) & _EDGE_MASKS[dir][cell]:
+                field[dest] = dist + 1
+                heapq.heappush(open_list, (dist + 1, dest))
+
+    return field
+
+# Returns the wall slots, as horizontal and vertical bitboards, which would cut
+# one shortest path from a cell to the goal row of a distance field
+def _path_masks(field: list[int], cell: int, h_walls: int, v_walls: int) -> tuple[int, int]:
+    h_mask, v_mask = 0, 0
+    dist = field[cell]
+    while 0 < dist < UNREACHABLE:
+        # Step to any neighbor one move closer to the goal row
+        for dir, dest in _ADJ[cell]:
+            if field[dest] == dist - 1 and \
+                not (h_walls if dir < _RIGHT else v_walls) & _EDGE_MASKS[dir][cell]:
+                break
+        if dir < _RIGHT:
+            h_mask |= _EDGE_MASKS[dir][cell]
+        else:
+            v_mask |= _EDGE_MASKS[dir][cell]
+        cell = dest
+        dist -= 1
+    return h_mask, v_mask
+
+# Packs a (2, 8, 8) walls array into horizontal and vertical bitboards
+def _pack_walls(walls: np.ndarray) -> tuple[int, int]:
+    if walls.shape != (2, 8, 8):
+        raise ValueError(f"walls of shape {walls.shape} don't match expected shape [2, 8, 8]")
+    packed = np.packbits(walls.reshape(2, 64).astype(bool), axis=1, bitorder="little")
+    return int.from_bytes(packed[0].tobytes(), "little"), \
+        int.from_bytes(packed[1].tobytes(), "little")
+
+# Unpacks horizontal and vertical bitboards into a (2, 8, 8) walls array
+def _unpack_walls(h_walls: int, v_walls: int) -> np.ndarray:
+    packed = np.frombuffer(h_walls.to_bytes(8, "little") + v_walls.to_bytes(8, "little"), \
+        dtype=np.uint8).reshape(2, 8)
+    return np.unpackbits(packed, axis=1, bitorder="little").astype(bool).reshape(2, 8, 8)
@@ -3,7 +3,32 @@
 # Author: Julia Kaeppel
 import numpy as np
 import pickle
+import struct
 import sys
+from typing import BinaryIO, Iterable, Optional, Union
+from quoridor import Board
+
+# Header of a length-prefixed frame: the length of its payload in bytes
+_FRAME_HEADER = struct.Struct(">I")
+
+# Binary board format. Each board is 20 bytes, little-endian:
+#
+# 0-7: Horizontal wall bits, bit y * 8 + x set for a wall in slot (x, y).
+# 8-15: Vertical wall bits, laid out the same way.
+# 16: Player 1's cell, y * 9 + x.
+# 17: Player 2's cell.
+# 18: Player 1's remaining walls in the low nibble, and player 2's in the high
+# nibble.
+# 19: Flags. Bit 0 is set on player 1's turn, and the rest are zero.
+_BOARD_STRUCT = struct.Struct("<QQBBBB")
+BOARD_SIZE = _BOARD_STRUCT.size
+
+# NumPy dtype of the binary board format, for encoding and decoding batches
+BOARD_DTYPE = np.dtype([("h_walls", "<u8"), ("v_walls", "<u8"), ("p1", "u1"), ("p2", "u1"), \
+    ("walls", "u1"), ("flags", "u1")])
+
+# Bytes accepted by the decoders
+Buffer = Union[bytes, bytearray, memoryview]
 
 class SerializableBoard:
     # Creates a SerializableBoard.
@@ -18,18 +43,159 @@ class SerializableBoard:
         self.p2_walls = p2_walls
         self.p1_turn = p1_turn
     
-    # Writes a SerializableBoard to a binary stream.
-    def write_board(self) -> bytes:
-        return pickle.dumps(self)
+    # Creates a SerializableBoard from a Board.
+    def from_board(board: Board, p1_turn: bool) -> "SerializableBoard":
+        return SerializableBoard(board.walls, board.p1, board.p2, board.p1_walls, \
+            board.p2_walls, p1_turn)
+
+    # Converts a SerializableBoard to a Board.
+    def to_board(self) -> Board:
+        return Board(self.walls, self.p1, self.p2, self.p1_walls, self.p2_walls)
+
+    # Writes a SerializableBoard to a binary stream, in the binary board
+    # format, or pickled if pickled is set.
+    def write_board(self, pickled: bool=False) -> bytes:
+        if pickled:
+            return pickle.dumps(self)
+        packed = np.packbits(self.walls.reshape(2, 64).astype(bool), axis=1, bitorder="little")
+        return _encode(int.from_bytes(packed[0].tobytes(), "little"), \
+            int.from_bytes(packed[1].tobytes(), "little"), self.p1, self.p2, \
+            self.p1_walls, self.p2_walls, self.p1_turn)
     
     # Outputs a SerializableBoard to stdout.
-    def output_board(self):
-        sys.stdout.buffer.write(self.write_board())
+    def output_board(self, pickled: bool=False):
+        sys.stdout.buffer.write(self.write_board(pickled))
     
-    # Reads a SerializableBoard from a binary stream.
-    def read_board(input: bytes) -> "SerializableBoard":
-        return pickle.loads(input)
+    # Reads a SerializableBoard from a binary stream. Pickled boards are only
+    # accepted if allow_pickle is set, since unpickling runs arbitrary code.
+    def read_board(input: Buffer, allow_pickle: bool=False) -> "SerializableBoard":
+        if is_pickled(input):
+            if not allow_pickle:
+                raise ValueError(f"expected a {BOARD_SIZE} byte board, got {len(input)} bytes")
+            return pickle.loads(input)
+
+        h_walls, v_walls, p1, p2, p1_walls, p2_walls, p1_turn = _decode(input)
+        packed = np.frombuffer(input, dtype=np.uint8, count=16).reshape(2, 8)
+        walls = np.unpackbits(packed, axis=1, bitorder="little").astype(bool).reshape(2, 8, 8)
+        return SerializableBoard(walls, p1, p2, p1_walls, p2_walls, p1_turn)
     
     # Reads a SerializableBoard from stdin.
-    def input_board() -> "SerializableBoard":
-        return pickle.loads(sys.stdin.buffer.read())
+    def input_board(allow_pickle: bool=False) -> "SerializableBoard":
+        return SerializableBoard.read_board(sys.stdin.buffer.read(), allow_pickle)
+
+    # Writes a SerializableBoard to a stream as a length-prefixed frame, so
+    # many boards can be sent over one stream.
+    def write_frame(self, stream: BinaryIO, pickled: bool=False):
+        write_frame(stream, self.write_board(pickled))
+
+    # Reads a length-prefixed SerializableBoard from a stream, or returns None
+    # if the stream has ended.
+    def read_frame(stream: BinaryIO, allow_pickle: bool=False) -> Optional["SerializableBoard"]:
+        data = read_frame(stream)
+        return None if data is None else SerializableBoard.read_board(data, allow_pickle)
+
+# Returns whether data holds a pickled board rather than the binary format
+def is_pickled(data: Buffer) -> bool:
+    return len(data) != BOARD_SIZE
+
+# Encodes a Board and the player to move in the binary board format.
+def encode_board(board: Board, p1_turn: bool) -> bytes:
+    return _encode(board.h_walls, board.v_walls, board.p1, board.p2, board.p1_walls, \
+        board.p2_walls, p1_turn)
+
+# Decodes a board in the binary board format straight into a Board, without
+# building a walls array. The board starts offset bytes into data. Returns the
+# board and whether it's player 1's turn.
+def decode_board(data: Buffer, offset: int=0) -> tuple[Board, bool]:
+    h_walls, v_walls, p1, p2, p1_walls, p2_walls, p1_turn = _decode(data, offset)
+    return (Board.from_bits(h_walls, v_walls, p1, p2, p1_walls, p2_walls), p1_turn)
+
+# Encodes many boards and the players to move as one contiguous buffer of
+# binary boards.
+def encode_boards(boards: Iterable[tuple[Board, bool]]) -> bytes:
+    return np.fromiter(((board.h_walls, board.v_walls, board.p1[1] * 9 + board.p1[0], \
+        board.p2[1] * 9 + board.p2[0], board.p1_walls | board.p2_walls << 4, int(p1_turn)) \
+        for board, p1_turn in boards), dtype=BOARD_DTYPE).tobytes()
+
+# Views a buffer of binary boards as a BOARD_DTYPE array, without copying it
+def view_boards(data: Buffer) -> np.ndarray:
+    return np.frombuffer(data, dtype=BOARD_DTYPE)
+
+# Decodes every board in a buffer of binary boards, yielding each Board and
+# whether it's player 1's turn.
+def decode_boards(data: Buffer) -> Iterable[tuple[Board, bool]]:
+    view = memoryview(data)
+    for offset in range(0, len(view) - BOARD_SIZE + 1, BOARD_SIZE):
+        yield decode_board(view, offset)
+
+# Writes many boards to a stream in the binary board format, encoding chunk
+# boards at a time.
+def write_boards(stream: BinaryIO, boards: Iterable[tuple[Board, bool]], chunk: int=4096):
+    batch = []
+    for board in boards:
+        batch.append(board)
+        if len(batch) == chunk:
+            stream.write(encode_boards(batch))
+            batch = []
+    if batch:
+        stream.write(encode_boards(batch))
+
+# Packs board fields into the binary board format
+def _encode(h_walls: int, v_walls: int, p1: (int, int), p2: (int, int), p1_walls: int, \
+    p2_walls: int, p1_turn: bool) -> bytes:
+    return _BOARD_STRUCT.pack(h_walls, v_walls, p1[1] * 9 + p1[0], p2[1] * 9 + p2[0], \
+        p1_walls | p2_walls << 4, int(p1_turn))
+
+# Unpacks and validates board fields from the binary board format
+def _decode(data: Buffer, offset: int=0) -> tuple[int, int, tuple[int, int], \
+    tuple[int, int], int, int, bool]:
+    if len(data) - offset < BOARD_SIZE:
+        raise ValueError(f"expected a {BOARD_SIZE} byte board, got {len(data) - offset} bytes")
+    h_walls, v_walls, p1, p2, walls, flags = _BOARD_STRUCT.unpack_from(data, offset)
+    p1_walls, p2_walls = walls & 0xf, walls >> 4
+    if p1 >= 81 or p2 >= 81 or p1 == p2:
+        raise ValueError(f"invalid pawn cells {p1} and {p2}")
+    if p1_walls > 10 or p2_walls > 10:
+        raise ValueError(f"invalid wall counts {p1_walls} and {p2_walls}")
+    if flags & ~1:
+        raise ValueError(f"invalid flags {flags:#x}")
+    return (h_walls, v_walls, (p1 % 9, p1 // 9), (p2 % 9, p2 // 9), p1_walls, p2_walls, \
+        bool(flags & 1))
+
+# Writes a length-prefixed frame to a stream, and flushes it.
+def write_frame(stream: BinaryIO, data: bytes):
+    stream.write(_FRAME_HEADER.pack(len(data)) + data)
+    stream.flush()
+
+# Reads a length-prefixed frame from a stream, or returns None if the stream
+# ended before another frame began.
+def read_frame(stream: BinaryIO) -> Optional[bytes]:
+    header = _read_exactly(stream, _FRAME_HEADER.size)
+    if not header:
+        return None
+    size = _FRAME_HEADER.unpack(header)[0] if len(header) == _FRAME_HEADER.size else -1
+    data = _read_exactly(stream, size) if size >= 0 else b""
+    if len(data) != size:
+        raise EOFError("stream ended partway through a frame")
+    return data
+
+# Splits the first length-prefixed frame off the front of a buffer, returning
+# its payload and the bytes after it, or None if the buffer doesn't hold a whole
+# frame yet.
+def split_frame(data: bytes) -> Optional[tuple[bytes, bytes]]:
+    if len(data) < _FRAME_HEADER.size:
+        return None
+    end = _FRAME_HEADER.size + _FRAME_HEADER.unpack_from(data)[0]
+    if len(data) < end:
+        return None
+    return (data[_FRAME_HEADER.size:end], data[end:])
+
+# Reads up to size bytes from a stream, stopping early only if it ends
+def _read_exactly(stream: BinaryIO, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
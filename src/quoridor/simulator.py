@@ -0,0 +1,297 @@
+# Batched game simulator.
+#
+# Holds a batch of games as NumPy arrays and advances every game by one move at
+# a time, for rollouts and self-play at scale. The arrays are shaped like those
+# of columnar.ColumnarDataSet, so batches can be loaded from datasets and
+# encoded for models with evaluator.encode directly.
+#
+# Author: Julia Kaeppel
+import numpy as np
+import sys
+import time
+from quoridor import Board, MOVE_COUNT, UNREACHABLE, WALL_MOVES
+from evaluator import encode
+from typing import Optional
+import vectorized
+
+# Moves as (dx, dy), and the sideways directions to try when jumping straight
+# over the other pawn is blocked
+_STEPS = ((0, 1), (0, -1), (1, 0), (-1, 0))
+_SIDES = (((-1, 0), (1, 0)), ((-1, 0), (1, 0)), ((0, -1), (0, 1)), ((0, -1), (0, 1)))
+
+# Every single wall placement as a (2, 8, 8) walls array, indexed by placement
+_PLACEMENTS = np.eye(128, dtype=bool).reshape(128, 2, 8, 8)
+
+# A batch of games. Games which have ended are left as they are by step.
+#
+# walls: (n, 2, 8, 8) bool walls arrays, as Board.walls.
+# pawns: (n, 2, 2) (x, y) positions of player 1's and player 2's pawns.
+# wall_counts: (n, 2) remaining walls of player 1 and player 2.
+# p1_turn: (n,) whether it's player 1's turn.
+# turns: (n,) moves played in each game since the batch was created.
+class GameBatch:
+    def __init__(self, walls: np.ndarray, pawns: np.ndarray, wall_counts: np.ndarray, \
+        p1_turn: np.ndarray):
+        self.walls = np.array(walls, dtype=bool)
+        self.pawns = np.array(pawns, dtype=np.int64)
+        self.wall_counts = np.array(wall_counts, dtype=np.int64)
+        self.p1_turn = np.array(p1_turn, dtype=bool)
+        self.turns = np.zeros(len(self.walls), dtype=np.int64)
+
+    # Creates a batch of n games at the starting position
+    @staticmethod
+    def new(n: int) -> "GameBatch":
+        return GameBatch(np.zeros((n, 2, 8, 8), dtype=bool), np.tile([[4, 0], [4, 8]], (n, 1, 1)), \
+            np.full((n, 2), 10), np.ones(n, dtype=bool))
+
+    # Creates a batch from a list of states and whose turn it is in each
+    @staticmethod
+    def from_boards(states: list[tuple[Board, bool]]) -> "GameBatch":
+        return GameBatch(np.array([state.walls for state, _ in states]).reshape(-1, 2, 8, 8), \
+            np.array([[state.p1, state.p2] for state, _ in states]).reshape(-1, 2, 2), \
+            np.array([[state.p1_walls, state.p2_walls] for state, _ in states]).reshape(-1, 2), \
+            np.array([p1_turn for _, p1_turn in states], dtype=bool))
+
+    def __len__(self) -> int:
+        return len(self.walls)
+
+    # Builds the Board of a single game, and whether it's player 1's turn
+    def board(self, i: int) -> tuple[Board, bool]:
+        (p1_x, p1_y), (p2_x, p2_y) = self.pawns[i].tolist()
+        p1_walls, p2_walls = self.wall_counts[i].tolist()
+        return (Board(self.walls[i], (p1_x, p1_y), (p2_x, p2_y), p1_walls, p2_walls), \
+            bool(self.p1_turn[i]))
+
+    # Encodes every game for a model, as evaluator.encode
+    def encode(self) -> np.ndarray:
+        return encode(self.walls, self.pawns, self.wall_counts, self.p1_turn)
+
+    # Returns whether each game has ended
+    def terminal(self) -> np.ndarray:
+        return (self.pawns[:, 0, 1] == 8) | (self.pawns[:, 1, 1] == 0)
+
+    # Returns whether player 1 has won each game
+    def p1_won(self) -> np.ndarray:
+        return self.pawns[:, 0, 1] == 8
+
+    # Returns the shortest path length of each player in each game, as an
+    # (n, 2) array, with UNREACHABLE for a walled off pawn
+    def distances(self) -> np.ndarray:
+        n = len(self)
+        dist = vectorized.path_lengths(np.concatenate([self.walls, self.walls]), \
+            np.repeat([8, 0], n), self.pawns[:, :, 0].T.ravel(), self.pawns[:, :, 1].T.ravel())
+        return dist.reshape(2, n).T
+
+    # Returns the cells each game's active pawn can move to, jumps included,
+    # as an (n, 81) bool mask indexed by pawn move
+    def pawn_mask(self) -> np.ndarray:
+        n = len(self)
+        boards = np.arange(n)
+        vertical, horizontal = vectorized.open_edges(self.walls)
+        mover = np.where(self.p1_turn, 0, 1)
+        ax, ay = self.pawns[boards, mover].T
+        ix, iy = self.pawns[boards, 1 - mover].T
+
+        mask = np.zeros((n, 81), dtype=bool)
+        for step, sides in zip(_STEPS, _SIDES):
+            # Check for edge of board and wall
+            can_move = _can_step(vertical, horizontal, ax, ay, step)
+            dx, dy = step
+            blocked = (ax + dx == ix) & (ay + dy == iy)
+            free = can_move & ~blocked
+            mask[boards[free], ((ay + dy) * 9 + ax + dx)[free]] = True
+
+            # Jump straight over the other pawn if possible, and diagonally
+            # otherwise
+            jumping = can_move & blocked
+            straight = jumping & _can_step(vertical, horizontal, ix, iy, step)
+            mask[boards[straight], ((iy + dy) * 9 + ix + dx)[straight]] = True
+            for sx, sy in sides:
+                diagonal = jumping & ~straight & _can_step(vertical, horizontal, ix, iy, (sx, sy))
+                mask[boards[diagonal], ((iy + sy) * 9 + ix + sx)[diagonal]] = True
+        return mask
+
+    # Returns the walls each game's active player could place without
+    # overlapping or crossing another, as an (n, 128) bool mask indexed by wall
+    # placement. Whether each leaves both pawns a path isn't checked.
+    def placeable_mask(self) -> np.ndarray:
+        placeable = vectorized.placeable_walls(self.walls).reshape(-1, 128)
+        mover = np.where(self.p1_turn, 0, 1)
+        return placeable & (self.wall_counts[np.arange(len(self)), mover] > 0)[:, np.newaxis]
+
+    # Returns every game's legal moves, as an (n, MOVE_COUNT) bool mask indexed
+    # by move. Only placeable walls which cut a shortest path of either pawn
+    # can leave it without a path, so only those are searched, all at once.
+    def legal_mask(self) -> np.ndarray:
+        n = len(self)
+        walls = self.placeable_mask()
+        vertical, horizontal = vectorized.open_edges(self.walls)
+        fields = vectorized.distance_fields(np.concatenate([self.walls, self.walls]), \
+            np.repeat([8, 0], n))
+        cut = _path_cuts(fields[:n], vertical, horizontal, self.pawns[:, 0]) | \
+            _path_cuts(fields[n:], vertical, horizontal, self.pawns[:, 1])
+
+        games, placements = np.nonzero(walls & cut)
+        walls[games, placements] = self.__leaves_paths(games, placements)
+        return np.concatenate([self.pawn_mask(), walls], axis=1)
+
+    # Picks a uniformly random legal move in each game, as an (n,) array of
+    # moves, with -1 for games which have ended or have no legal move. Random
+    # placeable walls are checked for leaving both pawns a path, and games
+    # which drew a wall that doesn't are drawn again. With probability greedy,
+    # a game plays the pawn move which shortens its path the most instead.
+    def random_moves(self, rng: np.random.Generator, greedy: float=0.0) -> np.ndarray:
+        n = len(self)
+        legal = np.concatenate([self.pawn_mask(), self.placeable_mask()], axis=1)
+        legal[self.terminal()] = False
+        moves = np.full(n, -1)
+        games = np.arange(n)
+        while len(games):
+            # The largest random key among a game's legal moves is uniform
+            keys = np.where(legal[games], rng.random((len(games), MOVE_COUNT)), -1.0)
+            picks = np.argmax(keys, axis=1)
+            has_move = keys[np.arange(len(games)), picks] >= 0
+            games, picks = games[has_move], picks[has_move]
+            moves[games] = picks
+
+            is_wall = picks >= WALL_MOVES
+            wall_games, placements = games[is_wall], picks[is_wall] - WALL_MOVES
+            ok = self.__leaves_paths(wall_games, placements)
+            legal[wall_games[~ok], picks[is_wall][~ok]] = False
+            moves[wall_games[~ok]] = -1
+            games = wall_games[~ok]
+
+        if greedy > 0:
+            chosen = np.flatnonzero((rng.random(n) < greedy) & (moves >= 0))
+            moves[chosen] = self.greedy_moves(chosen)
+        return moves
+
+    # Picks the pawn move which leaves the active pawn closest to its goal in
+    # each given game, or every game if none are given. Ties go to the lowest
+    # cell.
+    def greedy_moves(self, games: Optional[np.ndarray]=None) -> np.ndarray:
+        if games is None:
+            games = np.arange(len(self))
+        fields = vectorized.distance_fields(self.walls[games], np.where(self.p1_turn[games], 8, 0))
+        dist = np.where(self.pawn_mask()[games], fields.reshape(-1, 81), UNREACHABLE + 1)
+        return np.argmin(dist, axis=1)
+
+    # Plays a move in each game. Moves must be legal, and are ignored for games
+    # which have ended. A move of -1 passes the turn.
+    def step(self, moves: np.ndarray):
+        n = len(self)
+        moves = np.asarray(moves)
+        live = ~self.terminal()
+        mover = np.where(self.p1_turn, 0, 1)
+
+        pawn = np.flatnonzero(live & (moves >= 0) & (moves < WALL_MOVES))
+        self.pawns[pawn, mover[pawn], 0] = moves[pawn] % 9
+        self.pawns[pawn, mover[pawn], 1] = moves[pawn] // 9
+
+        wall = np.flatnonzero(live & (moves >= WALL_MOVES))
+        self.walls.reshape(n, 128)[wall, moves[wall] - WALL_MOVES] = True
+        self.wall_counts[wall, mover[wall]] -= 1
+
+        self.p1_turn[live] = ~self.p1_turn[live]
+        self.turns[live] += 1
+
+    # Puts the given games back at the starting position, so a finished game's
+    # slot can be reused by a new one
+    def restart(self, games: np.ndarray):
+        self.walls[games] = False
+        self.pawns[games] = [[4, 0], [4, 8]]
+        self.wall_counts[games] = 10
+        self.p1_turn[games] = True
+        self.turns[games] = 0
+
+    # Plays random moves until every game has ended or max_turns moves have
+    # been played, as random_moves
+    def play(self, rng: np.random.Generator, greedy: float=0.0, max_turns: Optional[int]=None):
+        while not self.terminal().all():
+            if max_turns is not None and self.turns.max() >= max_turns:
+                break
+            self.step(self.random_moves(rng, greedy))
+
+    # Returns whether placing a wall in each given game leaves both pawns a
+    # path. games and placements are matching arrays of game indices and wall
+    # placements.
+    def __leaves_paths(self, games: np.ndarray, placements: np.ndarray) -> np.ndarray:
+        k = len(games)
+        if k == 0:
+            return np.zeros(0, dtype=bool)
+        walls = self.walls[games] | _PLACEMENTS[placements]
+        pawns = self.pawns[games]
+        dist = vectorized.path_lengths(np.concatenate([walls, walls]), np.repeat([8, 0], k), \
+            pawns[:, :, 0].T.ravel(), pawns[:, :, 1].T.ravel())
+        return (dist != UNREACHABLE).reshape(2, k).all(axis=0)
+
+# Returns whether each pawn can step in a direction, given the open edges of
+# vectorized.open_edges
+def _can_step(vertical: np.ndarray, horizontal: np.ndarray, x: np.ndarray, y: np.ndarray, \
+    step: tuple[int, int]) -> np.ndarray:
+    boards = np.arange(len(x))
+    dx, dy = step
+    if dy == 1:
+        return (y < 8) & vertical[boards, np.minimum(y, 7), x]
+    if dy == -1:
+        return (y > 0) & vertical[boards, np.maximum(y - 1, 0), x]
+    if dx == 1:
+        return (x < 8) & horizontal[boards, y, np.minimum(x, 7)]
+    return (x > 0) & horizontal[boards, y, np.maximum(x - 1, 0)]
+
+# Follows a shortest path from each pawn down its distance field, returning the
+# walls which would cut it as an (n, 128) bool mask indexed by wall placement.
+# Walled off pawns have no path, and nothing is marked for them.
+def _path_cuts(fields: np.ndarray, vertical: np.ndarray, horizontal: np.ndarray, \
+    pawns: np.ndarray) -> np.ndarray:
+    n = len(fields)
+    boards = np.arange(n)
+    cut = np.zeros((n, 2, 8, 8), dtype=bool)
+    x, y = pawns[:, 0].copy(), pawns[:, 1].copy()
+    dist = fields[boards, y, x]
+    walking = (dist > 0) & (dist != UNREACHABLE)
+    while walking.any():
+        # Take the first step which leads one cell closer to the goal
+        taken = np.zeros(n, dtype=bool)
+        for dx, dy in _STEPS:
+            nx, ny = np.clip(x + dx, 0, 8), np.clip(y + dy, 0, 8)
+            step = walking & ~taken & _can_step(vertical, horizontal, x, y, (dx, dy)) & \
+                (fields[boards, ny, nx] == dist - 1)
+            b = boards[step]
+            if dy != 0:
+                # Horizontal walls left and right of the edge's midpoint
+                row = np.minimum(y, ny)[step]
+                for wx in (x[step] - 1, x[step]):
+                    ok = (wx >= 0) & (wx <= 7)
+                    cut[b[ok], 0, row[ok], wx[ok]] = True
+            else:
+                # Vertical walls below and above the edge's midpoint
+                col = np.minimum(x, nx)[step]
+                for wy in (y[step] - 1, y[step]):
+                    ok = (wy >= 0) & (wy <= 7)
+                    cut[b[ok], 1, wy[ok], col[ok]] = True
+            x[step], y[step] = nx[step], ny[step]
+            taken |= step
+        dist = np.where(taken, dist - 1, dist)
+        walking &= dist > 0
+    return cut.reshape(n, 128)
+
+# Times random self-play over a batch of games, printing simulated moves per
+# minute. Finished games are restarted, so the batch stays full.
+def benchmark(n: int=4096, steps: int=200, greedy: float=0.0, seed: int=0):
+    rng = np.random.default_rng(seed)
+    games = GameBatch.new(n)
+    start = time.perf_counter()
+    for _ in range(steps):
+        games.restart(games.terminal())
+        games.step(games.random_moves(rng, greedy))
+    elapsed = time.perf_counter() - start
+    print(f"{n} games, {steps} steps: {n * steps / elapsed * 60:,.0f} moves/minute")
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 4096
+    greedy = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    benchmark(n, greedy=greedy)
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,30 @@
 #
 # Author: Julia Kaeppel
 import pickle
+import columnar
+from indexed_set import IndexedSet
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from quoridor import Board
 import minimax
 import random
+import struct
 import time
 import os
+from serializable_board import decode_board, encode_board
+from typing import Iterable, Optional
+
+# A journal is compacted once it holds this many records per live state
+JOURNAL_COMPACT_FACTOR = 4
+
+# Journal record layout: a board and its turn in the binary board format, the
+# set it's now in, its score (NaN for none) and its score priority
+_RECORD = struct.Struct("<20sBfH")
+
+# Journal record sets. A swap record marks the processed set becoming the
+# unprocessed set, and has an empty board.
+_UNPROCESSED = 0
+_PROCESSED = 1
+_SWAP = 2
 
 # Training data information for a board state
 class StateInfo:
@@ -21,13 +40,50 @@ class StateInfo:
 class DataSet:
     # Initializes a Dataset.
     def __init__(self):
-        self.valid = dict()
-        self.processed = dict()
-        self.unprocessed = dict()
+        self.valid = IndexedSet()
+        self.processed = IndexedSet()
+        self.unprocessed = IndexedSet()
         self.processed_prio = 0
+        self.journal = None
         key = (Board(), True)
         self.unprocessed[key] = StateInfo()
 
+    # Loads a dataset by replaying a journal, and keeps appending to it.
+    def from_journal(path: str) -> "DataSet":
+        dataset = DataSet.__new__(DataSet)
+        dataset.valid = IndexedSet()
+        dataset.processed = IndexedSet()
+        dataset.unprocessed = IndexedSet()
+        dataset.processed_prio = 0
+        dataset.journal = None
+        Journal.replay(path, dataset)
+        dataset.journal = Journal(path)
+        return dataset
+
+    # Starts recording changes to a journal, which autosaves then append to
+    # instead of pickling the whole dataset. A journal which doesn't exist yet
+    # is started with every current state.
+    def open_journal(self, path: str):
+        self.journal = Journal(path)
+        if self.journal.records == 0:
+            self.journal.compact(self)
+
+    # Journals aren't pickled
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state.pop("journal", None)
+        return state
+
+    # Restores a pickled dataset. Datasets pickled before IndexedSet store
+    # plain dicts, which are converted, keeping the StateInfo objects shared
+    # between valid and the other sets.
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        for name in ("valid", "processed", "unprocessed"):
+            if isinstance(getattr(self, name), dict):
+                setattr(self, name, IndexedSet(getattr(self, name)))
+        self.journal = None
+
     # Generates new states up to the target size. autosave_interval is measured
     # in seconds. progress_interval is measured in datapoints generated.
     def gen_states(self, target_size: int, directory: str, autosave_interval: int=60, progress_interval: int=100):
@@ -38,14 +94,17 @@ class DataSet:
             # processed states
             if len(self.unprocessed) == 0:
                 self.unprocessed = self.processed
-                self.processed = dict()
+                self.processed = IndexedSet()
+                if self.journal is not None:
+                    self.journal.swap()
             
             # Select a random state to process, removing it from the unprocessed list
-            key = random.choice(list(self.unprocessed.keys()))
+            key = self.unprocessed.sample()
             state_info = self.unprocessed[key]
             del self.unprocessed[key]
 
-            # Update score priority and calculate score
+            # Update score priority and calculate score. The search applies and
+            # undoes moves on the stored board itself, leaving it unchanged.
             board = key[0]
             p1_turn = key[1]
             state_info.score_prio += 1
@@ -56,23 +115,8 @@ class DataSet:
             if state_info.score_prio == 1:
                 state_info.score = score
             
-            # Add state to valid set
-            self.valid[key] = state_info
-
-            # Add state to either unprocessed or processed set based on prio
-            if state_info.score_prio < self.processed_prio:
-                self.unprocessed[key] = state_info
-            else:
-                self.processed[key] = state_info
-
-            # Update processed_prio if a new max has been reached
-            if state_info.score_prio > self.processed_prio:
-                self.processed_prio = state_info.score_prio
-            
-            # Add child to unprocessed set if not already contained
-            child_key = (child, not p1_turn)
-            if not (child_key in self.valid or child_key in self.unprocessed):
-                self.unprocessed[child_key] = StateInfo()
+            self.__record(key, state_info, child, \
+                lambda key: key in self.valid or key in self.unprocessed)
 
             # Print progress
             if len(self.valid) > max_len and len(self.valid) % progress_interval == 0:
@@ -82,12 +126,140 @@ class DataSet:
             # Autosave if necessary
             curr_time = time.time()
             if autosave_time > 0 and curr_time - autosave_time >= autosave_interval:
-                self.save(directory + f"/d{minimax.MAX_DEPTH}-autosave")
+                self.__autosave(directory)
                 autosave_time = time.time()
         
         # Create final save
+        if self.journal is not None:
+            self.journal.flush()
         self.save(directory + f"/d{minimax.MAX_DEPTH}-{len(self.valid)}")
     
+    # Generates new states up to the target size like gen_states, searching
+    # several states at once across a pool of worker processes. The
+    # coordinator hands each worker a state, then merges its score and child
+    # back in the same way gen_states does, so score_prio is handled the same.
+    #
+    # New children are deduplicated against an index of the Zobrist key of
+    # every state ever queued, including those still being searched, rather
+    # than by hashing whole boards.
+    def gen_states_parallel(self, target_size: int, directory: str, workers: Optional[int]=None, \
+        autosave_interval: int=60, progress_interval: int=100):
+        workers = workers if workers is not None else os.cpu_count()
+        known = {board.key(p1_turn) for board, p1_turn in self.valid}
+        known.update(board.key(p1_turn) for board, p1_turn in self.unprocessed)
+
+        # Adds a state to the index, returning whether it was already there
+        def seen(key: tuple[Board, bool]) -> bool:
+            zobrist = key[0].key(key[1])
+            if zobrist in known:
+                return True
+            known.add(zobrist)
+            return False
+
+        start = time.time()
+        autosave_time = start
+        max_len = 0
+        counts = dict()
+        pending = dict()
+        with ProcessPoolExecutor(workers) as executor:
+            while len(self.valid) < target_size:
+                # Keep every worker busy, plus one queued state each
+                while len(pending) < workers * 2:
+                    if len(self.unprocessed) == 0:
+                        # Wait for states in flight before reprocessing old ones
+                        if pending:
+                            break
+                        self.unprocessed = self.processed
+                        self.processed = IndexedSet()
+                        if self.journal is not None:
+                            self.journal.swap()
+
+                    # Select a random state to process, removing it from the
+                    # unprocessed list
+                    key = self.unprocessed.sample()
+                    state_info = self.unprocessed[key]
+                    del self.unprocessed[key]
+                    state_info.score_prio += 1
+                    future = executor.submit(_gen_state, key[0], key[1], state_info.score_prio)
+                    pending[future] = (key, state_info)
+
+                # Merge finished searches
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key, state_info = pending.pop(future)
+                    score, child, pid = future.result()
+                    counts[pid] = counts.get(pid, 0) + 1
+                    if state_info.score_prio == 1:
+                        state_info.score = score
+                    self.__record(key, state_info, child, seen)
+
+                # Print progress
+                if len(self.valid) > max_len and len(self.valid) // progress_interval > \
+                    max_len // progress_interval:
+                    max_len = len(self.valid)
+                    elapsed = time.time() - start
+                    rates = ", ".join(f"{count / elapsed:.1f}" for count in counts.values())
+                    print(f"{max_len}/{target_size} ({sum(counts.values()) / elapsed:.1f} " \
+                        f"positions/s, per worker: {rates})")
+
+                # Autosave if necessary
+                curr_time = time.time()
+                if autosave_time > 0 and curr_time - autosave_time >= autosave_interval:
+                    self.__autosave(directory, pending.values())
+                    autosave_time = time.time()
+
+            # Return states still in flight to the unprocessed set
+            for future in pending:
+                future.cancel()
+                key, state_info = pending[future]
+                state_info.score_prio -= 1
+                self.unprocessed[key] = state_info
+
+        # Create final save
+        if self.journal is not None:
+            self.journal.flush()
+        self.save(directory + f"/d{minimax.MAX_DEPTH}-{len(self.valid)}")
+
+    # Adds a processed state to the valid set, and to the unprocessed or
+    # processed set based on its priority. Its child is queued for processing
+    # unless seen reports it's already known.
+    def __record(self, key: tuple[Board, bool], state_info: StateInfo, child: Board, seen):
+        # Add state to valid set
+        self.valid[key] = state_info
+
+        # Add state to either unprocessed or processed set based on prio
+        processed = state_info.score_prio >= self.processed_prio
+        if processed:
+            self.processed[key] = state_info
+        else:
+            self.unprocessed[key] = state_info
+        if self.journal is not None:
+            self.journal.append(key, state_info, processed)
+
+        # Update processed_prio if a new max has been reached
+        if state_info.score_prio > self.processed_prio:
+            self.processed_prio = state_info.score_prio
+
+        # Add child to unprocessed set if not already contained
+        child_key = (child, not key[1])
+        if not seen(child_key):
+            self.unprocessed[child_key] = StateInfo()
+            if self.journal is not None:
+                self.journal.append(child_key, self.unprocessed[child_key], False)
+
+    # Saves progress. With a journal, only the changes since the last autosave
+    # are written, and the journal is compacted once it grows too long.
+    # Otherwise the whole dataset is pickled. pending holds states which have
+    # been taken out of the unprocessed set but not processed yet.
+    def __autosave(self, directory: str, pending: Iterable[tuple[tuple[Board, bool], StateInfo]]=()):
+        if self.journal is None:
+            self.save(directory + f"/d{minimax.MAX_DEPTH}-autosave")
+            return
+
+        self.journal.flush()
+        if self.journal.records > JOURNAL_COMPACT_FACTOR * (len(self.valid) + len(self.unprocessed)):
+            self.journal.compact(self, pending)
+
     # Saves the dataset.
     def save(self, file_prefix: str):
         file_name = file_prefix + ".pickle"
@@ -98,3 +270,110 @@ class DataSet:
             os.replace(file_name, file_backup)
         # Save file
         pickle.dump(self, open(file_name, "wb"))
+
+    # Exports the valid states to a columnar dataset directory, which can be
+    # memory-mapped with columnar.ColumnarDataSet.
+    def save_columns(self, directory: str):
+        columnar.export(self, directory)
+
+# Append-only log of changes to a DataSet. Every record is the new score,
+# priority and set of one state, so replaying the records in order rebuilds
+# the dataset. Records are buffered in memory until flushed, and compacting
+# rewrites the log with one record per state.
+class Journal:
+    # Opens a journal, creating it if it doesn't exist. A record left partly
+    # written by a crash is discarded.
+    def __init__(self, path: str):
+        self.path = path
+        self.buffer = bytearray()
+        size = os.path.getsize(path) if os.path.isfile(path) else 0
+        if size % _RECORD.size:
+            os.truncate(path, size - size % _RECORD.size)
+        self.records = size // _RECORD.size
+
+    # Records a state's current info, and whether it's in the processed set
+    # rather than the unprocessed set.
+    def append(self, key: tuple[Board, bool], info: StateInfo, processed: bool):
+        self.buffer += _encode_record(key, info, _PROCESSED if processed else _UNPROCESSED)
+        self.records += 1
+
+    # Records the processed set becoming the unprocessed set.
+    def swap(self):
+        self.buffer += _RECORD.pack(b"", _SWAP, 0, 0)
+        self.records += 1
+
+    # Writes buffered records to disk.
+    def flush(self):
+        with open(self.path, "ab") as f:
+            f.write(self.buffer)
+            f.flush()
+            os.fsync(f.fileno())
+        self.buffer.clear()
+
+    # Rewrites the journal with one record per state of a dataset. pending
+    # holds states taken out of the unprocessed set but not yet processed,
+    # whose priorities have already been increased. They're recorded as
+    # unprocessed with their priorities restored.
+    def compact(self, dataset: "DataSet", pending: Iterable[tuple[tuple[Board, bool], StateInfo]]=()):
+        records = bytearray()
+        for key, info in dataset.processed.items():
+            records += _encode_record(key, info, _PROCESSED)
+        for key, info in dataset.unprocessed.items():
+            records += _encode_record(key, info, _UNPROCESSED)
+        for key, info in pending:
+            records += _encode_record(key, StateInfo(info.score, info.score_prio - 1), _UNPROCESSED)
+
+        # Replace the journal only once the new one is fully written
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(records)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self.buffer.clear()
+        self.records = len(records) // _RECORD.size
+
+    # Replays a journal into an empty dataset.
+    def replay(path: str, dataset: "DataSet"):
+        with open(path, "rb") as f:
+            data = f.read()
+        data = data[:len(data) - len(data) % _RECORD.size]
+
+        # Each board is decoded once, and its info shared between sets
+        keys = dict()
+        infos = dict()
+        for board, kind, score, score_prio in _RECORD.iter_unpack(data):
+            if kind == _SWAP:
+                dataset.unprocessed = dataset.processed
+                dataset.processed = IndexedSet()
+                continue
+
+            key = keys.get(board)
+            if key is None:
+                key = keys[board] = decode_board(board)
+                infos[key] = StateInfo()
+            info = infos[key]
+            info.score = None if score != score else score
+            info.score_prio = score_prio
+            if score_prio > 0:
+                dataset.valid[key] = info
+            dataset.processed_prio = max(dataset.processed_prio, score_prio)
+
+            dataset.processed.pop(key, None)
+            dataset.unprocessed.pop(key, None)
+            if kind == _PROCESSED:
+                dataset.processed[key] = info
+            else:
+                dataset.unprocessed[key] = info
+
+# Encodes a journal record
+def _encode_record(key: tuple[Board, bool], info: StateInfo, kind: int) -> bytes:
+    return _RECORD.pack(encode_board(key[0], key[1]), kind, \
+        float("nan") if info.score is None else info.score, info.score_prio)
+
+# Searches a state for training data in a worker process, returning its score,
+# the child to queue and the worker's process ID
+def _gen_state(board: Board, p1_turn: bool, score_prio: int) -> tuple[float, Board, int]:
+    score, child = minimax.negamax(board, minimax.MAX_DEPTH, float("-inf"), float("+inf"), \
+        p1_turn, True, score_prio)
+    return (score, child, os.getpid())
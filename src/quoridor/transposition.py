@@ -0,0 +1,154 @@
+# Transposition table for caching search results.
+#
+# Author: Julia Kaeppel
+import numpy as np
+from typing import Optional
+
+# Bound types. An exact value is the true negamax value of the position. A
+# lower bound comes from a beta cutoff, and an upper bound from a search where
+# no move raised alpha.
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# dtype of each column of the table. Every move fits in 16 bits.
+_DTYPES = {"keys": np.uint64, "values": np.float64, "moves": np.uint16, "depths": np.int8, \
+    "bounds": np.uint8, "ages": np.uint8}
+
+# Marks an entry without a best move
+NO_MOVE = np.iinfo(_DTYPES["moves"]).max
+
+# A bounded, hash-indexed table of search results. Positions are keyed by
+# Board.key, and each entry stores the depth searched, the bound type, the
+# value and the best move found.
+#
+# Entries live in buckets of two. The first slot of a bucket prefers deeper
+# searches, and is only overwritten by a search at least as deep, or by any
+# search once its entry is left over from an earlier call to new_search. The
+# second slot is always overwritten, so recent positions are never lost.
+class TranspositionTable:
+    # Bytes used per entry, across every column
+    ENTRY_SIZE = sum(np.dtype(dtype).itemsize for dtype in _DTYPES.values())
+
+    # Creates a table using at most max_bytes of memory.
+    def __init__(self, max_bytes: int=64 * 1024 * 1024):
+        # Round the capacity down to a power of two, holding at least one bucket
+        capacity = 2
+        while capacity * 2 * self.ENTRY_SIZE <= max_bytes:
+            capacity *= 2
+        self.capacity = capacity
+        self.mask = capacity - 2
+
+        self.keys = np.zeros(capacity, dtype=_DTYPES["keys"])
+        self.values = np.zeros(capacity, dtype=_DTYPES["values"])
+        self.moves = np.full(capacity, NO_MOVE, dtype=_DTYPES["moves"])
+        self.depths = np.full(capacity, -1, dtype=_DTYPES["depths"])
+        self.bounds = np.zeros(capacity, dtype=_DTYPES["bounds"])
+        self.ages = np.zeros(capacity, dtype=_DTYPES["ages"])
+        self.age = 0
+
+        # Usage counters
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    # Marks the start of a new search. Entries from earlier searches are kept,
+    # but may be overwritten by shallower ones.
+    def new_search(self):
+        self.age = (self.age + 1) & 0xff
+
+    # Looks up a position, returning its (depth, bound, value, move) entry, or
+    # None if the position isn't stored. move is None if no best move is known.
+    def probe(self, key: int) -> Optional[tuple[int, int, float, Optional[int]]]:
+        index = self.__find(key)
+        if index < 0:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        move = self.moves[index]
+        return (int(self.depths[index]), int(self.bounds[index]), float(self.values[index]), \
+            None if move == NO_MOVE else int(move))
+
+    # Returns the best move stored for a position, or None if it isn't stored or
+    # has no best move. Unlike probe, this isn't counted as a hit or miss, so
+    # looking up a move ordering hint doesn't skew the usage counters.
+    def best_move(self, key: int) -> Optional[int]:
+        index = self.__find(key)
+        if index < 0:
+            return None
+        move = self.moves[index]
+        return None if move == NO_MOVE else int(move)
+
+    # Returns the stored value of a position if it was searched to at least the
+    # given depth and its bound settles the (alpha, beta) window, or None
+    # otherwise.
+    def cutoff(self, key: int, depth: int, alpha: float, beta: float) -> Optional[float]:
+        entry = self.probe(key)
+        if entry is None:
+            return None
+
+        entry_depth, bound, value, _ = entry
+        if entry_depth < depth:
+            return None
+        if bound == EXACT or (bound == LOWER and value >= beta) or \
+            (bound == UPPER and value <= alpha):
+            return value
+        return None
+
+    # Stores the result of searching a position to a given depth.
+    def store(self, key: int, depth: int, bound: int, value: float, move: Optional[int]):
+        index = self.__find(key)
+        if index < 0:
+            # Prefer the depth-preferred slot, falling back to the
+            # always-replace slot
+            index = key & self.mask
+            if self.depths[index] >= 0 and self.ages[index] == self.age and \
+                self.depths[index] > depth:
+                index += 1
+            if self.depths[index] >= 0:
+                self.overwrites += 1
+        elif self.depths[index] > depth and self.ages[index] == self.age:
+            # Don't replace a deeper result from this search with a shallower one
+            return
+
+        self.stores += 1
+        self.keys[index] = key
+        self.values[index] = value
+        self.moves[index] = NO_MOVE if move is None else move
+        self.depths[index] = depth
+        self.bounds[index] = bound
+        self.ages[index] = self.age
+
+    # Empties the table and resets its counters.
+    def clear(self):
+        self.depths.fill(-1)
+        self.moves.fill(NO_MOVE)
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    # Returns the usage counters and the fraction of slots in use.
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "capacity": self.capacity,
+            "bytes": self.capacity * self.ENTRY_SIZE,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "overwrites": self.overwrites,
+            "fill": float(np.count_nonzero(self.depths >= 0)) / self.capacity,
+        }
+
+    # Returns the slot holding a key, or -1 if it isn't stored
+    def __find(self, key: int) -> int:
+        index = key & self.mask
+        if self.depths[index] >= 0 and self.keys[index] == key:
+            return index
+        if self.depths[index + 1] >= 0 and self.keys[index + 1] == key:
+            return index + 1
+        return -1
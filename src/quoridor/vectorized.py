@@ -0,0 +1,144 @@
+# Vectorized NumPy operations over stacks of wall configurations.
+#
+# Author: Julia Kaeppel
+import numpy as np
+from quoridor import Board, UNREACHABLE
+
+# Every single wall placement as a (2, 8, 8) walls array. Placement i is the
+# wall with alignment i // 64 in slot i % 64.
+_PLACEMENTS = np.eye(128, dtype=bool).reshape(128, 2, 8, 8)
+
+# Results of evaluating every wall placement on a board. Each array has shape
+# (2, 8, 8), indexed the same way as Board.walls.
+#
+# placeable: Whether the wall overlaps or crosses no existing wall.
+# valid: Whether the wall is placeable and leaves both pawns a path.
+# p1_dist, p2_dist: Shortest path lengths after placing the wall, or
+# UNREACHABLE. Entries for walls which aren't placeable are UNREACHABLE.
+class WallPlacements:
+    def __init__(self, placeable: np.ndarray, valid: np.ndarray, p1_dist: np.ndarray, \
+        p2_dist: np.ndarray):
+        self.placeable = placeable
+        self.valid = valid
+        self.p1_dist = p1_dist
+        self.p2_dist = p2_dist
+
+# Evaluates every wall placement on a board at once. Walls which don't cut a
+# pawn's current shortest path keep its current distance, and the rest are
+# searched together as a single stack, for both players at once.
+def wall_placements(board: Board) -> WallPlacements:
+    walls = board.walls
+    placeable = placeable_walls(walls[np.newaxis])[0].ravel()
+
+    # Find the placeable walls which cut each pawn's shortest path
+    p1_cut = placeable & _unpack_bits(*board.path_walls(True))
+    p2_cut = placeable & _unpack_bits(*board.path_walls(False))
+    p1_indices, p2_indices = np.flatnonzero(p1_cut), np.flatnonzero(p2_cut)
+    indices = np.concatenate([p1_indices, p2_indices])
+    count = len(p1_indices)
+
+    # Search every cut path together
+    (p1_x, p1_y), (p2_x, p2_y) = board.p1, board.p2
+    dist = path_lengths(walls | _PLACEMENTS[indices], \
+        np.where(np.arange(len(indices)) < count, 8, 0), \
+        np.where(np.arange(len(indices)) < count, p1_x, p2_x), \
+        np.where(np.arange(len(indices)) < count, p1_y, p2_y))
+
+    p1_dist = np.where(placeable, board.p1_dist, UNREACHABLE).astype(np.int16)
+    p2_dist = np.where(placeable, board.p2_dist, UNREACHABLE).astype(np.int16)
+    p1_dist[p1_indices] = dist[:count]
+    p2_dist[p2_indices] = dist[count:]
+
+    valid = placeable & (p1_dist != UNREACHABLE) & (p2_dist != UNREACHABLE)
+    return WallPlacements(placeable.reshape(2, 8, 8), valid.reshape(2, 8, 8), \
+        p1_dist.reshape(2, 8, 8), p2_dist.reshape(2, 8, 8))
+
+# Returns whether each wall slot is free of overlapping and crossing walls, for
+# a stack of walls arrays of shape (n, 2, 8, 8).
+def placeable_walls(walls: np.ndarray) -> np.ndarray:
+    h, v = walls[:, 0], walls[:, 1]
+
+    # Horizontal walls overlap horizontally adjacent horizontal walls, and
+    # vertical walls overlap vertically adjacent vertical walls
+    h_pad = np.pad(h, ((0, 0), (0, 0), (1, 1)))
+    v_pad = np.pad(v, ((0, 0), (1, 1), (0, 0)))
+    h_overlap = h_pad[:, :, :-2] | h_pad[:, :, 1:-1] | h_pad[:, :, 2:]
+    v_overlap = v_pad[:, :-2] | v_pad[:, 1:-1] | v_pad[:, 2:]
+
+    # Walls of either alignment in the same slot cross
+    crossed = h | v
+    return ~np.stack([h_overlap | crossed, v_overlap | crossed], axis=1)
+
+# Returns whether each edge is open, for a stack of walls arrays of shape
+# (n, 2, 8, 8). The first array has shape (n, 8, 9), and holds the edges
+# between (x, y) and (x, y + 1). The second has shape (n, 9, 8), and holds the
+# edges between (x, y) and (x + 1, y).
+def open_edges(walls: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    h_pad = np.pad(walls[:, 0], ((0, 0), (0, 0), (1, 1)))
+    v_pad = np.pad(walls[:, 1], ((0, 0), (1, 1), (0, 0)))
+    return ~(h_pad[:, :, :-1] | h_pad[:, :, 1:]), ~(v_pad[:, :-1] | v_pad[:, 1:])
+
+# Computes shortest path lengths for a stack of walls arrays of shape
+# (n, 2, 8, 8), each from its own cell to its own goal row. Pawns which are
+# walled off get UNREACHABLE.
+#
+# All boards are searched together, growing the set of cells reached from the
+# goal row by one breadth-first layer per iteration, until every pawn has been
+# reached or no board's reached set can grow.
+def path_lengths(walls: np.ndarray, goal_rows: np.ndarray, xs: np.ndarray, \
+    ys: np.ndarray) -> np.ndarray:
+    n = len(walls)
+    boards = np.arange(n)
+    vertical, horizontal = open_edges(walls)
+
+    reached = np.zeros((n, 9, 9), dtype=bool)
+    reached[boards, goal_rows] = True
+    dist = np.where(ys == goal_rows, 0, UNREACHABLE).astype(np.int16)
+
+    layer = 0
+    while True:
+        layer += 1
+        grown = reached.copy()
+        grown[:, :-1] |= reached[:, 1:] & vertical
+        grown[:, 1:] |= reached[:, :-1] & vertical
+        grown[:, :, :-1] |= reached[:, :, 1:] & horizontal
+        grown[:, :, 1:] |= reached[:, :, :-1] & horizontal
+
+        arrived = grown[boards, ys, xs]
+        dist[arrived & (dist == UNREACHABLE)] = layer
+        if arrived.all() or np.array_equal(grown, reached):
+            return dist
+        reached = grown
+
+# Computes full distance fields for a stack of walls arrays of shape
+# (n, 2, 8, 8), each towards its own goal row. The result has shape (n, 9, 9),
+# indexed by y and then x, with UNREACHABLE for cells that have no path.
+def distance_fields(walls: np.ndarray, goal_rows: np.ndarray) -> np.ndarray:
+    n = len(walls)
+    vertical, horizontal = open_edges(walls)
+
+    reached = np.zeros((n, 9, 9), dtype=bool)
+    reached[np.arange(n), goal_rows] = True
+    field = np.where(reached, 0, UNREACHABLE).astype(np.int16)
+
+    layer = 0
+    while True:
+        layer += 1
+        grown = reached.copy()
+        grown[:, :-1] |= reached[:, 1:] & vertical
+        grown[:, 1:] |= reached[:, :-1] & vertical
+        grown[:, :, :-1] |= reached[:, :, 1:] & horizontal
+        grown[:, :, 1:] |= reached[:, :, :-1] & horizontal
+
+        arrived = grown & ~reached
+        if not arrived.any():
+            return field
+        field[arrived] = layer
+        reached = grown
+
+# Unpacks horizontal and vertical bitboards into 128 bools, indexed by wall
+# placement
+def _unpack_bits(h_bits: int, v_bits: int) -> np.ndarray:
+    packed = np.frombuffer(h_bits.to_bytes(8, "little") + v_bits.to_bytes(8, "little"), \
+        dtype=np.uint8)
+    return np.unpackbits(packed, bitorder="little").astype(bool)
@@ -0,0 +1,7 @@
+# The bot's modules import each other by name, so tests run with src/quoridor
+# on the path, as the bots themselves do.
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", \
+    "quoridor"))
@@ -0,0 +1,44 @@
+# Regression tests for minimax search.
+import numpy as np
+import pytest
+import minimax
+from quoridor import Board
+
+# Player 1 is a step from their goal, and player 2 is far from theirs
+def _near_win() -> Board:
+    return Board(np.zeros((2, 8, 8), dtype=bool), (0, 7), (8, 8), 10, 10)
+
+# A terminal position is lost for the player to move, whichever player it is
+def test_terminal_lost_for_player_to_move():
+    won_by_p1 = Board(np.zeros((2, 8, 8), dtype=bool), (4, 8), (4, 4), 10, 10)
+    won_by_p2 = Board(np.zeros((2, 8, 8), dtype=bool), (4, 4), (4, 0), 10, 10)
+    assert minimax.negamax(won_by_p1, 2, float("-inf"), float("+inf"), False, False, 0)[0] \
+        == float("-inf")
+    assert minimax.negamax(won_by_p2, 2, float("-inf"), float("+inf"), True, False, 0)[0] \
+        == float("-inf")
+
+# Both players take a winning move when they have one
+def test_takes_winning_move():
+    for depth in (1, 2, 3):
+        score, move = minimax.negamax(_near_win(), depth, float("-inf"), float("+inf"), True, \
+            False, 0)
+        assert score == float("+inf")
+        assert move.p1 == (0, 8)
+
+        mirrored = Board(np.zeros((2, 8, 8), dtype=bool), (8, 0), (0, 1), 10, 10)
+        score, move = minimax.negamax(mirrored, depth, float("-inf"), float("+inf"), False, \
+            False, 0)
+        assert score == float("+inf")
+        assert move.p2 == (0, 0)
+
+# Iterative deepening always completes depth 1, however small the budget
+def test_iterative_deepening_completes_first_depth():
+    for move_time, max_nodes in ((0.0, None), (None, 1)):
+        result = minimax.iterative_deepening(Board(), True, move_time=move_time, \
+            max_nodes=max_nodes)
+        assert result.depth == 1
+        assert result.move is not None
+
+def test_iterative_deepening_rejects_zero_depth():
+    with pytest.raises(ValueError):
+        minimax.iterative_deepening(Board(), True, max_depth=0)
@@ -0,0 +1,192 @@
+# Regression tests for the bitboard Board: move generation against a
+# straightforward reference on the (2, 8, 8) walls array, apply and undo, and
+# incremental distance field repair.
+from collections import deque
+import random
+import numpy as np
+from quoridor import Board, _distance_field, _repair_field, _WALL_EDGES
+
+# Returns whether a wall blocks the step from (x, y) by (dx, dy). Horizontal
+# walls in row y lie between rows y and y + 1, and vertical walls in column x
+# between columns x and x + 1. Each wall covers two cells.
+def _blocked(walls: np.ndarray, x: int, y: int, dx: int, dy: int) -> bool:
+    if dy != 0:
+        row = y if dy > 0 else y - 1
+        return any(walls[0, row, wx] for wx in (x - 1, x) if 0 <= wx <= 7)
+    col = x if dx > 0 else x - 1
+    return any(walls[1, wy, col] for wy in (y - 1, y) if 0 <= wy <= 7)
+
+# Returns whether a pawn can step from (x, y) by (dx, dy)
+def _can_step(walls: np.ndarray, x: int, y: int, dx: int, dy: int) -> bool:
+    return 0 <= x + dx <= 8 and 0 <= y + dy <= 8 and not _blocked(walls, x, y, dx, dy)
+
+# Returns the length of the shortest path from a cell to a goal row, or None
+def _path_length(walls: np.ndarray, pos: tuple[int, int], goal_row: int) -> int:
+    seen = {pos: 0}
+    queue = deque([pos])
+    while queue:
+        x, y = queue.popleft()
+        if y == goal_row:
+            return seen[(x, y)]
+        for dx, dy in ((0, 1), (0, -1), (1, 0), (-1, 0)):
+            dest = (x + dx, y + dy)
+            if _can_step(walls, x, y, dx, dy) and dest not in seen:
+                seen[dest] = seen[(x, y)] + 1
+                queue.append(dest)
+    return None
+
+# Returns the cells the active pawn can move to, jumps included
+def _pawn_moves(walls: np.ndarray, ap: tuple[int, int], ip: tuple[int, int]) \
+    -> set[tuple[int, int]]:
+    moves = set()
+    for dx, dy in ((0, 1), (0, -1), (1, 0), (-1, 0)):
+        if not _can_step(walls, ap[0], ap[1], dx, dy):
+            continue
+        dest = (ap[0] + dx, ap[1] + dy)
+        if dest != ip:
+            moves.add(dest)
+        elif _can_step(walls, ip[0], ip[1], dx, dy):
+            moves.add((ip[0] + dx, ip[1] + dy))
+        else:
+            for sx, sy in ((dy, dx), (-dy, -dx)):
+                if _can_step(walls, ip[0], ip[1], sx, sy):
+                    moves.add((ip[0] + sx, ip[1] + sy))
+    return moves
+
+# Returns whether a wall can be placed without overlapping or crossing another
+def _placeable(walls: np.ndarray, alignment: int, x: int, y: int) -> bool:
+    if walls[1 - alignment, y, x]:
+        return False
+    if alignment == 0:
+        return not any(walls[0, y, wx] for wx in (x - 1, x, x + 1) if 0 <= wx <= 7)
+    return not any(walls[1, wy, x] for wy in (y - 1, y, y + 1) if 0 <= wy <= 7)
+
+# Returns every child of a state as (walls bytes, p1, p2, p1 walls, p2 walls,
+# p1 distance, p2 distance) tuples
+def _reference_children(state: Board, p1_turn: bool) -> set[tuple]:
+    walls = state.walls
+    p1, p2 = state.p1, state.p2
+    children = set()
+    for dest in _pawn_moves(walls, p1 if p1_turn else p2, p2 if p1_turn else p1):
+        c1, c2 = (dest, p2) if p1_turn else (p1, dest)
+        children.add((walls.tobytes(), c1, c2, state.p1_walls, state.p2_walls, \
+            _path_length(walls, c1, 8), _path_length(walls, c2, 0)))
+
+    if (state.p1_walls if p1_turn else state.p2_walls) == 0:
+        return children
+    for alignment in (0, 1):
+        for y in range(8):
+            for x in range(8):
+                if not _placeable(walls, alignment, x, y):
+                    continue
+                child = walls.copy()
+                child[alignment, y, x] = True
+                p1_dist, p2_dist = _path_length(child, p1, 8), _path_length(child, p2, 0)
+                if p1_dist is None or p2_dist is None:
+                    continue
+                children.add((child.tobytes(), p1, p2, state.p1_walls - p1_turn, \
+                    state.p2_walls - (not p1_turn), p1_dist, p2_dist))
+    return children
+
+# Returns the same tuples for Board's own children
+def _children(state: Board, p1_turn: bool) -> set[tuple]:
+    return {(child.walls.tobytes(), child.p1, child.p2, child.p1_walls, child.p2_walls, \
+        child.p1_dist, child.p2_dist) for child in state.adj_states(p1_turn)}
+
+# Plays random moves from the starting position, favoring walls so positions
+# are crowded with them, and returns every position reached
+def _random_positions(seed: int, games: int=6, plies: int=40) -> list[tuple[Board, bool]]:
+    rng = random.Random(seed)
+    positions = []
+    for _ in range(games):
+        state, p1_turn = Board(), True
+        for _ in range(plies):
+            positions.append((state, p1_turn))
+            children = state.adj_states(p1_turn)
+            walls = [child for child in children if child.p1 == state.p1 and child.p2 == state.p2]
+            state = rng.choice(walls if walls and rng.random() < 0.7 else children)
+            p1_turn = not p1_turn
+            if state.terminal():
+                break
+    return positions
+
+# Places the pawns next to each other, so jumps are generated
+def _adjacent_positions(seed: int, count: int=40) -> list[tuple[Board, bool]]:
+    rng = random.Random(seed)
+    walled = [state for state, _ in _random_positions(seed, 2, 30)]
+    positions = []
+    while len(positions) < count:
+        walls = rng.choice(walled).walls
+        p1 = (rng.randrange(9), rng.randrange(1, 8))
+        dx, dy = rng.choice(((0, 1), (0, -1), (1, 0), (-1, 0)))
+        p2 = (p1[0] + dx, p1[1] + dy)
+        if not (0 <= p2[0] <= 8 and 1 <= p2[1] <= 7):
+            continue
+        if _path_length(walls, p1, 8) is None or _path_length(walls, p2, 0) is None:
+            continue
+        positions.append((Board(walls, p1, p2, rng.randrange(3), rng.randrange(3)), \
+            rng.random() < 0.5))
+    return positions
+
+def test_adj_states_match_reference():
+    for state, p1_turn in _random_positions(1, 2) + _adjacent_positions(2):
+        assert _children(state, p1_turn) == _reference_children(state, p1_turn)
+
+# Every field apply and undo touch, compared through the public interface
+def _snapshot(state: Board) -> tuple:
+    return (state.h_walls, state.v_walls, state.p1, state.p2, state.p1_walls, \
+        state.p2_walls, state.p1_dist, state.p2_dist, state.hash, state.key(True), \
+        tuple(state.distance_field(True)), tuple(state.distance_field(False)), \
+        state.walls.tobytes())
+
+def test_apply_undo_restores_state():
+    for state, p1_turn in _random_positions(3, 3, 30):
+        before = _snapshot(state)
+        for move in state.moves(p1_turn):
+            child = state.child(move, p1_turn)
+            if not state.apply(move, p1_turn):
+                assert child is None
+                assert _snapshot(state) == before
+                continue
+
+            # The applied board matches a freshly built child
+            fresh = Board.from_bits(child.h_walls, child.v_walls, child.p1, child.p2, \
+                child.p1_walls, child.p2_walls, eager=True)
+            assert _snapshot(state) == _snapshot(fresh)
+            state.undo()
+            assert _snapshot(state) == before
+
+def test_apply_undo_sequence():
+    rng = random.Random(4)
+    for state, p1_turn in _random_positions(5, 2, 20):
+        before = _snapshot(state)
+        applied = 0
+        turn = p1_turn
+        for _ in range(12):
+            if state.terminal():
+                break
+            moves = list(state.moves(turn))
+            rng.shuffle(moves)
+            if any(state.apply(move, turn) for move in moves):
+                applied += 1
+                turn = not turn
+        for _ in range(applied):
+            state.undo()
+        assert _snapshot(state) == before
+
+def test_repair_field_matches_full_search():
+    for state, _ in _random_positions(6, 3, 30)[::3]:
+        h_walls, v_walls = state.h_walls, state.v_walls
+        for goal_row in (0, 8):
+            field = _distance_field(h_walls, v_walls, goal_row)
+            original = list(field)
+            for alignment in (0, 1):
+                for slot in range(64):
+                    bit = 1 << slot
+                    if (h_walls | v_walls) & bit:
+                        continue
+                    new_h = h_walls | bit if alignment == 0 else h_walls
+                    new_v = v_walls | bit if alignment == 1 else v_walls
+                    repaired = _repair_field(field, new_h, new_v, _WALL_EDGES[alignment][slot])
+                    assert repaired == _distance_field(new_h, new_v, goal_row)
+                    assert field == original
@@ -0,0 +1,125 @@
+# Tests for the 20-byte binary board format and length-prefixed frames.
+import io
+import pickle
+import random
+import pytest
+from quoridor import Board
+from serializable_board import BOARD_SIZE, SerializableBoard, decode_board, decode_boards, \
+    encode_board, encode_boards, read_frame, split_frame, write_frame, _decode, _encode
+
+# Plays random moves from the starting position, returning every position
+# reached and whose turn it is there
+def _positions(seed: int, plies: int=60) -> list[tuple[Board, bool]]:
+    rng = random.Random(seed)
+    state, p1_turn = Board(), True
+    positions = []
+    for _ in range(plies):
+        positions.append((state, p1_turn))
+        state, p1_turn = rng.choice(state.adj_states(p1_turn)), not p1_turn
+        if state.terminal():
+            break
+    return positions
+
+def _fields(state: Board, p1_turn: bool) -> tuple:
+    return (state.h_walls, state.v_walls, state.p1, state.p2, state.p1_walls, \
+        state.p2_walls, p1_turn)
+
+def test_encode_decode_round_trip():
+    for state, p1_turn in _positions(1):
+        data = encode_board(state, p1_turn)
+        assert len(data) == BOARD_SIZE
+        assert _fields(*decode_board(data)) == _fields(state, p1_turn)
+
+def test_encode_boards_round_trip():
+    positions = _positions(2)
+    data = encode_boards(positions)
+    assert len(data) == BOARD_SIZE * len(positions)
+    assert [_fields(*decoded) for decoded in decode_boards(data)] == \
+        [_fields(state, p1_turn) for state, p1_turn in positions]
+    assert data == b"".join(encode_board(state, p1_turn) for state, p1_turn in positions)
+
+def test_write_read_board_round_trip():
+    for state, p1_turn in _positions(3):
+        sb = SerializableBoard.from_board(state, p1_turn)
+        for pickled in (False, True):
+            read = SerializableBoard.read_board(sb.write_board(pickled), pickled)
+            assert (read.walls == state.walls).all()
+            assert (read.p1, read.p2, read.p1_walls, read.p2_walls, read.p1_turn) == \
+                (state.p1, state.p2, state.p1_walls, state.p2_walls, p1_turn)
+            assert read.to_board() == state
+
+def test_decode_rejects_bad_boards():
+    valid = _encode(0, 0, (4, 0), (4, 8), 10, 10, True)
+    _decode(valid)
+    with pytest.raises(ValueError):
+        _decode(valid[:-1])
+    with pytest.raises(ValueError):
+        _decode(valid, 1)
+
+    bad = [
+        _encode(0, 0, (4, 0), (4, 0), 10, 10, True),
+        _encode(0, 0, (4, 0), (4, 8), 11, 10, True),
+        _encode(0, 0, (4, 0), (4, 8), 10, 11, True),
+        valid[:16] + bytes([81]) + valid[17:],
+        valid[:17] + bytes([81]) + valid[18:],
+        valid[:19] + bytes([2]),
+    ]
+    for data in bad:
+        with pytest.raises(ValueError):
+            _decode(data)
+
+# Records that unpickling ran code
+_unpickled = []
+
+def _record():
+    _unpickled.append(True)
+    return SerializableBoard.from_board(Board(), True)
+
+class _Payload:
+    def __reduce__(self):
+        return (_record, ())
+
+def test_read_board_refuses_pickles():
+    data = pickle.dumps(_Payload())
+    with pytest.raises(ValueError):
+        SerializableBoard.read_board(data)
+    assert not _unpickled
+
+    # Only an explicit opt in unpickles
+    SerializableBoard.read_board(data, allow_pickle=True)
+    assert _unpickled
+
+def test_frames():
+    stream = io.BytesIO()
+    frames = [b"", encode_board(Board(), True), b"x" * 1000]
+    for frame in frames:
+        write_frame(stream, frame)
+
+    stream.seek(0)
+    assert [read_frame(stream) for _ in frames] == frames
+    assert read_frame(stream) is None
+
+    # Splitting a buffer gives the same frames, and waits for whole ones
+    data = stream.getvalue()
+    for frame in frames:
+        assert split_frame(data[:len(frame) + 3]) is None
+        split, data = split_frame(data)
+        assert split == frame
+    assert split_frame(data) is None
+
+def test_truncated_frames():
+    stream = io.BytesIO()
+    write_frame(stream, encode_board(Board(), True))
+    data = stream.getvalue()
+    for end in (2, 4, len(data) - 1):
+        with pytest.raises(EOFError):
+            read_frame(io.BytesIO(data[:end]))
+
+def test_board_frames():
+    stream = io.BytesIO()
+    sb = SerializableBoard.from_board(Board(), False)
+    sb.write_frame(stream)
+    stream.seek(0)
+    read = SerializableBoard.read_frame(stream)
+    assert read.to_board() == Board() and not read.p1_turn
+    assert SerializableBoard.read_frame(stream) is None
@@ -0,0 +1,76 @@
+# Tests for DataSet journals: replaying a journal must rebuild the live dataset
+# it was written from.
+import os
+import numpy as np
+from indexed_set import IndexedSet
+from quoridor import Board
+import training_data
+from training_data import DataSet, Journal, StateInfo, _RECORD, _SWAP
+
+# Starts a dataset a few moves from the end of a game. Its chain of children
+# soon reaches a finished game, so the unprocessed set empties and the sets are
+# swapped during generation.
+def _near_end_dataset(path: str) -> DataSet:
+    dataset = DataSet()
+    dataset.unprocessed = IndexedSet()
+    dataset.unprocessed[(Board(None, (4, 5), (4, 3), 2, 2), True)] = StateInfo()
+    dataset.open_journal(path)
+    return dataset
+
+# Returns the contents of a dataset's sets. Journals store scores as float32.
+def _contents(dataset: DataSet) -> tuple:
+    sets = tuple({key: (None if info.score is None else float(np.float32(info.score)), \
+        info.score_prio) for key, info in indexed.items()} \
+        for indexed in (dataset.valid, dataset.processed, dataset.unprocessed))
+    return sets + (dataset.processed_prio,)
+
+def _kinds(path: str) -> list[int]:
+    with open(path, "rb") as f:
+        return [kind for _, kind, _, _ in _RECORD.iter_unpack(f.read())]
+
+def test_replay_after_appends_and_swaps(tmp_path):
+    path = str(tmp_path / "journal")
+    dataset = _near_end_dataset(path)
+    dataset.gen_states(30, str(tmp_path), autosave_interval=0)
+
+    assert _SWAP in _kinds(path)
+    assert _contents(DataSet.from_journal(path)) == _contents(dataset)
+
+def test_replay_after_compaction(tmp_path, monkeypatch):
+    # Compact at every autosave
+    monkeypatch.setattr(training_data, "JOURNAL_COMPACT_FACTOR", 1)
+    path = str(tmp_path / "journal")
+    dataset = _near_end_dataset(path)
+    dataset.gen_states(20, str(tmp_path), autosave_interval=0)
+    assert _contents(DataSet.from_journal(path)) == _contents(dataset)
+
+    # A compacted journal holds one record per state, and can be appended to
+    dataset.journal.compact(dataset)
+    assert len(_kinds(path)) == len(dataset.processed) + len(dataset.unprocessed)
+    assert _contents(DataSet.from_journal(path)) == _contents(dataset)
+    dataset.gen_states(30, str(tmp_path), autosave_interval=0)
+    assert _contents(DataSet.from_journal(path)) == _contents(dataset)
+
+# A record left partly written by a crash is dropped, and appending resumes
+# after the last whole record
+def test_truncated_record_is_dropped(tmp_path):
+    path = str(tmp_path / "journal")
+    dataset = _near_end_dataset(path)
+    dataset.gen_states(15, str(tmp_path), autosave_interval=0)
+    expected = _contents(dataset)
+    size = os.path.getsize(path)
+    with open(path, "ab") as f:
+        f.write(_encode_partial())
+
+    loaded = DataSet.from_journal(path)
+    assert _contents(loaded) == expected
+    assert os.path.getsize(path) == size
+    assert Journal(path).records == size // _RECORD.size
+
+    loaded.gen_states(25, str(tmp_path), autosave_interval=0)
+    assert _contents(DataSet.from_journal(path)) == _contents(loaded)
+
+# Returns the first half of a record
+def _encode_partial() -> bytes:
+    record = training_data._encode_record((Board(), True), StateInfo(1.0, 1), 1)
+    return record[:_RECORD.size // 2]